@@ -0,0 +1,99 @@
+"""
+Deterministic stand-in for the OpenAI client, used by the offline benchmarks.
+
+Responses are picked by prompt kind (intent, schema, patch, summary, script), told apart by
+the requested response model, and can be fixed strings, callables taking the prompt, or lists
+replayed in order. Latency is simulated per call, token usage goes to an in-memory store.
+"""
+import asyncio
+import json
+import random
+import time
+from typing import Callable
+
+from pydantic import BaseModel
+
+from models import DbSchema, IntentResult, SchemaAnswer, SchemaPatch
+from services.llm_service import LLMClient
+from services.metrics import span, record_llm_usage
+from services.token_ledger import InMemoryTokenStore
+
+INTENT_YES = json.dumps({"was_related": "yes", "answer": ""})
+
+
+def prompt_kind(user_prompt: str, response_model: type[BaseModel] = None) -> str:
+    if response_model is IntentResult:
+        return "intent"
+    if response_model is SchemaPatch:
+        return "patch"
+    if response_model is SchemaAnswer:
+        return "schema"
+    if "DATABASE_DRAFT" in user_prompt:
+        return "script"
+    return "summary"
+
+
+def schema_response(schema: DbSchema) -> str:
+    return json.dumps({"schema": schema.model_dump()})
+
+
+class FakeLLMClient(LLMClient):
+
+    def __init__(
+        self,
+        responses: dict[str, str | Callable[[str], str] | list[str]] = None,
+        latency: float | dict[str, float] = 0.0,
+        jitter: float = 0.0,
+        token_limit: int = 10 ** 12,
+        seed: int = 42
+    ):
+        super().__init__(url="fake://llm", model="fake", token_limit=token_limit, token_store=InMemoryTokenStore())
+        self.responses = {"intent": INTENT_YES, "summary": "Done.", **(responses or {})}
+        self.latency = latency
+        self.jitter = jitter
+        self.calls: list[tuple[str, str]] = []
+        self._random = random.Random(seed)
+
+    def send_prompt(self, user_prompt: str, system_prompt: str, temperature: float = 0,
+                    response_model: type[BaseModel] = None) -> str:
+        kind, estimated_tokens = self._start_call(user_prompt, system_prompt, response_model)
+        self._check_and_update_token_usage(estimated_tokens)
+        with span("llm_call"):
+            time.sleep(self._delay(kind))
+        return self._finish_call(kind, user_prompt, estimated_tokens)
+
+    async def send_prompt_async(self, user_prompt: str, system_prompt: str, temperature: float = 0,
+                                response_model: type[BaseModel] = None) -> str:
+        kind, estimated_tokens = self._start_call(user_prompt, system_prompt, response_model)
+        await self._check_and_update_token_usage_async(estimated_tokens)
+        with span("llm_call"):
+            await asyncio.sleep(self._delay(kind))
+        return self._finish_call(kind, user_prompt, estimated_tokens)
+
+    def _estimate_tokens(self, *texts: str) -> int:
+        # Offline, the tiktoken encoding may not be downloadable
+        return sum(len(text) for text in texts) // 4
+
+    def _start_call(self, user_prompt: str, system_prompt: str,
+                    response_model: type[BaseModel] = None) -> tuple[str, int]:
+        kind = prompt_kind(user_prompt, response_model)
+        self.calls.append((kind, user_prompt))
+        return kind, self._estimate_tokens(system_prompt, user_prompt)
+
+    def _finish_call(self, kind: str, user_prompt: str, estimated_tokens: int) -> str:
+        response = self.responses.get(kind)
+        if response is None:
+            raise KeyError(f"No fake response for {kind} prompts")
+        if isinstance(response, list):
+            response = response.pop(0)
+        if callable(response):
+            response = response(user_prompt)
+
+        completion_tokens = self._estimate_tokens(response)
+        self.token_ledger.settle(estimated_tokens, estimated_tokens + completion_tokens)
+        record_llm_usage(estimated_tokens, completion_tokens)
+        return response
+
+    def _delay(self, kind: str) -> float:
+        latency = self.latency.get(kind, 0.0) if isinstance(self.latency, dict) else self.latency
+        return max(0.0, latency + self._random.uniform(-self.jitter, self.jitter))
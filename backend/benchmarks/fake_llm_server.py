@@ -0,0 +1,118 @@
+"""
+Local HTTP server speaking the OpenAI chat completions API (at url) and the Ollama chat API
+(at ollama_url), for exercising the LLM transport and clients.
+
+Answers are scripted as (status, content, delay) steps replayed in order; once the plan is
+empty every request gets `default`. Streaming requests get server-sent events from the OpenAI
+API and newline delimited JSON from the Ollama API.
+
+    with FakeLLMServer() as server:
+        server.plan = [(503, "", 0), (200, "hello", 0.1)]
+        client = OpenAiClient(api_key="fake", model="fake", token_limit=10 ** 9,
+                              token_store=InMemoryTokenStore(), url=server.url)
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+USAGE = {"prompt_tokens": 80, "completion_tokens": 20, "total_tokens": 100,
+         "prompt_tokens_details": {"cached_tokens": 64}}
+# Durations in nanoseconds
+OLLAMA_STATS = {"done": True, "prompt_eval_count": 80, "eval_count": 20, "load_duration": 2_000_000,
+                "prompt_eval_duration": 40_000_000, "eval_duration": 400_000_000}
+
+
+class FakeLLMServer:
+
+    def __init__(self, default: tuple[int, str, float] = (200, "{}", 0.0)):
+        self.plan: list[tuple[int, str, float]] = []
+        self.default = default
+        self.requests: list[dict] = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/v1/chat/completions"
+        self.ollama_url = f"http://127.0.0.1:{self._server.server_address[1]}/api/chat"
+
+    def __enter__(self) -> "FakeLLMServer":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def next_step(self, body: dict) -> tuple[int, str, float]:
+        with self._lock:
+            self.requests.append(body)
+            return self.plan.pop(0) if self.plan else self.default
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                status, content, delay = server.next_step(body)
+                time.sleep(delay)
+                try:
+                    if status == 200 and self.path == "/api/chat":
+                        self._ollama(content, body.get("stream", True))
+                    elif status == 200 and body.get("stream"):
+                        self._stream(content)
+                    elif status == 200:
+                        self._send(200, {"choices": [{"message": {"content": content}}], "usage": USAGE})
+                    else:
+                        self._send(status, {"error": {"message": content or "fake error"}})
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up (timeout or a hedged request that lost)
+                    pass
+
+            def _send(self, status: int, data: dict):
+                payload = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                if status == 429:
+                    self.send_header("Retry-After", "0.1")
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, content: str):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for start in range(0, len(content), 40):
+                    chunk = {"choices": [{"delta": {"content": content[start:start + 40]}}]}
+                    self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+                self._write_chunk(f"data: {json.dumps({'choices': [], 'usage': USAGE})}\n\ndata: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _ollama(self, content: str, stream: bool):
+                if not stream:
+                    self._send(200, {"message": {"role": "assistant", "content": content}, **OLLAMA_STATS})
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for start in range(0, len(content), 40):
+                    chunk = {"message": {"role": "assistant", "content": content[start:start + 40]}, "done": False}
+                    self._write_chunk(json.dumps(chunk) + "\n")
+                self._write_chunk(json.dumps({"message": {"role": "assistant", "content": ""}, **OLLAMA_STATS}) + "\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _write_chunk(self, text: str):
+                data = text.encode()
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
@@ -0,0 +1,63 @@
+"""
+Accuracy of the local intent classifier on the labeled corpus in data/intent_corpus.jsonl.
+
+Messages the classifier leaves to the LLM count against recall but not against precision. Run from the backend directory: python -m benchmarks.intent_classifier [threshold]
+"""
+import json
+import os
+import sys
+
+from models import DbSchema, Table, Column
+from services.intent_classifier import IntentClassifier
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "intent_corpus.jsonl")
+
+
+def load_corpus(path: str = CORPUS_PATH) -> list[dict]:
+    with open(path) as corpus:
+        return [json.loads(line) for line in corpus if line.strip()]
+
+
+def schema_with_tables(names: list[str]) -> DbSchema | None:
+    if not names:
+        return None
+    return DbSchema(
+        tables=[Table(table_id=f"t{index}", name=name, columns=[Column(name="id", type="int")])
+                for index, name in enumerate(names)],
+        relations=[]
+    )
+
+
+def main():
+    threshold = float(sys.argv[1]) if len(sys.argv) > 1 else 0.8
+    classifier = IntentClassifier(threshold=threshold)
+    corpus = load_corpus()
+
+    counts = {label: {"tp": 0, "fp": 0, "fn": 0} for label in ("yes", "no")}
+    decided = 0
+    for example in corpus:
+        result = classifier.classify(
+            [{"role": "user", "content": example["message"]}], schema_with_tables(example["tables"])
+        )
+        if result is None:
+            counts[example["label"]]["fn"] += 1
+            continue
+        decided += 1
+        predicted = json.loads(result)["was_related"]
+        if predicted == example["label"]:
+            counts[predicted]["tp"] += 1
+        else:
+            counts[predicted]["fp"] += 1
+            counts[example["label"]]["fn"] += 1
+            print(f"wrong: {example['message']!r} labeled {example['label']}, classified {predicted}")
+
+    print(f"threshold {threshold}, {len(corpus)} messages")
+    for label, count in counts.items():
+        precision = count["tp"] / max(count["tp"] + count["fp"], 1)
+        recall = count["tp"] / max(count["tp"] + count["fn"], 1)
+        print(f"  was_related={label:>3}: precision {precision:6.1%}  recall {recall:6.1%}")
+    print(f"  LLM intent calls avoided: {decided}/{len(corpus)} ({decided / len(corpus):.1%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Offline load benchmark of /generate/schema and /generate/dbsql.
+
+Requests go through FastAPI's TestClient with the services wired to FakeLLMClient, so no
+OpenAI tokens or DynamoDB calls are spent. With the default zero LLM latency the numbers
+show the overhead of our own code: prompt building, parsing, mapping, dedup and sqlglot.
+
+Run from the backend directory: python -m benchmarks.load [--requests N] [--latency S]
+"""
+import argparse
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Per-request logs would dominate the measurements
+os.environ.setdefault("LOG_LEVEL", "warning")
+
+from fastapi.testclient import TestClient
+
+import main
+from benchmarks.fake_llm import FakeLLMClient, schema_response
+from benchmarks.schemas import generate_schema
+from models import Table, Column
+from services.admission import AdmissionController
+from services.database_service import DatabaseService
+from services.ddl_compiler import DDLCompiler
+from services.metrics import metrics
+from services.script_service import SQLScriptService
+
+SIZES = (10, 100, 500)
+CONCURRENCY = (1, 8)
+STAGE_SPANS = ("json_parse", "mapping", "ddl_compile", "sqlglot_parse")
+
+
+def scenarios(size: int) -> list[tuple[str, str, dict, dict]]:
+    """
+    (name, path, request body, fake responses) per endpoint variant.
+    """
+    schema = generate_schema(size)
+    updated = schema.model_copy(deep=True)
+    updated.tables.append(Table(table_id="benchmark-new-table", name="audit_logs", columns=[
+        Column(name="id", type="int"), Column(name="action", type="varchar")
+    ]))
+    current_db = schema.model_dump()
+
+    return [
+        ("schema", "/generate/schema", {
+            "messages": [{"role": "user", "content": "add an audit_logs table"}],
+            "currentDb": current_db,
+            "dialect": "postgres",
+        }, {"schema": schema_response(updated)}),
+        ("dbsql", "/generate/dbsql", {"currentDb": current_db, "dialect": "postgres"}, {}),
+        ("dbsql llm", "/generate/dbsql", {"currentDb": current_db, "dialect": "postgres", "useLlm": True},
+         {"script": DDLCompiler.to_sql(schema, "postgres")}),
+    ]
+
+
+def run(client: TestClient, path: str, body: dict, requests: int, concurrency: int) -> tuple[float, list[float]]:
+    def one_request(_):
+        start = time.perf_counter()
+        response = client.post(path, json=body)
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(one_request, range(requests)))
+    return time.perf_counter() - start, latencies
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=32, help="requests per scenario")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated LLM latency in seconds")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=CONCURRENCY)
+    args = parser.parse_args()
+
+    print(f"{'scenario':<10} {'tables':>6} {'conc':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  "
+          + " ".join(f"{name:>13}" for name in STAGE_SPANS))
+
+    for size in args.sizes:
+        for name, path, body, responses in scenarios(size):
+            for concurrency in args.concurrency:
+                llm = FakeLLMClient(responses=responses, latency=args.latency)
+                main.app.dependency_overrides[main.get_database_service] = lambda: DatabaseService(llm)
+                main.app.dependency_overrides[main.get_script_service] = lambda: SQLScriptService(llm)
+                # All requests come from one client, only the concurrency limits apply
+                admission = AdmissionController(max_concurrent=main.MAX_CONCURRENT_REQUESTS,
+                                                max_queue=main.MAX_QUEUED_REQUESTS)
+                main.app.dependency_overrides[main.get_admission_controller] = lambda: admission
+                metrics.reset()
+
+                with TestClient(main.app) as client:
+                    run(client, path, body, min(args.requests, 4), 1)  # warm up
+                    metrics.reset()
+                    elapsed, latencies = run(client, path, body, args.requests, concurrency)
+                llm.close()
+
+                percentiles = statistics.quantiles(latencies, n=100)
+                spans = metrics.totals("chat2db_span_seconds", "span")
+                stage_ms = []
+                for span_name in STAGE_SPANS:
+                    total, count = spans.get(span_name, (0.0, 0))
+                    stage_ms.append(f"{total / count * 1000:13.2f}" if count else f"{'-':>13}")
+                print(f"{name:<10} {size:>6} {concurrency:>5} {len(latencies) / elapsed:>8.1f} "
+                      f"{percentiles[49] * 1000:>8.1f} {percentiles[94] * 1000:>8.1f} {percentiles[98] * 1000:>8.1f}  "
+                      + " ".join(stage_ms))
+
+    main.app.dependency_overrides.clear()
+    print("stage columns: mean ms per call")
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,96 @@
+"""
+Checks that prompts of the same kind start with a byte-identical prefix, which is what the
+provider's prompt cache matches on, and reports how long the shared prefixes are.
+Exits with status 1 when a prompt builder puts request data into its static prefix.
+
+OpenAI caches prompts from 1024 tokens on, in 128 token steps. The system prompt and the
+start of the user message both count.
+
+Run from the backend directory: python -m benchmarks.prompt_prefix
+"""
+import os
+import sys
+
+from benchmarks.schema_encoding import token_counter
+from benchmarks.schemas import generate_schema
+from prompts.database_prompts import (
+    DatabasePrompts, SCHEMA_RULES, FULL_SCHEMA_TASK, SCHEMA_PATCH_TASK, INTENT_RULES, SUMMARY_RULES
+)
+from prompts.script_prompts import ScriptPrompts, SCRIPT_RULES
+from services.database_service import SYSTEM_PROMPT
+from services.schema_codec import SchemaCodec
+
+FIRST_TURN = [{"role": "user", "content": "Create a shop with customers, orders and products"}]
+NEXT_TURN = FIRST_TURN + [
+    {"role": "assistant", "content": "I have created tables customers, orders and products."},
+    {"role": "user", "content": "Add reviews for products"},
+]
+OTHER_CHAT = [{"role": "user", "content": "I need a library database"}]
+
+
+def common_prefix(*texts: str) -> str:
+    return os.path.commonprefix(list(texts))
+
+
+def main():
+    count_tokens, tokenizer = token_counter()
+    small, large = SchemaCodec.encode(generate_schema(5)), SchemaCodec.encode(generate_schema(40))
+
+    # (name, static part, prompts for different requests)
+    cases = [
+        ("schema", SCHEMA_RULES + FULL_SCHEMA_TASK, [
+            DatabasePrompts.generate_sql_schema(FIRST_TURN, "postgresql"),
+            DatabasePrompts.generate_sql_schema(OTHER_CHAT, "mysql", large),
+        ]),
+        ("schema patch", SCHEMA_RULES + SCHEMA_PATCH_TASK, [
+            DatabasePrompts.generate_schema_patch(FIRST_TURN, "postgresql", small),
+            DatabasePrompts.generate_schema_patch(OTHER_CHAT, "sqlite", large),
+        ]),
+        ("schema and patch", SCHEMA_RULES, [
+            DatabasePrompts.generate_sql_schema(FIRST_TURN, "postgresql", small),
+            DatabasePrompts.generate_schema_patch(FIRST_TURN, "postgresql", small),
+        ]),
+        ("intent", INTENT_RULES, [
+            DatabasePrompts.check_if_generate_schema(FIRST_TURN),
+            DatabasePrompts.check_if_generate_schema(OTHER_CHAT),
+        ]),
+        ("summary", SUMMARY_RULES, [
+            DatabasePrompts.get_user_answer_template(None, small, FIRST_TURN),
+            DatabasePrompts.get_user_answer_template(small, large, OTHER_CHAT),
+        ]),
+        ("script", SCRIPT_RULES, [
+            ScriptPrompts.generate_sql_schema_script_template(small, "postgresql"),
+            ScriptPrompts.generate_sql_schema_script_template(large, "tsql"),
+        ]),
+    ]
+
+    failures = []
+    print(f"tokenizer: {tokenizer}, system prompt: {count_tokens(SYSTEM_PROMPT)} tokens")
+    print(f"{'prompts':<18} {'static tokens':>14} {'shared tokens':>14}")
+    for name, static, prompts in cases:
+        prefix = common_prefix(*prompts)
+        if not all(prompt.startswith(static) for prompt in prompts):
+            failures.append(f"{name}: prompt does not start with its static instructions")
+        print(f"{name:<18} {count_tokens(static):>14} {count_tokens(prefix):>14}")
+
+    # The next turn of a chat shares the history up to the new messages
+    first = DatabasePrompts.generate_schema_patch(FIRST_TURN, "postgresql", small)
+    following = DatabasePrompts.generate_schema_patch(NEXT_TURN, "postgresql", large)
+    shared = common_prefix(first, following)
+    if FIRST_TURN[0]["content"] not in shared:
+        failures.append("next turn: the conversation history is not part of the shared prefix")
+    print(f"{'next chat turn':<18} {'':>14} {count_tokens(shared):>14}")
+
+    # A re-ask repeats the failed prompt, all of it can come from the cache
+    full = DatabasePrompts.generate_sql_schema(FIRST_TURN, "postgresql", small)
+    if not DatabasePrompts.fix_invalid_schema(full, "invalid JSON").startswith(full):
+        failures.append("re-ask: does not start with the failed prompt")
+    print(f"{'re-ask':<18} {'':>14} {count_tokens(full):>14}")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Token usage of the prompt schema encodings.
+
+Run from the backend directory: python -m benchmarks.schema_encoding
+"""
+import time
+
+from benchmarks.schemas import generate_schema
+from services.schema_codec import SchemaCodec
+
+SIZES = (10, 100, 500)
+
+
+def token_counter():
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("o200k_base")
+        return lambda text: len(encoding.encode(text)), "o200k_base"
+    except Exception as e:
+        print(f"tiktoken encoding unavailable ({e}), falling back to chars / 4")
+        return lambda text: len(text) // 4, "chars/4"
+
+
+def main():
+    count_tokens, tokenizer = token_counter()
+    print(f"tokenizer: {tokenizer}")
+    print(f"{'tables':>7} {'json':>9} {'json indent':>12} {'repr':>9} {'compact':>9} {'saved':>7} {'encode ms':>10} {'decode ms':>10}")
+
+    for size in SIZES:
+        schema = generate_schema(size)
+
+        started = time.perf_counter()
+        compact = SchemaCodec.encode(schema)
+        encode_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        decoded = SchemaCodec.decode(compact, SchemaCodec.aliases_for(schema))
+        decode_ms = (time.perf_counter() - started) * 1000
+        assert decoded == schema, "compact encoding is not lossless"
+
+        json_tokens = count_tokens(schema.model_dump_json())
+        indent_tokens = count_tokens(schema.model_dump_json(indent=2))
+        repr_tokens = count_tokens(repr(schema))
+        compact_tokens = count_tokens(compact)
+        saved = 1 - compact_tokens / json_tokens
+
+        print(f"{size:>7} {json_tokens:>9} {indent_tokens:>12} {repr_tokens:>9} {compact_tokens:>9} "
+              f"{saved:>6.0%} {encode_ms:>10.2f} {decode_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Prompt size with the full schema vs the relevant subgraph.
+
+Run from the backend directory: python -m benchmarks.schema_subgraph
+"""
+from benchmarks.schema_encoding import token_counter
+from benchmarks.schemas import generate_schema
+from services.database_service import DatabaseService
+from services.schema_subgraph import SchemaSubgraph
+
+SIZES = (50, 100, 500)
+MESSAGES = (
+    "add a tracking_number column to shipments",
+    "rename the title column of tickets to subject",
+    "customers should have many addresses",
+    "remove the coupons table",
+)
+
+
+def main():
+    count_tokens, tokenizer = token_counter()
+    selector = SchemaSubgraph()
+    print(f"tokenizer: {tokenizer}")
+    print(f"{'tables':>7} {'full':>9} {'subgraph':>9} {'tables sent':>12} {'saved':>7}  message")
+
+    for size in SIZES:
+        schema = generate_schema(size)
+        for message in MESSAGES:
+            messages = [{"role": "user", "content": message}]
+            subgraph = selector.select(schema, messages)
+            full_tokens = count_tokens(DatabaseService._build_full_schema_prompt(messages, "postgres", schema))
+            subgraph_tokens = count_tokens(
+                DatabaseService._build_full_schema_prompt(messages, "postgres", subgraph or schema)
+            )
+            sent = len(subgraph.tables) if subgraph else size
+            print(f"{size:>7} {full_tokens:>9} {subgraph_tokens:>9} {sent:>12} "
+                  f"{1 - subgraph_tokens / full_tokens:>7.0%}  {message}")
+
+
+if __name__ == "__main__":
+    main()
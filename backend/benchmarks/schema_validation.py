@@ -0,0 +1,93 @@
+"""
+Mapping and validation of large LLM schema answers: json.loads and per-object model
+construction (the previous mapping) vs SchemaValidator, which validates the JSON text in
+one TypeAdapter call and checks it over id and name indexes.
+
+Run from the backend directory: python -m benchmarks.schema_validation [runs]
+"""
+import json
+import statistics
+import sys
+import time
+
+from benchmarks.schemas import generate_schema
+from models import DbSchema, Table, Column, Relation
+from services.schema_validator import SchemaValidator, SchemaValidationError
+
+RUNS = 5
+# (tables, columns per table)
+SIZES = ((100, 10), (1000, 20), (2000, 20))
+
+
+def legacy_map(raw_response: str) -> DbSchema:
+    raw_schema = json.loads(raw_response)["schema"]
+    tables = [Table(
+        table_id=table.get("table_id"),
+        name=table.get("name"),
+        columns=[Column(**col) for col in table.get("columns", [])]
+    ) for table in raw_schema["tables"]]
+
+    seen = set()
+    relations = []
+    for rel in raw_schema["relations"]:
+        if rel["type"] == "many-to-many":
+            key = tuple(sorted([rel["from_table"], rel["to_table"]]))
+            if key in seen:
+                continue
+            seen.add(key)
+        relations.append(Relation(**rel))
+    return DbSchema(tables=tables, relations=relations)
+
+
+def raw_schema(table_count: int, columns_per_table: int) -> dict:
+    schema = generate_schema(table_count).model_dump()
+    for table in schema["tables"]:
+        for index in range(len(table["columns"]), columns_per_table):
+            table["columns"].append({"name": f"attribute_{index}", "type": "varchar"})
+    return schema
+
+
+def broken(schema: dict) -> dict:
+    schema["tables"][1]["table_id"] = schema["tables"][0]["table_id"]
+    schema["tables"][2]["columns"].append(dict(schema["tables"][2]["columns"][0]))
+    schema["relations"].append({**schema["relations"][0], "to_table": "missing", "to_table_id": "missing"})
+    return schema
+
+
+def measure(function, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else RUNS
+    print(f"{'tables':>7} {'columns':>8} {'relations':>9} {'legacy ms':>10} {'validator ms':>13} "
+          f"{'checks only':>12} {'speedup':>8}")
+
+    for table_count, columns_per_table in SIZES:
+        schema = raw_schema(table_count, columns_per_table)
+        response = json.dumps({"schema": schema})
+        columns = sum(len(table["columns"]) for table in schema["tables"])
+        mapped, _ = SchemaValidator.parse(response)
+
+        legacy_ms = measure(lambda: legacy_map(response), runs)
+        validator_ms = measure(lambda: SchemaValidator.parse(response), runs)
+        validate_ms = measure(lambda: SchemaValidator.validate(mapped), runs)
+        print(f"{table_count:>7} {columns:>8} {len(schema['relations']):>9} {legacy_ms:>10.1f} "
+              f"{validator_ms:>13.1f} {validate_ms:>12.1f} {legacy_ms / validator_ms:>7.1f}x")
+
+    schema = broken(raw_schema(1000, 20))
+    try:
+        SchemaValidator.parse(json.dumps({"schema": schema}))
+    except SchemaValidationError as e:
+        print(f"\nbroken 1000 table schema: {len(e.issues)} issues")
+        for issue in e.issues:
+            print(f"  {issue.level:<8} {issue.code:<20} {issue.message}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import random
+import uuid
+
+from models import DbSchema, Table, Column, Relation
+
+ENTITIES = [
+    "user", "customer", "order", "product", "category", "invoice", "payment", "shipment", "address",
+    "supplier", "warehouse", "inventory", "review", "coupon", "cart", "employee", "department", "project",
+    "task", "comment", "tag", "session", "subscription", "plan", "notification", "message", "account",
+    "transaction", "ledger", "branch", "vehicle", "driver", "route", "ticket", "event", "venue", "booking",
+]
+ATTRIBUTES = [
+    ("name", "varchar"), ("title", "varchar"), ("description", "text"), ("email", "varchar"),
+    ("phone", "varchar"), ("status", "varchar"), ("amount", "decimal"), ("price", "decimal"),
+    ("quantity", "int"), ("is_active", "bool"), ("created_at", "timestamp"), ("updated_at", "timestamp"),
+    ("due_date", "date"), ("metadata", "json"), ("external_id", "uuid"), ("score", "float"),
+    ("position", "smallint"), ("views", "bigint"), ("attachment", "blob"), ("notes", "text"),
+]
+
+
+def generate_schema(table_count: int, seed: int = 42) -> DbSchema:
+    """
+    Realistic looking schema: 4-12 columns per table, most tables reference an earlier table
+    with a foreign key column and roughly one in ten relations is many-to-many.
+    """
+    rng = random.Random(seed)
+    tables: list[Table] = []
+    relations: list[Relation] = []
+
+    for index in range(table_count):
+        entity = ENTITIES[index % len(ENTITIES)]
+        name = f"{entity}s" if index < len(ENTITIES) else f"{entity}s_{index // len(ENTITIES)}"
+        columns = [Column(name="id", type="int")]
+        attributes = rng.sample(ATTRIBUTES, rng.randint(3, 11))
+        columns += [Column(name=attribute, type=attribute_type) for attribute, attribute_type in attributes]
+        table = Table(table_id=str(uuid.UUID(int=rng.getrandbits(128))), name=name, columns=columns)
+
+        if tables and rng.random() < 0.85:
+            for parent in rng.sample(tables, min(len(tables), rng.randint(1, 2))):
+                relation_type = "many-to-many" if rng.random() < 0.1 else "one-to-many"
+                if relation_type == "one-to-many":
+                    table.columns.append(Column(name=f"{parent.name.rstrip('s')}_id", type="int"))
+                relations.append(Relation(
+                    from_table=parent.name,
+                    from_table_id=parent.table_id,
+                    to_table=table.name,
+                    to_table_id=table.table_id,
+                    type=relation_type
+                ))
+        tables.append(table)
+
+    return DbSchema(tables=tables, relations=relations)
@@ -0,0 +1,59 @@
+"""
+Cold start of the Lambda handler: module import time and time to the first response.
+
+Every run is a fresh interpreter, like a Lambda cold start.
+Run from the backend directory: python -m benchmarks.startup [runs]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+RUNS = 5
+
+# Executed in a fresh interpreter, prints import and first response times in ms
+PROBE = """
+import json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+event = {
+    "version": "2.0",
+    "routeKey": "GET /",
+    "rawPath": "/",
+    "rawQueryString": "",
+    "headers": {"host": "localhost"},
+    "requestContext": {
+        "http": {"method": "GET", "path": "/", "protocol": "HTTP/1.1", "sourceIp": "127.0.0.1", "userAgent": "benchmark"},
+        "requestId": "benchmark",
+        "stage": "$default",
+    },
+    "isBase64Encoded": False,
+}
+response = main.handler(event, None)
+answered = time.perf_counter()
+assert response["statusCode"] == 200, response
+print(json.dumps({"import_ms": (imported - start) * 1000, "first_response_ms": (answered - start) * 1000}))
+"""
+
+
+def run_once() -> dict:
+    env = dict(os.environ, APP_MODE="lambda")
+    env.setdefault("AWS_DEFAULT_REGION", "eu-north-1")
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE], env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else RUNS
+    results = [run_once() for _ in range(runs)]
+    for key in ("import_ms", "first_response_ms"):
+        values = [result[key] for result in results]
+        print(f"{key:>18}: median {statistics.median(values):8.1f}  min {min(values):8.1f}  max {max(values):8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Failure scenarios of the LLM transport against a local fake OpenAI server.
+
+Covers retries on 5xx and 429, per-attempt timeouts, hedged requests, the circuit breaker
+and the re-ask of unparsable schema answers. Prints one line per scenario with the
+outcome, the number of HTTP requests the server saw and the elapsed time.
+
+Run from the backend directory: python -m benchmarks.transport
+"""
+import asyncio
+import json
+import os
+import statistics
+import time
+
+os.environ.setdefault("LOG_LEVEL", "error")
+
+from benchmarks.fake_llm_server import FakeLLMServer
+from models import SchemaRequest
+from services.database_service import DatabaseService
+from services.llm_service import OpenAiClient
+from services.llm_transport import LLMTransport, CircuitBreaker, LLMTransportError
+from services.metrics import metrics
+from services.token_ledger import InMemoryTokenStore
+
+SCHEMA_ANSWER = json.dumps({"schema": {"tables": [
+    {"table_id": "t1", "name": "users", "columns": [{"name": "id", "type": "int"}]}
+], "relations": []}})
+
+
+class LocalOpenAiClient(OpenAiClient):
+
+    def _estimate_tokens(self, *texts: str) -> int:
+        # Offline, the tiktoken encoding may not be downloadable
+        return sum(len(text) for text in texts) // 4
+
+
+def make_client(server: FakeLLMServer, **transport_options) -> LocalOpenAiClient:
+    options = {"attempt_timeout": 1.0, "deadline": 5.0, "max_retries": 3, "backoff_base": 0.05, "seed": 1}
+    options.update(transport_options)
+    return LocalOpenAiClient(api_key="fake", model="fake", token_limit=10 ** 9,
+                             token_store=InMemoryTokenStore(), transport=LLMTransport(**options), url=server.url)
+
+
+def call(client: LocalOpenAiClient) -> str:
+    try:
+        return f"ok {client.send_prompt('hi', 'system')!r}"
+    except LLMTransportError as e:
+        return f"{type(e).__name__} {e.status_code or ''}".strip()
+
+
+def report(name: str, outcome: str, server: FakeLLMServer, elapsed: float):
+    print(f"{name:<32} {outcome:<34} {len(server.requests):>8} {elapsed * 1000:>9.0f}")
+
+
+def scenario(name: str, plan: list[tuple[int, str, float]], **transport_options):
+    with FakeLLMServer(default=(200, "hello", 0.0)) as server:
+        server.plan = plan
+        client = make_client(server, **transport_options)
+        start = time.perf_counter()
+        outcome = call(client)
+        report(name, outcome, server, time.perf_counter() - start)
+        client.close()
+
+
+def breaker_scenario():
+    with FakeLLMServer(default=(500, "", 0.0)) as server:
+        client = make_client(server, max_retries=0, breaker=CircuitBreaker(failure_threshold=3, reset_timeout=0.3))
+        start = time.perf_counter()
+        outcomes = [call(client) for _ in range(5)]
+        report("breaker opens after 3 failures", outcomes[-1], server, time.perf_counter() - start)
+
+        time.sleep(0.3)
+        server.default = (200, "hello", 0.0)
+        start = time.perf_counter()
+        outcome = call(client)
+        report("breaker half-open trial", f"{outcome}, {client.transport.breaker.state}", server,
+               time.perf_counter() - start)
+        client.close()
+
+
+def hedging_scenario(hedge_after: float | None, requests: int = 40) -> list[float]:
+    # Every tenth answer stalls for a second, like a slow replica
+    with FakeLLMServer() as server:
+        client = make_client(server, hedge_after=hedge_after)
+
+        async def run() -> list[float]:
+            latencies = []
+            for i in range(requests):
+                server.plan = [(200, "hello", 1.0 if i % 10 == 9 else 0.02)]
+                start = time.perf_counter()
+                await client.send_prompt_async("hi", "system")
+                latencies.append(time.perf_counter() - start)
+            await client.aclose()
+            return latencies
+
+        latencies = asyncio.run(run())
+        client.close()
+        return latencies
+
+
+def reask_scenario():
+    with FakeLLMServer() as server:
+        server.plan = [(200, "{\"schema\": {\"tables\": [", 0.0), (200, SCHEMA_ANSWER, 0.0)]
+        client = make_client(server)
+        service = DatabaseService(client)
+        start = time.perf_counter()
+        updated_db = service._generate_sql_schema([{"role": "user", "content": "add users"}], "postgres")
+        report("unparsable schema is re-asked", f"ok {len(updated_db.tables)} table(s)", server,
+               time.perf_counter() - start)
+
+        server.plan = [(200, json.dumps({"was_related": "yes", "answer": ""}), 0.0),
+                       (200, SCHEMA_ANSWER[:-10], 0.0), (200, SCHEMA_ANSWER, 0.0)]
+        stream = service.generate_schema_stream(SchemaRequest(
+            messages=[{"role": "user", "content": "create a users table"}], currentDb=None, dialect="postgres"))
+
+        async def consume():
+            return [event async for event, _ in stream]
+
+        start = time.perf_counter()
+        events = asyncio.run(consume())
+        report("unparsable stream is re-asked", f"ok {events[-1]}", server, time.perf_counter() - start)
+        client.close()
+
+
+def main_benchmark():
+    metrics.reset()
+    print(f"{'scenario':<32} {'outcome':<34} {'requests':>8} {'ms':>9}")
+    scenario("200", [])
+    scenario("503, 503, 200", [(503, "", 0.0), (503, "", 0.0)])
+    scenario("429 with Retry-After, 200", [(429, "", 0.0)])
+    scenario("stalled attempt, 200", [(200, "late", 3.0)], attempt_timeout=0.3)
+    scenario("400 is not retried", [(400, "bad request", 0.0)])
+    scenario("503 until retries run out", [(503, "", 0.0)] * 4)
+    scenario("deadline shorter than stall", [(200, "late", 3.0)] * 4, attempt_timeout=1.0, deadline=1.5)
+    breaker_scenario()
+    reask_scenario()
+
+    print()
+    print(f"{'hedging':<32} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for hedge_after in (None, 0.2):
+        latencies = hedging_scenario(hedge_after)
+        percentiles = statistics.quantiles(latencies, n=100)
+        label = f"hedge after {hedge_after}s" if hedge_after else "no hedging"
+        print(f"{label:<32} {percentiles[49] * 1000:>8.0f} {percentiles[94] * 1000:>8.0f} "
+              f"{max(latencies) * 1000:>8.0f}")
+
+    print()
+    names = ("chat2db_llm_retries_total", "chat2db_llm_hedged_total", "chat2db_llm_breaker_rejected_total",
+             "chat2db_schema_reask_total")
+    for line in metrics.render().splitlines():
+        if line.startswith(names):
+            print(line)
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -1,12 +1,29 @@
+import asyncio
+import json
 import os
+import secrets
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
 
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from models import SchemaRequest, SchemaResponse, ScriptResponse, ScriptRequest
-from services.database_service import DatabaseService
-from services.llm_service import LLMClient, TokenLimitError, OpenAiClient
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from models import (SchemaRequest, SchemaResponse, ScriptResponse, ScriptRequest, DbSchema,
+                    BatchScriptRequest, BatchScriptResponse, MigrationRequest, MigrationResponse)
+from services.admission import AdmissionController, AdmissionMiddleware, RequestCost
+from services.database_service import DatabaseService, SchemaAnswerError
+from services.history_compactor import HistoryCompactor
+from services.intent_classifier import IntentClassifier
+from services.response_cache import ResponseCache
+from services.schema_subgraph import SchemaSubgraph
+from services.llm_service import LLMClient, TokenLimitError, OpenAiClient, OllamaClient
+from services.llm_transport import LLMTransport, LLMTransportError, CircuitBreaker
+from services.metrics import metrics, current_endpoint, log_event
 from services.script_service import SQLScriptService
+from services.single_flight import SingleFlight
+from services.token_ledger import TokenStore, DynamoDBTokenStore, InMemoryTokenStore, SQLiteTokenStore
 
 load_dotenv()
 
@@ -15,8 +32,97 @@ token_limit=1000000
 remote_frontend_url = "https://chat2db.netlify.app/"
 
 APP_MODE = os.getenv("APP_MODE", "local")
+SPECULATIVE_SCHEMA = os.getenv("SPECULATIVE_SCHEMA", "false").lower() == "true"
+LLM_SUMMARY = os.getenv("LLM_SUMMARY", "false").lower() == "true"
+SCHEMA_PATCH_MODE = os.getenv("SCHEMA_PATCH_MODE", "false").lower() == "true"
+# 0 disables history compaction
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+# dynamodb | sqlite | memory
+TOKEN_STORE = os.getenv("TOKEN_STORE", "dynamodb")
+# Quota reserved from the token store at a time. Lambda drops containers without releasing
+# their reservation, so it gets a smaller block there
+TOKEN_BLOCK_SIZE = int(os.getenv("TOKEN_BLOCK_SIZE", "5000" if APP_MODE == "lambda" else "20000"))
+# By default the monthly token limit counts every token; when enabled cached prompt tokens only count
+# with the share of the prompt price they are billed at (PROMPT_TOKEN_PRICE, CACHED_PROMPT_TOKEN_PRICE)
+QUOTA_DISCOUNT_CACHED_TOKENS = os.getenv("QUOTA_DISCOUNT_CACHED_TOKENS", "false").lower() == "true"
+# Schemas with at least this many tables are sent to the LLM as the relevant subgraph only, 0 disables
+SCHEMA_SUBGRAPH_MIN_TABLES = int(os.getenv("SCHEMA_SUBGRAPH_MIN_TABLES", "40"))
+SCHEMA_SUBGRAPH_HOPS = int(os.getenv("SCHEMA_SUBGRAPH_HOPS", "1"))
+# Confidence needed to skip the LLM intent prompt, above 1 disables the local classifier
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.8"))
+# 0 disables the response cache, RESPONSE_CACHE_PATH adds a persistent SQLite tier
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH")
+# Concurrent identical schema and script requests share one generation
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "true").lower() == "true"
+# Seconds per LLM attempt and per call including retries
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "120"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+# Send a duplicate request when an answer takes longer than this (e.g. the p95 latency), 0 disables
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+# Constrain answers to the JSON schema of their response model, turn off for models and
+# servers without structured outputs, the schema is put into the prompt then
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "true").lower() == "true"
+# openai | ollama
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api/chat")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3")
+# Duration like 30m or seconds, -1 keeps the model loaded
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "-1")
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "8192"))
+# Generations running at once, the rest queue, 0 doesn't limit
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "1"))
+OLLAMA_STREAM = os.getenv("OLLAMA_STREAM", "true").lower() == "true"
+OLLAMA_PRELOAD = os.getenv("OLLAMA_PRELOAD", "true").lower() == "true"
+# Admission control of LLM requests, 0 disables a limit
+CLIENT_TOKENS_PER_MINUTE = float(os.getenv("CLIENT_TOKENS_PER_MINUTE", "20000"))
+CLIENT_BURST_TOKENS = float(os.getenv("CLIENT_BURST_TOKENS", "60000"))
+MAX_REQUEST_TOKENS = int(os.getenv("MAX_REQUEST_TOKENS", "100000"))
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "16"))
+MAX_QUEUED_REQUESTS = int(os.getenv("MAX_QUEUED_REQUESTS", "64"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+# Behind a reverse proxy: the header the proxies append the client address to (e.g. x-forwarded-for)
+# and how many of them append to it. On Lambda the API Gateway source IP is used instead
+CLIENT_ADDRESS_HEADER = os.getenv("CLIENT_ADDRESS_HEADER")
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", "1"))
+# The Lambda is reachable through the public API Gateway, /metrics is only served there when enabled
+# explicitly. With METRICS_TOKEN set scrapers must send it as a bearer token
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false" if APP_MODE == "lambda" else "true").lower() == "true"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
 
-app = FastAPI()
+TOKEN_LIMIT_MESSAGE = "Sorry, our service reached token limit. Try again later."
+LLM_UNAVAILABLE_MESSAGE = "Sorry, our AI service is not responding right now. Try again later."
+INVALID_SCHEMA_MESSAGE = "Sorry, I couldn't build a valid schema from that. Please try rephrasing your request."
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Not run on Lambda, see the Mangum handler
+    await preload_local_model()
+    yield
+    await close_llm_clients()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Added before CORS so rejections still get the CORS headers
+app.add_middleware(
+    AdmissionMiddleware,
+    # Resolved per request so benchmarks can override it like the services
+    get_controller=lambda: app.dependency_overrides.get(get_admission_controller, get_admission_controller)(),
+    costs={
+        "/generate/schema": RequestCost.schema,
+        "/generate/schema/stream": RequestCost.schema,
+        "/generate/dbsql": RequestCost.script,
+        "/generate/dbsql/batch": RequestCost.batch_script,
+    },
+    client_header=CLIENT_ADDRESS_HEADER,
+    trusted_proxies=TRUSTED_PROXIES,
+)
 
 origins = ["*"] if APP_MODE == "local" else remote_frontend_url
 
@@ -28,14 +134,120 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# llm_service: LLMClient = OllamaClient()
-llm_service: LLMClient = OpenAiClient(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    model=model,
-    token_limit=token_limit)
+# Services are built on first use so the Lambda cold start only pays for importing the app
+
+
+@lru_cache(maxsize=1)
+def get_llm_service() -> LLMClient:
+    if TOKEN_STORE == "memory":
+        token_store: TokenStore = InMemoryTokenStore()
+    elif TOKEN_STORE == "sqlite":
+        token_store: TokenStore = SQLiteTokenStore(os.getenv("TOKEN_STORE_PATH", "token_usage.db"))
+    else:
+        token_store: TokenStore = DynamoDBTokenStore(os.getenv("TABLE_NAME", "Chat2dbTokenUsage"))
+
+    transport = LLMTransport(
+        attempt_timeout=LLM_TIMEOUT,
+        deadline=LLM_DEADLINE,
+        max_retries=LLM_MAX_RETRIES,
+        hedge_after=LLM_HEDGE_AFTER or None,
+        breaker=CircuitBreaker(failure_threshold=LLM_BREAKER_FAILURES, reset_timeout=LLM_BREAKER_RESET))
+
+    if LLM_PROVIDER == "ollama":
+        return OllamaClient(
+            url=OLLAMA_URL,
+            model=OLLAMA_MODEL,
+            transport=transport,
+            keep_alive=int(OLLAMA_KEEP_ALIVE) if OLLAMA_KEEP_ALIVE.lstrip("-").isdigit() else OLLAMA_KEEP_ALIVE,
+            num_ctx=OLLAMA_NUM_CTX or None,
+            max_concurrency=OLLAMA_MAX_CONCURRENCY,
+            stream=OLLAMA_STREAM,
+            structured_output=STRUCTURED_OUTPUT)
+
+    return OpenAiClient(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        model=model,
+        token_limit=token_limit,
+        token_store=token_store,
+        transport=transport,
+        structured_output=STRUCTURED_OUTPUT,
+        token_block_size=TOKEN_BLOCK_SIZE,
+        discount_cached_tokens=QUOTA_DISCOUNT_CACHED_TOKENS)
+
+
+@lru_cache(maxsize=1)
+def get_admission_controller() -> AdmissionController:
+    return AdmissionController(
+        tokens_per_minute=CLIENT_TOKENS_PER_MINUTE,
+        burst_tokens=CLIENT_BURST_TOKENS,
+        max_request_tokens=MAX_REQUEST_TOKENS,
+        max_concurrent=MAX_CONCURRENT_REQUESTS,
+        max_queue=MAX_QUEUED_REQUESTS,
+        queue_timeout=ADMISSION_QUEUE_TIMEOUT)
+
+
+@lru_cache(maxsize=1)
+def get_response_cache() -> ResponseCache | None:
+    if RESPONSE_CACHE_SIZE <= 0:
+        return None
+    return ResponseCache(max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, path=RESPONSE_CACHE_PATH)
+
+
+@lru_cache(maxsize=1)
+def get_database_service() -> DatabaseService:
+    llm_service = get_llm_service()
+    return DatabaseService(
+        llm_service=llm_service,
+        speculative=SPECULATIVE_SCHEMA,
+        llm_summary=LLM_SUMMARY,
+        patch_mode=SCHEMA_PATCH_MODE,
+        history_compactor=HistoryCompactor(
+            estimate_tokens=llm_service._estimate_tokens,
+            token_budget=HISTORY_TOKEN_BUDGET) if HISTORY_TOKEN_BUDGET > 0 else None,
+        response_cache=get_response_cache(),
+        intent_classifier=IntentClassifier(
+            threshold=INTENT_CONFIDENCE_THRESHOLD) if INTENT_CONFIDENCE_THRESHOLD <= 1 else None,
+        schema_subgraph=SchemaSubgraph(
+            min_tables=SCHEMA_SUBGRAPH_MIN_TABLES,
+            hops=SCHEMA_SUBGRAPH_HOPS) if SCHEMA_SUBGRAPH_MIN_TABLES > 0 else None,
+        single_flight=SingleFlight("schema") if SINGLE_FLIGHT else None)
+
+
+@lru_cache(maxsize=1)
+def get_script_service() -> SQLScriptService:
+    return SQLScriptService(
+        llm_service=get_llm_service(),
+        response_cache=get_response_cache(),
+        single_flight=SingleFlight("script") if SINGLE_FLIGHT else None)
+
+
+@app.middleware("http")
+async def track_request(request: Request, call_next):
+    route_paths = {route.path for route in app.routes}
+    # Unknown paths share one label so scanners can't blow up the metric cardinality
+    endpoint = request.url.path if request.url.path in route_paths else "other"
+    token = current_endpoint.set(endpoint)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.observe("chat2db_request_seconds", time.perf_counter() - start, "Request duration",
+                        endpoint=endpoint, method=request.method, status=str(status))
+        current_endpoint.reset(token)
+
+
+def get_metrics(request: Request) -> PlainTextResponse:
+    if METRICS_TOKEN and not secrets.compare_digest(request.headers.get("authorization", ""),
+                                                    f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, headers={"WWW-Authenticate": "Bearer"})
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-database_service = DatabaseService(llm_service=llm_service)
-script_service = SQLScriptService(llm_service=llm_service)
+
+if METRICS_ENABLED:
+    app.add_api_route("/metrics", get_metrics, methods=["GET"])
 
 
 @app.get("/")
@@ -43,38 +255,136 @@ def root():
     return {"message": f"API is running in {APP_MODE} mode"}
 
 
+async def preload_local_model():
+    # The first request after startup would otherwise wait for the model to load
+    if LLM_PROVIDER != "ollama" or not OLLAMA_PRELOAD:
+        return
+    try:
+        await asyncio.to_thread(get_llm_service().preload)
+    except LLMTransportError as e:
+        log_event("llm_preload_failed", level="warning", error=str(e))
+
+
+async def close_llm_clients():
+    if get_llm_service.cache_info().currsize:
+        llm_service = get_llm_service()
+        await llm_service.aclose()
+        llm_service.close()
+    if get_response_cache.cache_info().currsize and get_response_cache():
+        get_response_cache().close()
+
+
 @app.post("/generate/dbsql")
-def generate_sql_script(request: ScriptRequest) -> ScriptResponse:
+async def generate_sql_script(
+    request: ScriptRequest,
+    script_service: SQLScriptService = Depends(get_script_service)
+) -> ScriptResponse:
     try:
-        return script_service.generate_sql_script(request.currentDb, request.dialect)
+        return await script_service.generate_sql_script_async(request.currentDb, request.dialect, request.useLlm)
     except TokenLimitError:
-        return ScriptResponse(sql="", message="Sorry, our service reached token limit. Try again later.")
+        return ScriptResponse(sql="", message=TOKEN_LIMIT_MESSAGE)
+    except LLMTransportError as e:
+        log_event("llm_unavailable", level="error", error=str(e))
+        return ScriptResponse(sql="", message=LLM_UNAVAILABLE_MESSAGE)
+
+
+@app.post("/generate/dbsql/batch")
+async def generate_sql_scripts(
+    request: BatchScriptRequest,
+    script_service: SQLScriptService = Depends(get_script_service)
+) -> BatchScriptResponse:
+    try:
+        return await script_service.generate_sql_scripts_async(request.currentDb, request.dialects, request.useLlm)
+    except (TokenLimitError, LLMTransportError) as e:
+        if isinstance(e, LLMTransportError):
+            log_event("llm_unavailable", level="error", error=str(e))
+        message = TOKEN_LIMIT_MESSAGE if isinstance(e, TokenLimitError) else LLM_UNAVAILABLE_MESSAGE
+        return BatchScriptResponse(scripts={
+            dialect: ScriptResponse(sql="", message=message) for dialect in request.dialects
+        })
+
+
+@app.post("/generate/migration")
+async def generate_migration_script(
+    request: MigrationRequest,
+    script_service: SQLScriptService = Depends(get_script_service)
+) -> MigrationResponse:
+    return await script_service.generate_migration_script_async(request.previousDb, request.currentDb, request.dialect)
 
 
 @app.post("/generate/schema")
-def generate_schema(request: SchemaRequest) -> SchemaResponse:
-    print(f"Received request: {request.messages}")
-    if request.currentDb:
-        print(f"Current DB state: {request.currentDb}")
+async def generate_schema(
+    request: SchemaRequest,
+    database_service: DatabaseService = Depends(get_database_service)
+) -> SchemaResponse:
+    log_event("schema_request", messages=len(request.messages),
+              tables=len(request.currentDb.tables) if request.currentDb else 0)
 
     try:
-        schema_response = database_service.generate_schema(request)
+        schema_response = await database_service.generate_schema_async(request)
     except TokenLimitError:
-        return SchemaResponse(
-            response="Sorry, our service reached token limit. Try again later.",
-            updatedDb=request.currentDb
-        )
-
-    print(f"""
-    Message: {schema_response.response}
-    Generated Schema: {schema_response.updatedDb.model_dump_json(indent=2)}
-    """)
+        return _unchanged_schema_response(request, TOKEN_LIMIT_MESSAGE)
+    except LLMTransportError as e:
+        log_event("llm_unavailable", level="error", error=str(e))
+        return _unchanged_schema_response(request, LLM_UNAVAILABLE_MESSAGE)
+    except SchemaAnswerError:
+        # Already logged with the answer when the re-ask failed
+        return _unchanged_schema_response(request, INVALID_SCHEMA_MESSAGE)
+
+    log_event("schema_response", tables=len(schema_response.updatedDb.tables),
+              relations=len(schema_response.updatedDb.relations))
     return schema_response
 
 
+@app.post("/generate/schema/stream")
+async def generate_schema_stream(
+    request: SchemaRequest,
+    database_service: DatabaseService = Depends(get_database_service)
+) -> StreamingResponse:
+    """
+    Server-sent events variant of /generate/schema: intent, table, relations, summary, done.
+    Mangum buffers the response, so on Lambda the events arrive all at once.
+    """
+    async def events():
+        try:
+            async for event, data in database_service.generate_schema_stream(request):
+                yield _sse(event, data)
+        except (TokenLimitError, LLMTransportError, SchemaAnswerError) as e:
+            if isinstance(e, LLMTransportError):
+                log_event("llm_unavailable", level="error", error=str(e))
+            if isinstance(e, TokenLimitError):
+                message = TOKEN_LIMIT_MESSAGE
+            elif isinstance(e, SchemaAnswerError):
+                message = INVALID_SCHEMA_MESSAGE
+            else:
+                message = LLM_UNAVAILABLE_MESSAGE
+            response = _unchanged_schema_response(request, message)
+            yield _sse("summary", {"response": response.response})
+            yield _sse("done", response.model_dump())
+        except Exception as e:
+            log_event("schema_stream_failed", level="error", error=str(e))
+            yield _sse("error", {"message": "Sorry, something went wrong. Please try again."})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _unchanged_schema_response(request: SchemaRequest, message: str) -> SchemaResponse:
+    return SchemaResponse(response=message, updatedDb=request.currentDb or DbSchema(tables=[], relations=[]))
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 if APP_MODE == "lambda":
     from mangum import Mangum
-    handler = Mangum(app)
+    # Mangum would run startup and shutdown around every invocation, closing the pooled
+    # clients, the token ledger and the response cache after each request
+    handler = Mangum(app, lifespan="off")
 
 if __name__ == "__main__" and APP_MODE == "local":
     import uvicorn
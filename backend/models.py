@@ -1,6 +1,11 @@
-from typing import List, Optional, Literal
+from typing import Dict, List, Optional, Literal
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
+
+# Column types the schema prompts allow
+VALID_COLUMN_TYPES = (
+    "int", "bigint", "smallint", "float", "decimal", "bool", "text", "varchar", "date", "timestamp", "uuid", "json", "blob"
+)
 
 
 class Column(BaseModel):
@@ -27,6 +32,79 @@ class DbSchema(BaseModel):
     relations: List[Relation]
 
 
+class SchemaIssue(BaseModel):
+    level: Literal["error", "warning"]
+    code: str
+    message: str
+    table_id: Optional[str] = None
+    table: Optional[str] = None
+    column: Optional[str] = None
+    relation: Optional[int] = None
+
+
+class SchemaOperation(BaseModel):
+    op: Literal[
+        "add_table", "drop_table", "rename_table",
+        "add_column", "drop_column", "rename_column", "alter_type",
+        "add_relation", "drop_relation"
+    ]
+    table_id: str
+    name: Optional[str] = None
+    new_name: Optional[str] = None
+    type: Optional[str] = None
+    columns: Optional[List[Column]] = None
+    to_table_id: Optional[str] = None
+
+
+class SchemaPatch(BaseModel):
+    operations: List[SchemaOperation]
+
+
+# Answers of the LLM, their JSON schemas constrain the generation
+
+
+class SchemaAnswer(BaseModel):
+    # `schema` is a BaseModel method, the field only uses it as its JSON name
+    model_config = ConfigDict(populate_by_name=True)
+
+    db_schema: DbSchema = Field(alias="schema")
+
+
+class IntentResult(BaseModel):
+    was_related: Literal["yes", "no"]
+    answer: str
+
+
+class ColumnChange(BaseModel):
+    name: str
+    old_name: Optional[str] = None
+    old_type: Optional[str] = None
+    new_type: Optional[str] = None
+
+
+class TableChange(BaseModel):
+    table_id: str
+    name: str
+    old_name: Optional[str] = None
+    added_columns: List[Column] = []
+    removed_columns: List[Column] = []
+    changed_columns: List[ColumnChange] = []
+
+
+class RelationChange(BaseModel):
+    before: Relation
+    after: Relation
+
+
+class SchemaDiff(BaseModel):
+    added_tables: List[Table] = []
+    removed_tables: List[Table] = []
+    changed_tables: List[TableChange] = []
+    added_relations: List[Relation] = []
+    removed_relations: List[Relation] = []
+    changed_relations: List[RelationChange] = []
+
+
 class SchemaRequest(BaseModel):
     messages: list[dict[str, str]]
     dialect: Optional[str] = "postgresql"
@@ -36,13 +114,38 @@ class SchemaRequest(BaseModel):
 class ScriptRequest(BaseModel):
     dialect: str = "postgresql"
     currentDb: DbSchema
+    useLlm: bool = False
+
+
+class BatchScriptRequest(BaseModel):
+    dialects: List[str]
+    currentDb: DbSchema
+    useLlm: bool = False
+
+
+class MigrationRequest(BaseModel):
+    dialect: str = "postgresql"
+    previousDb: Optional[DbSchema] = None
+    currentDb: DbSchema
 
 
 class SchemaResponse(BaseModel):
     response: str
     updatedDb: DbSchema
+    diff: Optional[SchemaDiff] = None
+    # Warnings about updatedDb, e.g. tables without columns or unknown column types
+    issues: List[SchemaIssue] = []
 
 
 class ScriptResponse(BaseModel):
     sql: str
     message: str
+
+
+class MigrationResponse(ScriptResponse):
+    # Changes the dialect can't express as ALTER statements
+    notes: List[str] = []
+
+
+class BatchScriptResponse(BaseModel):
+    scripts: Dict[str, ScriptResponse]
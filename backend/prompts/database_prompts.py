@@ -1,139 +1,157 @@
+SCHEMA_NOTATION = (
+    "one table per line as `TABLE_ID table_name: column type, column type, ...`, "
+    "relations as `R FROM_TABLE_ID TYPE TO_TABLE_ID` where TYPE is 1:1 (one-to-one), "
+    "1:N (one-to-many) or N:N (many-to-many)"
+)
+
+# The static instructions open every prompt and the request data comes last, so consecutive
+# prompts of the same kind start with the same bytes and the provider's prompt cache applies.
+# Don't interpolate anything request specific into these blocks.
+
+SCHEMA_RULES = f"""
+You are a helpful assistant for software developers. You create and update database schemas
+based on the user's description.
+
+Rules:
+- Use SQL-compatible types for the SQL dialect given below.
+- Table fields should be in lowercase with snake_case naming.
+- if table has foreign keys include them as column with int type in the table.
+- Many to one is not valid relation type, use one to many instead.
+- don't made any additional changes to the schema if user didn't ask for it.
+- Respond ONLY with JSON, no explanations or extra text.
+
+Valid types for columns: ["int", "bigint", "smallint", "float", "decimal", "bool", "text", "varchar", "date", "timestamp","uuid","json","blob"]
+
+Schemas use this notation: {SCHEMA_NOTATION}
+"""
+
+# The shape of the answers comes from the response models in models.py, the prompts only
+# explain what to put in them
+
+FULL_SCHEMA_TASK = """
+Your task is to generate or update an existing database schema, answer with the complete schema.
+- Each table must have a unique `table_id` (use uuid for it) that is not used in any column and any other table.
+- Don't change table_id of existing tables,you can only create new ones.
+- Relations refer to tables by name and by the table_id from the tables section.
+- Relation types: one-to-one, one-to-many, many-to-many.
+"""
+
+SCHEMA_PATCH_TASK = """
+Your task is to update an existing database schema. Don't repeat the schema, respond only with the list of edit operations.
+- Refer to existing tables only by their `table_id`.
+- New tables need a new unique `table_id` (use uuid for it) that is not used in any column and any other table.
+- If nothing has to change return an empty list of operations.
+
+Operations and the fields they use, leave the other fields null:
+- add_table: table_id (the new one), name, columns
+- drop_table: table_id
+- rename_table: table_id, name (the new name)
+- add_column: table_id, name, type
+- drop_column: table_id, name
+- rename_column: table_id, name, new_name
+- alter_type: table_id, name, type
+- add_relation: table_id (from table), to_table_id, type (one-to-one, one-to-many or many-to-many)
+- drop_relation: table_id (from table), to_table_id
+"""
+
+INTENT_RULES = """
+User jest asked you a question you have to decide if it is related to creating or updating database schema or not.
+If user question is not related to database schema you should politely inform user that you job is to help with creating database schema and you cannot help with this question.
+
+Rules:
+1. Set was_related to "yes" or "no" and answer to your answer for the user.
+2. if user question is related to creating or updating database schema you should respond with "yes" and empty answer.
+3. if user don't directly ask you to create or update database schema but you can infer that he wants to do it you should respond with "yes" and empty answer.
+4. if user question is related to database schema you should respond with "yes" and empty answer.
+5. if user demand something that is beyond you job you should respond with "no" and polite answer that you cannot help with this question.
+6. user sometimes may question ask what you can do say hello or thank you for your work you for such question you should respond with "no" and natural answer
+7. Your answer should be very short and to the point (max 30 words).
+
+example answers when was_related is "no":
+Sorry, i cannot help with this question. My job is to help with creating or updating database schema.
+hey
+Thank you i'm glad that you like it!
+I'm sorry that i couldn't help you.
+"""
+
+SUMMARY_RULES = f"""
+User just asked you to  create or update database schema and you tried you best.
+Now you need to answer user question.
+
+Rules:
+1.you should answer very briefly what you did according to difference between schema before and after you work.
+2.Your answer should be very short and to the point (max 30 words).
+
+example answers:
+I have created new schema with tables: users, orders, products. I have updated the users table.
+I have updated the book table.
+
+Schemas use this notation: {SCHEMA_NOTATION}
+"""
+
+JSON_ONLY = "Output ONLY valid JSON. No comments. No explanations."
+
 
 class DatabasePrompts:
 
     @staticmethod
     def get_user_answer_template(previous_db_state, current_db_state, user_question) -> str:
-        return f"""
-        User just asked you to  create or update database schema and you tried you best
-    
-        schema before your work:
-        {previous_db_state if previous_db_state
-        else "This is first question in the chat"}
-    
-        schema after you finished your work:
-        {current_db_state}
-    
-        Now you need to answer user question.
-    
-        Rules:
-        1.you should answer very briefly what you did according to difference between schema before and after you work.
-        2.Your answer should be very short and to the point (max 30 words).
-    
-        example answers:
-        I have created new schema with tables: users, orders, products. I have updated the users table.
-        I have updated the book table.
-        
-        
-    
-        here is user question:
-        {user_question}
-    
-        now your answer:
-        """
+        return f"""{SUMMARY_RULES}
+here is user question:
+{user_question}
+
+schema before your work:
+{previous_db_state if previous_db_state else "This is first question in the chat"}
+
+schema after you finished your work:
+{current_db_state}
+
+now your answer:
+"""
 
     @staticmethod
-    def check_if_generate_schema(messages:list[dict[str,str]])->str:
-        return f"""
-            User jest asked you a question you have to decide if it is related to creating or updating database schema or not.
-            If user question is not related to database schema you should politely inform user that you job is to help with creating database schema and you cannot help with this question.
-            
-            Rules:
-            1. You answer always should be with JSON format.
-            2. if user question is related to creating or updating database schema you should respond with "yes" and empty answer.
-            3. if user don't directly ask you to create or update database schema but you can infer that he wants to do it you should respond with "yes" and empty answer.
-            4. if user question is related to database schema you should respond with "yes" and empty answer.
-            5. if user demand something that is beyond you job you should respond with "no" and polite answer that you cannot help with this question.
-            6. user sometimes may question ask what you can do say hello or thank you for your work you for such question you should respond with "no" and natural answer
-            7. Your answer should be very short and to the point (max 30 words).
-            
-            example answers: 
-            {{
-                "was_related": "yes",
-                "answer": ""
-            }}
-            {{
-                "was_related": "no",
-                "answer": "Sorry, i cannot help with this question. My job is to help with creating or updating database schema."
-            }}
-            {{
-                "was_related": "no",
-                "answer": "hey"
-            }}
-            {{
-                "was_related": "no",
-                "answer": "Thank you i'm glad that you like it!"
-            }}
-            {{
-                "was_related": "no",
-                "answer": "I'm sorry that i couldn't help you."
-            }}        
-            
-            
-            
-            Here is ur conversation history with user:{messages}
-            
-            Now your answer:
-            """
+    def check_if_generate_schema(messages: list[dict[str, str]]) -> str:
+        return f"""{INTENT_RULES}
+Here is ur conversation history with user:{messages}
+
+Now your answer:
+"""
 
     @staticmethod
     def generate_sql_schema(user_messages: list[dict[str, str]], database_dialect: str,
                             current_db_state: str = None) -> str:
-        return f"""
-        You are a helpful assistant for software developers. Your task is to generate or update an existing database schema
-        based on the user's description.
-    
-        Rules:
-        - Use SQL-compatible types for: {database_dialect}
-        - Table fields should be in lowercase with snake_case naming.
-        - if table has foreign keys include them as column with int type in the table.
-        - Many to one is not valid relation type, use one to many instead.
-        - don't made any additional changes to the schema if user didn't ask for it.
-        - Each table must have a unique `table_id` that is not used in any column and any other table.
-        - Don't change table_id of existing tables,you can only create new ones.
-        - Respond ONLY with JSON, no explanations or extra text.
-    
-        Valid types for columns: ["int", "bigint", "smallint", "float", "decimal", "bool", "text", "varchar", "date", "timestamp","uuid","json","blob"]
-    
-        
-        The JSON must follow **exactly** this structure:
-    
-        {{
-            "schema": {{
-                "tables": [
-                    {{
-                        "table_id": "table_id",   # Each table must have a unique table_id (use uuid for it) that is not used in any column.
-                        "name": "table_name",
-                        "columns": [
-                            {{
-                                "name": "column_name",
-                                "type": "data_type"
-                            }},
-                            ...
-                        ]
-                    }},
-                    ...
-                ],
-                "relations": [
-                    {{
-                        "from_table": "table_name",
-                        "from_table_id": "table_id", # Use the same table_id as in the tables section.
-                        "to_table": "table_name",
-                        "to_table_id": "table_id",  # Use target table_id from the tables section.
-                        "type": "RELATION_TYPE"  # valid options: "one-to-one", "one-to-many", "many-to-many"
-                    }},
-                    ...
-                ]
-            }}
-        }}
-    
-        {f"Here is current database state: {current_db_state}" if current_db_state else ""}
-    
-        Your conversation history with user:
-        \"\"\"
-        {user_messages}
-        \"\"\"
-    
-    
-    
-        Output ONLY valid JSON. No comments. No explanations.
-        """
\ No newline at end of file
+        return DatabasePrompts._schema_prompt(FULL_SCHEMA_TASK, user_messages, database_dialect, current_db_state)
+
+    @staticmethod
+    def fix_invalid_schema(schema_prompt: str, error: str) -> str:
+        # Starts with the whole failed prompt, the provider serves it from the prompt cache
+        return f"""{schema_prompt}
+Your previous answer to this task could not be used: {error}
+Answer again with the complete schema.
+
+{JSON_ONLY}
+"""
+
+    @staticmethod
+    def generate_schema_patch(user_messages: list[dict[str, str]], database_dialect: str,
+                              current_db_state: str) -> str:
+        return DatabasePrompts._schema_prompt(SCHEMA_PATCH_TASK, user_messages, database_dialect, current_db_state)
+
+    @staticmethod
+    def _schema_prompt(task: str, user_messages: list[dict[str, str]], database_dialect: str,
+                       current_db_state: str | None) -> str:
+        # Ordered from the least to the most changing part: the dialect is fixed for a chat and the
+        # history only grows, so the next turn's prompt shares everything up to the current schema
+        current_state = f"Here is current database state:\n{current_db_state}" if current_db_state else ""
+        return f"""{SCHEMA_RULES}{task}
+SQL dialect: {database_dialect}
+
+Your conversation history with user:
+\"\"\"
+{user_messages}
+\"\"\"
+
+{current_state}
+
+{JSON_ONLY}
+"""
@@ -0,0 +1,279 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from pydantic import ValidationError
+
+from models import SchemaRequest, ScriptRequest, BatchScriptRequest
+from services import tokenizer
+from services.metrics import metrics, log_event
+from services.schema_codec import SchemaCodec
+
+# Buckets of the least recently seen clients are dropped beyond this, they refill anyway
+MAX_TRACKED_CLIENTS = 10_000
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, reason: str, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Holds up to capacity tokens and refills at rate tokens per second.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, tokens: float) -> float:
+        """
+        Takes the tokens and returns 0, or returns the seconds until they are available.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if tokens <= self.tokens:
+            self.tokens -= tokens
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """
+    Decides which LLM requests start, before any LLM call is made.
+
+    - A request estimated above max_request_tokens is rejected outright.
+    - Every client has a token bucket refilled with tokens_per_minute, up to burst_tokens, so one
+      client with large schemas and long histories can't use up the shared monthly limit.
+    - At most max_concurrent requests run at once. Up to max_queue wait for a slot for at most
+      queue_timeout seconds, requests beyond that are rejected immediately instead of waiting
+      behind a queue they won't get through.
+
+    0 disables a limit. State is per process: a Lambda container serves one request at a time,
+    so there only the size cap and the per-container buckets apply.
+    """
+
+    def __init__(self, tokens_per_minute: float = 0, burst_tokens: float = 0, max_request_tokens: int = 0,
+                 max_concurrent: int = 0, max_queue: int = 0, queue_timeout: float = 30.0):
+        self.tokens_per_minute = tokens_per_minute
+        self.burst_tokens = burst_tokens or tokens_per_minute
+        self.max_request_tokens = max_request_tokens
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        # Requests running or waiting for a slot, counted before the first await so a burst
+        # arriving in the same event loop iteration sees it
+        self.active = 0
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._lock = threading.Lock()
+        self._slots: asyncio.Semaphore | None = None
+        self._slots_loop = None
+
+    @property
+    def counts_tokens(self) -> bool:
+        """
+        False when no limit looks at request sizes, the bodies don't have to be tokenized then.
+        """
+        return bool(self.max_request_tokens or self.tokens_per_minute)
+
+    async def admit(self, client: str, tokens: int):
+        """
+        Waits for a slot, raises AdmissionRejected when the request can't run. Every admitted
+        request must call release() when it is done.
+        """
+        if self.max_request_tokens and tokens > self.max_request_tokens:
+            raise AdmissionRejected(
+                413, "too_large",
+                f"Request is too large ({tokens} tokens, the limit is {self.max_request_tokens}). "
+                f"Shorten the conversation or the schema."
+            )
+        if self.max_concurrent and self.active >= self.max_concurrent + self.max_queue:
+            raise AdmissionRejected(429, "queue_full", "The service is busy, try again later.", retry_after=1.0)
+        self._charge(client, tokens)
+
+        if not self.max_concurrent:
+            return
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots_loop is not loop:
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+            self._slots_loop = loop
+
+        started = time.perf_counter()
+        self.active += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except BaseException as e:
+            # Timed out or the client went away while waiting
+            self.active -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                raise AdmissionRejected(503, "queue_timeout", "The service is busy, try again later.", retry_after=1.0)
+            raise
+        metrics.observe("chat2db_admission_queue_seconds", time.perf_counter() - started,
+                        "Time requests waited for a free slot")
+
+    def _charge(self, client: str, tokens: int):
+        if not self.tokens_per_minute or not tokens:
+            return
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(self.tokens_per_minute / 60, self.burst_tokens)
+                if len(self._buckets) > MAX_TRACKED_CLIENTS:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+            # A request larger than the bucket waits until the bucket is full instead of never running
+            wait = bucket.take(min(tokens, bucket.capacity))
+        if wait:
+            raise AdmissionRejected(429, "client_budget", "Too many requests, try again later.", retry_after=wait)
+
+    def release(self):
+        if not self.max_concurrent:
+            return
+        self.active -= 1
+        self._slots.release()
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying an AdmissionController to the paths in `costs`, which map the request
+    body to its estimated prompt tokens. Other paths pass through. The slot is held until the
+    response is sent, streamed responses included.
+
+    get_controller is called per request, so it can resolve the app's dependency overrides.
+
+    Clients are told apart by an address they can't choose: the source IP API Gateway saw, else
+    the entry our own proxies appended to client_header (trusted_proxies entries from the
+    right, the ones left of it come from the client), else the connection's address.
+    """
+
+    def __init__(self, app, get_controller: Callable[[], AdmissionController],
+                 costs: dict[str, Callable[[bytes], int]], client_header: str | None = None,
+                 trusted_proxies: int = 1):
+        self.app = app
+        self.get_controller = get_controller
+        self.costs = costs
+        self.client_header = client_header.lower().encode() if client_header else None
+        self.trusted_proxies = trusted_proxies
+
+    async def __call__(self, scope, receive, send):
+        cost = self.costs.get(scope.get("path")) if scope["type"] == "http" else None
+        if cost is None:
+            await self.app(scope, receive, send)
+            return
+
+        controller = self.get_controller()
+        body = await _read_body(receive)
+        # Validating and encoding a large schema and counting its tokens (the first count loads the
+        # encoding) would block the event loop
+        tokens = await asyncio.to_thread(cost, body) if controller.counts_tokens else 0
+        try:
+            await controller.admit(self._client(scope), tokens)
+        except AdmissionRejected as e:
+            metrics.inc("chat2db_admission_rejected_total", 1, "Requests rejected by admission control",
+                        reason=e.reason)
+            log_event("admission_rejected", level="warning", reason=e.reason)
+            await _reject(send, e)
+            return
+
+        try:
+            await self.app(scope, _replay(body, receive), send)
+        finally:
+            controller.release()
+
+    def _client(self, scope) -> str:
+        # Set by Mangum on Lambda, REST APIs (v1) and HTTP APIs (v2) put the address in different places
+        request_context = (scope.get("aws.event") or {}).get("requestContext") or {}
+        source_ip = (request_context.get("identity") or {}).get("sourceIp") or \
+            (request_context.get("http") or {}).get("sourceIp")
+        if source_ip:
+            return source_ip
+
+        if self.client_header and self.trusted_proxies > 0:
+            addresses = [address.strip() for name, value in scope.get("headers", [])
+                         if name == self.client_header for address in value.decode("latin-1").split(",")]
+            if len(addresses) >= self.trusted_proxies:
+                return addresses[-self.trusted_proxies]
+
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+
+class RequestCost:
+    """
+    Estimated prompt tokens of the LLM calls a request body leads to. Bodies that don't validate
+    cost nothing here, the endpoint rejects them.
+    """
+
+    @staticmethod
+    def schema(body: bytes, estimate_tokens: Callable[..., int] = tokenizer.count_tokens) -> int:
+        try:
+            request = SchemaRequest.model_validate_json(body)
+        except ValidationError:
+            return 0
+        texts = [message.get("content", "") for message in request.messages]
+        if request.currentDb:
+            texts.append(SchemaCodec.encode(request.currentDb))
+        return estimate_tokens(*texts)
+
+    @staticmethod
+    def script(body: bytes, estimate_tokens: Callable[..., int] = tokenizer.count_tokens) -> int:
+        try:
+            request = ScriptRequest.model_validate_json(body)
+        except ValidationError:
+            return 0
+        # Compiled scripts don't call the LLM
+        return estimate_tokens(SchemaCodec.encode(request.currentDb)) if request.useLlm else 0
+
+    @staticmethod
+    def batch_script(body: bytes, estimate_tokens: Callable[..., int] = tokenizer.count_tokens) -> int:
+        try:
+            request = BatchScriptRequest.model_validate_json(body)
+        except ValidationError:
+            return 0
+        # One generation, the other dialects are transpiled
+        return estimate_tokens(SchemaCodec.encode(request.currentDb)) if request.useLlm else 0
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+def _replay(body: bytes, receive):
+    sent = False
+
+    async def replay():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return replay
+
+
+async def _reject(send, error: AdmissionRejected):
+    payload = json.dumps({"detail": str(error)}).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())]
+    if error.retry_after is not None:
+        headers.append((b"retry-after", str(max(1, round(error.retry_after))).encode()))
+    await send({"type": "http.response.start", "status": error.status_code, "headers": headers})
+    await send({"type": "http.response.body", "body": payload})
@@ -1,114 +1,548 @@
-import json
+import asyncio
+import contextvars
+from typing import AsyncIterator
 from pydantic import ValidationError
-from models import SchemaRequest, SchemaResponse, DbSchema, Table, Column, Relation
+from models import (SchemaRequest, SchemaResponse, DbSchema, Table, Column, SchemaAnswer, SchemaPatch, IntentResult,
+                    SchemaIssue)
 from prompts.database_prompts import DatabasePrompts
+from services.history_compactor import HistoryCompactor
+from services.intent_classifier import IntentClassifier
+from services.json_extract import extract_json
+from services.metrics import metrics, span, stage, in_stage, log_event
+from services.response_cache import ResponseCache, messages_fingerprint, schema_fingerprint
+from services.schema_codec import SchemaCodec
+from services.schema_diff import SchemaDiffer
+from services.schema_patch import SchemaPatcher, SchemaPatchError
+from services.schema_subgraph import SchemaSubgraph
+from services.schema_validator import SchemaValidator, SchemaValidationError
+from services.single_flight import SingleFlight
+from services.schema_stream import SchemaStreamParser
+
+SYSTEM_PROMPT = "You are an expert in relational databases and SQL."
+
+
+class SchemaAnswerError(ValueError):
+    """
+    The LLM answer can't be mapped to a schema, raised when asking once more didn't help either.
+    """
+
+# Repairs made while mapping the LLM answer of the current request, they are gone from the final schema
+# but the client still gets them as warnings
+mapping_issues: contextvars.ContextVar[list[SchemaIssue] | None] = contextvars.ContextVar("mapping_issues",
+                                                                                          default=None)
 
 
 class DatabaseService:
-    def __init__(self, llm_service):
+    def __init__(self, llm_service, speculative: bool = False, llm_summary: bool = False, patch_mode: bool = False,
+                 history_compactor: HistoryCompactor = None, response_cache: ResponseCache = None,
+                 intent_classifier: IntentClassifier = None, schema_subgraph: SchemaSubgraph = None,
+                 single_flight: SingleFlight = None):
         self.llm_service = llm_service
+        # Identical requests in flight at the same time (double clicks, retries, tabs) share one generation
+        self.single_flight = single_flight
+        # For large schemas only the tables the message refers to (and their neighbours) are sent
+        self.schema_subgraph = schema_subgraph
+        # Obvious messages are classified locally, only ambiguous ones go to the LLM intent prompt
+        self.intent_classifier = intent_classifier
+        # Intent answers are cached by conversation, greetings and thank-yous repeat a lot
+        self.response_cache = response_cache
+        self.history_compactor = history_compactor
+        # In patch mode existing schemas are updated from LLM edit operations instead of a full re-emit
+        self.patch_mode = patch_mode
+        # The user answer is built from the local schema diff unless the LLM summary is requested
+        self.llm_summary = llm_summary
+        # Speculative mode starts schema generation together with the intent check (async path only)
+        self.speculative = speculative
+        self.speculation_stats = {"started": 0, "discarded": 0, "wasted_tokens": 0}
 
     def generate_schema(self, request: SchemaRequest) -> SchemaResponse:
-        intent_prompt = DatabasePrompts.check_if_generate_schema(request.messages)
-        intent_response = self.llm_service.send_prompt(
-            user_prompt=intent_prompt,
-            system_prompt="You are an expert in relational databases and SQL.",
-            temperature=0.2
+        if self.single_flight is None:
+            return self._generate_schema(request)
+        return self.single_flight.do(self._request_key(request), lambda: self._generate_schema(request))
+
+    async def generate_schema_async(self, request: SchemaRequest) -> SchemaResponse:
+        if self.single_flight is None:
+            return await self._generate_schema_async(request)
+        return await self.single_flight.do_async(self._request_key(request),
+                                                 lambda: self._generate_schema_async(request))
+
+    def _generate_schema(self, request: SchemaRequest) -> SchemaResponse:
+        mapping_issues.set([])
+        request = self._compact_history(request)
+        early_response = self._handle_intent(self._ask_intent(request, self._known_intent(request)), request)
+        if early_response:
+            return early_response
+
+        subgraph = self._select_subgraph(request)
+        updated_db = self._generate_sql_schema(
+            user_messages=request.messages,
+            database_dialect=request.dialect,
+            current_db_state=subgraph or request.currentDb
         )
+        updated_db = self._merge_subgraph(request, subgraph, updated_db)
+        return self._schema_response(request, updated_db, self._summarize(request, updated_db))
 
-        try:
-            llm_recognition = json.loads(intent_response)
-        except json.JSONDecodeError:
-            return SchemaResponse(
-                response="Sorry, I couldn't understand your question. Please try again.",
-                updatedDb=DbSchema(tables=[], relations=[])
+    async def _generate_schema_async(self, request: SchemaRequest) -> SchemaResponse:
+        mapping_issues.set([])
+        request = self._compact_history(request)
+        known_intent = self._known_intent(request)
+        if self.speculative and known_intent is None:
+            updated_db = await self._generate_schema_speculative(request)
+        else:
+            updated_db = await self._generate_schema_sequential(request, known_intent)
+
+        if isinstance(updated_db, SchemaResponse):
+            return updated_db
+        return self._schema_response(request, updated_db, await self._summarize_async(request, updated_db))
+
+    async def generate_schema_stream(self, request: SchemaRequest) -> AsyncIterator[tuple[str, dict]]:
+        """
+        Streaming variant of generate_schema_async, yields (event, data) pairs:
+        intent, table (one per table as soon as it is parsed), relations, summary and done
+        with the complete SchemaResponse. Streamed tables are a preview, `done` is authoritative.
+        """
+        mapping_issues.set([])
+        request = self._compact_history(request)
+        early_response = self._handle_intent(
+            await self._ask_intent_async(request, self._known_intent(request)), request
+        )
+        yield "intent", {"was_related": early_response is None}
+        if early_response:
+            yield "summary", {"response": early_response.response}
+            yield "done", early_response.model_dump()
+            return
+
+        subgraph = self._select_subgraph(request)
+        current_db_state = subgraph or request.currentDb
+        if self._uses_patch(current_db_state):
+            # Edit operations can't be previewed table by table, send the tables once applied
+            updated_db = await self._generate_sql_schema_async(
+                user_messages=request.messages,
+                database_dialect=request.dialect,
+                current_db_state=current_db_state
             )
+            for table in updated_db.tables:
+                yield "table", table.model_dump()
+        else:
+            aliases = SchemaCodec.aliases_for(current_db_state)
+            full_prompt = self._build_full_schema_prompt(request.messages, request.dialect, current_db_state)
+            parser = SchemaStreamParser()
+            with stage("schema"):
+                async for chunk in self.llm_service.stream_prompt_async(**self._schema_call(full_prompt)):
+                    for kind, raw_item in parser.feed(chunk):
+                        table = self._map_streamed_table(kind, raw_item, aliases)
+                        if table is not None:
+                            yield "table", table.model_dump()
+            updated_db = await self._map_full_or_reask_async(parser.text, full_prompt, current_db_state)
+        updated_db = self._merge_subgraph(request, subgraph, updated_db)
 
-        if llm_recognition.get("was_related") != "yes":
-            return SchemaResponse(
-                response=llm_recognition.get("answer", "Sorry, I cannot help with that."),
-                updatedDb=request.currentDb
+        yield "relations", {"relations": [relation.model_dump() for relation in updated_db.relations]}
+
+        schema_response = self._schema_response(request, updated_db, await self._summarize_async(request, updated_db))
+        yield "summary", {"response": schema_response.response}
+        yield "done", schema_response.model_dump()
+
+    @staticmethod
+    def _map_streamed_table(kind: str, raw_item: dict, aliases: dict[str, str]) -> Table | None:
+        if kind != "table":
+            return None
+        try:
+            raw_table = SchemaCodec.resolve_aliases({"tables": [raw_item]}, aliases)["tables"][0]
+            return Table(
+                table_id=raw_table.get("table_id"),
+                name=raw_table.get("name"),
+                columns=[Column(**col) for col in raw_table.get("columns", [])]
             )
+        except (TypeError, AttributeError, ValidationError) as e:
+            # The final mapping reports the error for the whole response
+            log_event("streamed_table_skipped", level="warning", error=str(e))
+            return None
 
-        updated_db = self._generate_sql_schema(
+    async def _generate_schema_sequential(self, request: SchemaRequest,
+                                          known_intent: str = None) -> DbSchema | SchemaResponse:
+        early_response = self._handle_intent(await self._ask_intent_async(request, known_intent), request)
+        if early_response:
+            return early_response
+
+        subgraph = self._select_subgraph(request)
+        updated_db = await self._generate_sql_schema_async(
             user_messages=request.messages,
             database_dialect=request.dialect,
-            current_db_state=request.currentDb
+            current_db_state=subgraph or request.currentDb
         )
+        return self._merge_subgraph(request, subgraph, updated_db)
 
-        summary_prompt = DatabasePrompts.get_user_answer_template(
-            previous_db_state=request.currentDb,
-            current_db_state=updated_db.model_dump_json(indent=2),
-            user_question=request.messages
-        )
+    async def _generate_schema_speculative(self, request: SchemaRequest) -> DbSchema | SchemaResponse:
+        """
+        Runs the intent check and schema generation concurrently.
+        When the message turns out not to be a schema request the schema call is cancelled,
+        or its result discarded if it already finished, and the spent tokens are recorded.
+        """
+        subgraph = self._select_subgraph(request)
+        current_db_state = subgraph or request.currentDb
+        schema_prompt = self._build_schema_prompt(request.messages, request.dialect, current_db_state)
+        intent_task = asyncio.create_task(in_stage("intent", self.llm_service.send_prompt_async(
+            **self._intent_call(request.messages)
+        )))
+        schema_task = asyncio.create_task(in_stage("schema", self.llm_service.send_prompt_async(
+            **self._schema_call(schema_prompt, self._schema_response_model(current_db_state))
+        )))
+        self.speculation_stats["started"] += 1
 
-        response_for_user = self.llm_service.send_prompt(
-            user_prompt=summary_prompt,
-            system_prompt="You are an expert in relational databases and SQL.",
-            temperature=0.9
+        try:
+            intent_response = await intent_task
+        except BaseException:
+            schema_task.cancel()
+            raise
+        self._cache_intent(request.messages, intent_response)
+
+        early_response = self._handle_intent(intent_response, request)
+        if early_response:
+            self._discard_speculation(schema_task, schema_prompt)
+            return early_response
+
+        updated_db = await self._map_or_regenerate_async(
+            await schema_task, request.messages, request.dialect, current_db_state
         )
+        return self._merge_subgraph(request, subgraph, updated_db)
+
+    def _discard_speculation(self, schema_task: asyncio.Task, schema_prompt: str):
+        wasted_texts = [SYSTEM_PROMPT, schema_prompt]
+        if not schema_task.done():
+            schema_task.cancel()
+        elif not schema_task.cancelled() and schema_task.exception() is None:
+            wasted_texts.append(schema_task.result())
+
+        wasted_tokens = self.llm_service._estimate_tokens(*wasted_texts)
+        self.speculation_stats["discarded"] += 1
+        self.speculation_stats["wasted_tokens"] += wasted_tokens
+        metrics.inc("chat2db_speculation_discarded_total", 1, "Discarded speculative schema generations")
+        metrics.inc("chat2db_speculation_wasted_tokens_total", wasted_tokens,
+                    "Estimated tokens spent on discarded speculative schema generations")
+        log_event("speculation_discarded", wasted_tokens=wasted_tokens,
+                  total_wasted_tokens=self.speculation_stats["wasted_tokens"])
+
+    def _select_subgraph(self, request: SchemaRequest) -> DbSchema | None:
+        """
+        Part of currentDb to send to the LLM instead of the whole schema, None to send everything.
+        """
+        if self.schema_subgraph is None:
+            return None
+        subgraph = self.schema_subgraph.select(request.currentDb, request.messages)
+        if subgraph is not None:
+            log_event("schema_subgraph", tables_sent=len(subgraph.tables), tables=len(request.currentDb.tables))
+        return subgraph
+
+    def _merge_subgraph(self, request: SchemaRequest, subgraph: DbSchema | None, updated_db: DbSchema) -> DbSchema:
+        if subgraph is None:
+            return updated_db
+        return SchemaSubgraph.merge(request.currentDb, subgraph, updated_db)
+
+    @staticmethod
+    def _request_key(request: SchemaRequest) -> str:
+        # dialect is optional, null means the default one. Imported here, sqlglot is slow to import
+        from services.ddl_compiler import normalize_dialect
+        return ResponseCache.key("schema", messages_fingerprint(request.messages), normalize_dialect(request.dialect),
+                                 schema_fingerprint(request.currentDb))
+
+    def _compact_history(self, request: SchemaRequest) -> SchemaRequest:
+        if self.history_compactor is None:
+            return request
+        messages = self.history_compactor.compact(request.messages)
+        if len(messages) == len(request.messages):
+            return request
+        log_event("history_compacted", messages_before=len(request.messages), messages_after=len(messages))
+        return request.model_copy(update={"messages": messages})
+
+    def _known_intent(self, request: SchemaRequest) -> str | None:
+        """
+        Intent answer that doesn't need the LLM: from the local classifier or the cache.
+        """
+        if self.intent_classifier is not None:
+            intent_response = self.intent_classifier.classify(request.messages, request.currentDb)
+            if intent_response is not None:
+                return intent_response
+        return self._cached_intent(request.messages)
+
+    def _ask_intent(self, request: SchemaRequest, known_intent: str | None) -> str:
+        if known_intent is not None:
+            return known_intent
+        with stage("intent"):
+            intent_response = self.llm_service.send_prompt(**self._intent_call(request.messages))
+        self._cache_intent(request.messages, intent_response)
+        return intent_response
+
+    async def _ask_intent_async(self, request: SchemaRequest, known_intent: str | None) -> str:
+        if known_intent is not None:
+            return known_intent
+        with stage("intent"):
+            intent_response = await self.llm_service.send_prompt_async(**self._intent_call(request.messages))
+        self._cache_intent(request.messages, intent_response)
+        return intent_response
+
+    def _cached_intent(self, messages: list[dict[str, str]]) -> str | None:
+        if self.response_cache is None:
+            return None
+        return self.response_cache.get(ResponseCache.key("intent", messages_fingerprint(messages)))
+
+    def _cache_intent(self, messages: list[dict[str, str]], intent_response: str):
+        if self.response_cache is None:
+            return
+        # Unparsable answers are not cached, the next attempt may succeed
+        try:
+            intent = IntentResult.model_validate_json(extract_json(intent_response))
+        except ValidationError:
+            return
+        self.response_cache.set(ResponseCache.key("intent", messages_fingerprint(messages)), intent.model_dump_json())
+
+    @staticmethod
+    def _handle_intent(intent_response: str, request: SchemaRequest) -> SchemaResponse | None:
+        """
+        Returns a final response when the message is not a schema request, otherwise None.
+        """
+        try:
+            intent = IntentResult.model_validate_json(extract_json(intent_response))
+        except ValidationError:
+            return SchemaResponse(
+                response="Sorry, I couldn't understand your question. Please try again.",
+                updatedDb=DbSchema(tables=[], relations=[])
+            )
+
+        if intent.was_related != "yes":
+            return SchemaResponse(
+                response=intent.answer or "Sorry, I cannot help with that.",
+                updatedDb=request.currentDb or DbSchema(tables=[], relations=[])
+            )
+        return None
+
+    def _summarize(self, request: SchemaRequest, updated_db: DbSchema) -> str | None:
+        """
+        LLM summary when it is requested, otherwise None and the local diff summary is used.
+        """
+        if not self.llm_summary:
+            return None
+        with stage("summary"):
+            return self.llm_service.send_prompt(**self._summary_call(request, updated_db))
 
+    async def _summarize_async(self, request: SchemaRequest, updated_db: DbSchema) -> str | None:
+        if not self.llm_summary:
+            return None
+        with stage("summary"):
+            return await self.llm_service.send_prompt_async(**self._summary_call(request, updated_db))
+
+    @staticmethod
+    def _schema_response(request: SchemaRequest, updated_db: DbSchema, summary: str | None) -> SchemaResponse:
+        diff = SchemaDiffer.diff(request.currentDb, updated_db)
         return SchemaResponse(
-            response=response_for_user,
-            updatedDb=updated_db
+            response=summary if summary is not None else SchemaDiffer.summarize(
+                diff, is_first_schema=not request.currentDb
+            ),
+            updatedDb=updated_db,
+            diff=diff,
+            issues=DatabaseService._response_issues(updated_db)
         )
 
+    @staticmethod
+    def _response_issues(updated_db: DbSchema) -> list[SchemaIssue]:
+        """
+        Repairs made to the LLM answer and the warnings about the schema the client gets, checked
+        after the patch or subgraph merge.
+        """
+        issues = {}
+        for issue in (mapping_issues.get() or []) + SchemaValidator.validate(updated_db):
+            # Warnings still true after the repairs are found by both checks
+            issues.setdefault((issue.code, issue.message), issue)
+        return list(issues.values())
+
+    # Parameters of the LLM calls, shared by the sync, async and streamed flows
+
+    @staticmethod
+    def _intent_call(messages: list[dict[str, str]]) -> dict:
+        return {
+            "user_prompt": DatabasePrompts.check_if_generate_schema(messages),
+            "system_prompt": SYSTEM_PROMPT,
+            "temperature": 0.2,
+            "response_model": IntentResult,
+        }
+
+    @staticmethod
+    def _schema_call(prompt: str, response_model: type[SchemaAnswer | SchemaPatch] = SchemaAnswer) -> dict:
+        return {"user_prompt": prompt, "system_prompt": SYSTEM_PROMPT, "response_model": response_model}
+
+    @staticmethod
+    def _summary_call(request: SchemaRequest, updated_db: DbSchema) -> dict:
+        return {
+            "user_prompt": DatabasePrompts.get_user_answer_template(
+                previous_db_state=SchemaCodec.encode(request.currentDb) if request.currentDb else None,
+                current_db_state=SchemaCodec.encode(updated_db),
+                user_question=request.messages
+            ),
+            "system_prompt": SYSTEM_PROMPT,
+            "temperature": 0.9,
+        }
+
     def _generate_sql_schema(
         self,
         user_messages: list[dict[str, str]],
         database_dialect: str,
         current_db_state: DbSchema = None
     ) -> DbSchema:
-        prompt = DatabasePrompts.generate_sql_schema(
-            user_messages=user_messages,
-            database_dialect=database_dialect,
-            current_db_state=current_db_state.model_dump_json() if current_db_state else None
-        )
+        with stage("schema"):
+            raw_response = self.llm_service.send_prompt(**self._schema_call(
+                self._build_schema_prompt(user_messages, database_dialect, current_db_state),
+                self._schema_response_model(current_db_state)
+            ))
+        return self._map_or_regenerate(raw_response, user_messages, database_dialect, current_db_state)
 
-        raw_response = self.llm_service.send_prompt(
-            user_prompt=prompt,
-            system_prompt="You are an expert in relational databases and SQL."
-        )
+    async def _generate_sql_schema_async(
+        self,
+        user_messages: list[dict[str, str]],
+        database_dialect: str,
+        current_db_state: DbSchema = None
+    ) -> DbSchema:
+        with stage("schema"):
+            raw_response = await self.llm_service.send_prompt_async(**self._schema_call(
+                self._build_schema_prompt(user_messages, database_dialect, current_db_state),
+                self._schema_response_model(current_db_state)
+            ))
+        return await self._map_or_regenerate_async(raw_response, user_messages, database_dialect, current_db_state)
 
-        try:
-            parsed = json.loads(raw_response)
-        except json.JSONDecodeError as e:
-            raise ValueError(f"Invalid JSON returned from LLM: {e}\nRaw response: {raw_response}")
+    def _map_or_regenerate(
+        self,
+        raw_response: str,
+        user_messages: list[dict[str, str]],
+        database_dialect: str,
+        current_db_state: DbSchema = None
+    ) -> DbSchema:
+        """
+        Maps the answer to the prompt built by _build_schema_prompt. A patch that can't be applied
+        falls back to a full schema prompt, a full schema that can't be parsed is asked for once more.
+        """
+        full_prompt = self._build_full_schema_prompt(user_messages, database_dialect, current_db_state)
+        if self._uses_patch(current_db_state):
+            updated_db = self._apply_patch(raw_response, current_db_state)
+            if updated_db is not None:
+                return updated_db
+            with stage("schema_fallback"):
+                raw_response = self.llm_service.send_prompt(**self._schema_call(full_prompt))
+        return self._map_full_or_reask(raw_response, full_prompt, current_db_state)
 
+    async def _map_or_regenerate_async(
+        self,
+        raw_response: str,
+        user_messages: list[dict[str, str]],
+        database_dialect: str,
+        current_db_state: DbSchema = None
+    ) -> DbSchema:
+        full_prompt = self._build_full_schema_prompt(user_messages, database_dialect, current_db_state)
+        if self._uses_patch(current_db_state):
+            updated_db = self._apply_patch(raw_response, current_db_state)
+            if updated_db is not None:
+                return updated_db
+            with stage("schema_fallback"):
+                raw_response = await self.llm_service.send_prompt_async(**self._schema_call(full_prompt))
+        return await self._map_full_or_reask_async(raw_response, full_prompt, current_db_state)
+
+    def _map_full_or_reask(self, raw_response: str, full_prompt: str, current_db_state: DbSchema = None) -> DbSchema:
+        aliases = SchemaCodec.aliases_for(current_db_state)
+        updated_db, reask_prompt = self._try_map_full_schema(raw_response, full_prompt, aliases)
+        if updated_db is not None:
+            return updated_db
+        with stage("schema_reask"):
+            raw_response = self.llm_service.send_prompt(**self._schema_call(reask_prompt))
+        return self._map_full_schema_response(raw_response, aliases)
+
+    async def _map_full_or_reask_async(self, raw_response: str, full_prompt: str,
+                                       current_db_state: DbSchema = None) -> DbSchema:
+        aliases = SchemaCodec.aliases_for(current_db_state)
+        updated_db, reask_prompt = self._try_map_full_schema(raw_response, full_prompt, aliases)
+        if updated_db is not None:
+            return updated_db
+        with stage("schema_reask"):
+            raw_response = await self.llm_service.send_prompt_async(**self._schema_call(reask_prompt))
+        return self._map_full_schema_response(raw_response, aliases)
+
+    def _try_map_full_schema(self, raw_response: str, full_prompt: str,
+                             aliases: dict[str, str]) -> tuple[DbSchema | None, str | None]:
+        """
+        The mapped schema, or None and the prompt asking for it once more.
+        """
         try:
-            schema = parsed["schema"]
-            raw_tables = schema["tables"]
-            raw_relations = schema["relations"]
+            return self._map_full_schema_response(raw_response, aliases), None
+        except SchemaAnswerError as e:
+            return None, self._build_reask_prompt(full_prompt, e)
+
+    @staticmethod
+    def _build_reask_prompt(full_prompt: str, error: SchemaAnswerError) -> str:
+        # The error message ends with the raw response, the model doesn't need it back
+        reason = str(error).split("\nRaw response:")[0][:500]
+        log_event("schema_reask", level="warning", error=reason)
+        metrics.inc("chat2db_schema_reask_total", 1, "Schema answers asked for again after a parse error")
+        return DatabasePrompts.fix_invalid_schema(full_prompt, reason)
 
-            tables = [Table(
-                table_id=table.get("table_id"),
-                name=table.get("name"),
-                columns=[Column(**col) for col in table.get("columns", [])]
-            ) for table in raw_tables]
+    def _uses_patch(self, current_db_state: DbSchema | None) -> bool:
+        return self.patch_mode and current_db_state is not None and len(current_db_state.tables) > 0
 
-            relations = self._deduplicate_many_to_many_relations(raw_relations)
-            # relations = self.add_table_ids_to_relations(relations)
+    def _schema_response_model(self, current_db_state: DbSchema | None) -> type[SchemaAnswer | SchemaPatch]:
+        # Answer to the prompt built by _build_schema_prompt
+        return SchemaPatch if self._uses_patch(current_db_state) else SchemaAnswer
 
-            return DbSchema(tables=tables, relations=relations)
+    def _build_schema_prompt(
+        self,
+        user_messages: list[dict[str, str]],
+        database_dialect: str,
+        current_db_state: DbSchema = None
+    ) -> str:
+        if self._uses_patch(current_db_state):
+            return DatabasePrompts.generate_schema_patch(
+                user_messages=user_messages,
+                database_dialect=database_dialect,
+                current_db_state=SchemaCodec.encode(current_db_state)
+            )
+        return self._build_full_schema_prompt(user_messages, database_dialect, current_db_state)
 
-        except (TypeError, KeyError, ValidationError) as e:
-            print("Failed map schema, wrong schema structure:")
-            print(json.dumps(parsed, indent=2))
-            raise ValueError(f"error: {e}")
+    @staticmethod
+    def _build_full_schema_prompt(
+        user_messages: list[dict[str, str]],
+        database_dialect: str,
+        current_db_state: DbSchema = None
+    ) -> str:
+        return DatabasePrompts.generate_sql_schema(
+            user_messages=user_messages,
+            database_dialect=database_dialect,
+            current_db_state=SchemaCodec.encode(current_db_state) if current_db_state else None
+        )
 
     @staticmethod
-    def _deduplicate_many_to_many_relations(relations: list[dict]) -> list[Relation]:
-        seen = set()
-        filtered = []
-
-        for rel in relations:
-            if rel["type"] == "many-to-many":
-                key = tuple(sorted([rel["from_table"], rel["to_table"]]))
-                if key not in seen:
-                    seen.add(key)
-                    filtered.append(rel)
-            else:
-                filtered.append(rel)
-
-        # Convert to Relation models
-        return [Relation(**rel) for rel in filtered]
+    def _apply_patch(raw_response: str, current_db_state: DbSchema) -> DbSchema | None:
+        """
+        Applies the edit operations of a patch answer, None when they can't be applied.
+        """
+        try:
+            with span("json_parse"):
+                operations = SchemaPatcher.parse(raw_response)
+            log_event("schema_patch", operations=len(operations))
+            with span("mapping"):
+                return SchemaPatcher.apply(current_db_state, operations, SchemaCodec.aliases_for(current_db_state))
+        except SchemaPatchError as e:
+            log_event("schema_patch_failed", level="warning", error=str(e))
+            return None
+
+    def _map_full_schema_response(self, raw_response: str, aliases: dict[str, str] = None) -> DbSchema:
+        try:
+            with span("mapping"):
+                updated_db, issues = SchemaValidator.parse(raw_response, aliases)
+        except SchemaValidationError as e:
+            log_event("schema_mapping_failed", level="error", error=str(e), response_chars=len(raw_response))
+            log_event("schema_mapping_failed_response", level="debug", response=raw_response)
+            if e.issues[0].code == "invalid_json":
+                raise SchemaAnswerError(f"Invalid JSON returned from LLM: {e}\nRaw response: {raw_response}")
+            raise SchemaAnswerError(f"error: {e}")
+
+        if issues:
+            log_event("schema_issues", level="warning", count=len(issues),
+                      codes=sorted({issue.code for issue in issues}))
+            recorded = mapping_issues.get()
+            if recorded is not None:
+                recorded.extend(issues)
+        return updated_db
@@ -0,0 +1,384 @@
+import heapq
+
+from sqlglot import exp
+from models import DbSchema, Table, Relation
+
+# Column types the schema prompts allow, mapped to generic sqlglot types.
+# sqlglot takes care of the dialect specific spelling when rendering.
+COLUMN_TYPES = {
+    "int": "INT",
+    "bigint": "BIGINT",
+    "smallint": "SMALLINT",
+    "float": "FLOAT",
+    "decimal": "DECIMAL(10, 2)",
+    "bool": "BOOLEAN",
+    "text": "TEXT",
+    "varchar": "VARCHAR(255)",
+    "date": "DATE",
+    "timestamp": "TIMESTAMP",
+    "uuid": "UUID",
+    "json": "JSON",
+    "blob": "BLOB",
+}
+
+# Generic types sqlglot renders in a way the dialect can't execute, replaced when rendering.
+# Sized types are kept as written, except VARCHAR which SQLite stores as TEXT.
+DIALECT_COLUMN_TYPES = {
+    "mysql": {exp.DataType.Type.UUID: "CHAR(36)", exp.DataType.Type.VARBINARY: "LONGBLOB"},
+    "oracle": {exp.DataType.Type.UUID: "CHAR(36)"},
+    "tsql": {exp.DataType.Type.VARBINARY: "VARBINARY(MAX)"},
+    "sqlite": {exp.DataType.Type.VARCHAR: "TEXT"},
+}
+
+# Dialect names used by the frontend/prompts that sqlglot spells differently
+DIALECT_ALIASES = {
+    "postgresql": "postgres",
+    "mssql": "tsql",
+    "sqlserver": "tsql",
+}
+
+# Common reserved words that show up as table/column names (order, user, group...)
+# and must be quoted in every dialect
+RESERVED_WORDS = {
+    "all", "and", "as", "asc", "between", "by", "case", "check", "column", "constraint", "create",
+    "cross", "current_date", "current_time", "current_timestamp", "current_user", "default", "delete",
+    "desc", "distinct", "drop", "else", "end", "exists", "false", "for", "foreign", "from", "full",
+    "grant", "group", "having", "in", "index", "inner", "insert", "into", "is", "join", "key", "left",
+    "like", "limit", "not", "null", "offset", "on", "or", "order", "outer", "primary", "references",
+    "right", "role", "select", "session_user", "set", "table", "then", "to", "true", "union", "unique",
+    "update", "user", "using", "values", "when", "where", "with",
+}
+
+
+class DDLCompilerError(Exception):
+    pass
+
+
+def normalize_dialect(dialect: str | None) -> str:
+    dialect = (dialect or "postgres").strip().lower()
+    return DIALECT_ALIASES.get(dialect, dialect)
+
+
+class _TableDraft:
+    """
+    Mutable per-table state collected while compiling relations.
+    """
+
+    def __init__(self, name: str, columns: list[tuple[str, str]], order: int):
+        self.name = name
+        self.columns = columns
+        self.order = order
+        self.primary_key: list[str] = []
+        self.unique: set[str] = set()
+        # (column, referenced table name, referenced column)
+        self.foreign_keys: list[tuple[str, str, str]] = []
+
+    def column_type(self, name: str) -> str:
+        for column_name, column_type in self.columns:
+            if column_name.lower() == name.lower():
+                return column_type
+        return "int"
+
+
+class DDLCompiler:
+    """
+    Compiles a DbSchema into CREATE TABLE statements locally, without an LLM round trip.
+
+    Primary keys are taken from an `id` column, foreign keys are derived from relations:
+    one-to-many/one-to-one put the key on `to_table`, many-to-many gets a junction table.
+    The output is deterministic for a given schema and dialect.
+    """
+
+    @staticmethod
+    def to_sql(schema: DbSchema, dialect: str = "postgres", pretty: bool = True) -> str:
+        dialect = normalize_dialect(dialect)
+        statements = DDLCompiler.compile(schema, dialect)
+        return DDLCompiler.render(statements, dialect, pretty)
+
+    @staticmethod
+    def compile_many(schema: DbSchema, dialects: list[str]) -> dict[str, list[exp.Expression]]:
+        """
+        Statements per dialect, compiled once and shared by dialects that compile the same way
+        (only SQLite differs). Raises DDLCompilerError like compile().
+        """
+        compiled: dict[bool, list[exp.Expression]] = {}
+        statements = {}
+        for dialect in dialects:
+            inline_forward_keys = normalize_dialect(dialect) == "sqlite"
+            if inline_forward_keys not in compiled:
+                compiled[inline_forward_keys] = DDLCompiler.compile(schema, dialect)
+            statements[dialect] = compiled[inline_forward_keys]
+        return statements
+
+    @staticmethod
+    def render(statements: list[exp.Expression], dialect: str = "postgres", pretty: bool = True) -> str:
+        dialect = normalize_dialect(dialect)
+        column_types = DIALECT_COLUMN_TYPES.get(dialect)
+        if column_types:
+            statements = [statement.transform(_dialect_type, column_types) for statement in statements]
+        try:
+            return "\n\n".join(f"{statement.sql(dialect=dialect, pretty=pretty)};" for statement in statements)
+        except ValueError as e:
+            raise DDLCompilerError(f"Unsupported dialect {dialect}: {e}")
+
+    @staticmethod
+    def compile(schema: DbSchema, dialect: str = "postgres") -> list[exp.Expression]:
+        if not schema.tables:
+            raise DDLCompilerError("Schema does not contain any tables.")
+
+        ordered = DDLCompiler.order_by_dependencies(DDLCompiler.drafts(schema))
+        created: set[str] = set()
+        statements: list[exp.Expression] = []
+        deferred: list[exp.Expression] = []
+        inline_forward_keys = normalize_dialect(dialect) == "sqlite"
+
+        for draft in ordered:
+            inline_keys = []
+            for fk in draft.foreign_keys:
+                referenced = fk[1].lower()
+                if referenced in created or referenced == draft.name.lower() or inline_forward_keys:
+                    inline_keys.append(fk)
+                else:
+                    # Cycle between tables, the referenced table is created later
+                    deferred.append(DDLCompiler._alter_add_foreign_key(draft, fk))
+            statements.append(DDLCompiler.create_table(draft, inline_keys))
+            created.add(draft.name.lower())
+
+        return statements + deferred
+
+    @staticmethod
+    def drafts(schema: DbSchema) -> dict[str, "_TableDraft"]:
+        """
+        Tables as they will be created, keyed by lowercase name: relations applied as foreign key
+        columns and constraints, many-to-many relations as junction tables.
+        """
+        drafts = DDLCompiler._build_drafts(schema)
+        tables_by_id = {table.table_id: drafts[table.name.lower()] for table in schema.tables}
+
+        for relation in schema.relations:
+            DDLCompiler._apply_relation(relation, drafts, tables_by_id)
+        return drafts
+
+    @staticmethod
+    def _build_drafts(schema: DbSchema) -> dict[str, _TableDraft]:
+        drafts: dict[str, _TableDraft] = {}
+        for order, table in enumerate(schema.tables):
+            key = table.name.lower()
+            if key in drafts:
+                raise DDLCompilerError(f"Duplicate table name: {table.name}")
+            draft = _TableDraft(table.name, [(column.name, column.type) for column in table.columns], order)
+            draft.primary_key = DDLCompiler._find_primary_key(table)
+            drafts[key] = draft
+        return drafts
+
+    @staticmethod
+    def _find_primary_key(table: Table) -> list[str]:
+        names = {column.name.lower(): column.name for column in table.columns}
+        for candidate in ("id", f"{_singular(table.name)}_id", f"{table.name}_id"):
+            if candidate.lower() in names:
+                return [names[candidate.lower()]]
+        return []
+
+    @staticmethod
+    def _resolve(table_id: str, table_name: str, drafts: dict[str, _TableDraft],
+                 tables_by_id: dict[str, _TableDraft]) -> _TableDraft:
+        draft = tables_by_id.get(table_id) or drafts.get((table_name or "").lower())
+        if draft is None:
+            raise DDLCompilerError(f"Relation references unknown table: {table_name} ({table_id})")
+        return draft
+
+    @staticmethod
+    def _apply_relation(relation: Relation, drafts: dict[str, _TableDraft],
+                        tables_by_id: dict[str, _TableDraft]):
+        parent = DDLCompiler._resolve(relation.from_table_id, relation.from_table, drafts, tables_by_id)
+        child = DDLCompiler._resolve(relation.to_table_id, relation.to_table, drafts, tables_by_id)
+
+        if relation.type == "many-to-many":
+            DDLCompiler._add_junction(parent, child, drafts)
+            return
+
+        column = DDLCompiler._add_foreign_key(child, parent)
+        if column and relation.type == "one-to-one":
+            child.unique.add(column)
+
+    @staticmethod
+    def _add_foreign_key(child: _TableDraft, parent: _TableDraft, column: str | None = None) -> str | None:
+        if not parent.primary_key:
+            return None
+        referenced_column = parent.primary_key[0]
+
+        if column is None:
+            column = DDLCompiler._find_reference_column(child, parent)
+        if column is None:
+            column = "parent_id" if child is parent else f"{_singular(parent.name)}_id"
+            child.columns.append((column, parent.column_type(referenced_column)))
+
+        fk = (column, parent.name, referenced_column)
+        if all(existing[0].lower() != column.lower() for existing in child.foreign_keys):
+            child.foreign_keys.append(fk)
+        return column
+
+    @staticmethod
+    def _find_reference_column(child: _TableDraft, parent: _TableDraft) -> str | None:
+        candidates = [f"{_singular(parent.name)}_id", f"{parent.name}_id"]
+        if child is parent:
+            candidates = ["parent_id", f"parent_{_singular(parent.name)}_id"]
+
+        existing = {name.lower(): name for name, _ in child.columns}
+        primary_key = {name.lower() for name in child.primary_key}
+        for candidate in candidates:
+            if candidate.lower() in existing and candidate.lower() not in primary_key:
+                return existing[candidate.lower()]
+        return None
+
+    @staticmethod
+    def _add_junction(left: _TableDraft, right: _TableDraft, drafts: dict[str, _TableDraft]):
+        for name in (f"{left.name}_{right.name}", f"{right.name}_{left.name}"):
+            junction = drafts.get(name.lower())
+            if junction is not None:
+                # The user already modelled the junction table, only link it
+                DDLCompiler._add_foreign_key(junction, left)
+                DDLCompiler._add_foreign_key(junction, right)
+                return
+
+        if not left.primary_key or not right.primary_key:
+            return
+
+        left_column = f"{_singular(left.name)}_id"
+        right_column = f"related_{_singular(right.name)}_id" if left is right else f"{_singular(right.name)}_id"
+        junction = _TableDraft(
+            name=f"{left.name}_{right.name}",
+            columns=[
+                (left_column, left.column_type(left.primary_key[0])),
+                (right_column, right.column_type(right.primary_key[0])),
+            ],
+            order=len(drafts)
+        )
+        junction.primary_key = [left_column, right_column]
+        DDLCompiler._add_foreign_key(junction, left, left_column)
+        DDLCompiler._add_foreign_key(junction, right, right_column)
+        drafts[junction.name.lower()] = junction
+
+    @staticmethod
+    def order_by_dependencies(drafts: dict[str, _TableDraft]) -> list[_TableDraft]:
+        """
+        Topological order so referenced tables are created first, ties keep schema order.
+        Tables left in a cycle are appended in schema order, references outside drafts are ignored.
+        """
+        dependencies = {
+            key: {fk[1].lower() for fk in draft.foreign_keys if fk[1].lower() != key and fk[1].lower() in drafts}
+            for key, draft in drafts.items()
+        }
+        dependents: dict[str, list[str]] = {key: [] for key in drafts}
+        for key, parents in dependencies.items():
+            for parent in parents:
+                dependents[parent].append(key)
+
+        ready = [(draft.order, key) for key, draft in drafts.items() if not dependencies[key]]
+        heapq.heapify(ready)
+        ordered: list[_TableDraft] = []
+        while ready:
+            _, key = heapq.heappop(ready)
+            ordered.append(drafts[key])
+            for dependent in dependents[key]:
+                dependencies[dependent].discard(key)
+                if not dependencies[dependent]:
+                    heapq.heappush(ready, (drafts[dependent].order, dependent))
+
+        placed = {draft.name.lower() for draft in ordered}
+        ordered.extend(sorted((d for k, d in drafts.items() if k not in placed), key=lambda d: d.order))
+        return ordered
+
+    @staticmethod
+    def create_table(draft: _TableDraft, foreign_keys: list[tuple[str, str, str]]) -> exp.Create:
+        """
+        CREATE TABLE for a draft, with the given foreign keys declared inline.
+        """
+        single_primary_key = draft.primary_key[0].lower() if len(draft.primary_key) == 1 else None
+        expressions: list[exp.Expression] = []
+
+        for name, column_type in draft.columns:
+            constraints = []
+            if name.lower() == single_primary_key:
+                constraints.append(exp.ColumnConstraint(kind=exp.PrimaryKeyColumnConstraint()))
+            elif name in draft.unique:
+                constraints.append(exp.ColumnConstraint(kind=exp.UniqueColumnConstraint()))
+            expressions.append(exp.ColumnDef(
+                this=identifier(name),
+                kind=data_type(column_type),
+                constraints=constraints
+            ))
+
+        if len(draft.primary_key) > 1:
+            expressions.append(exp.PrimaryKey(expressions=[identifier(name) for name in draft.primary_key]))
+
+        expressions.extend(foreign_key_constraint(draft.name, fk) for fk in foreign_keys)
+
+        return exp.Create(
+            this=exp.Schema(this=exp.Table(this=identifier(draft.name)), expressions=expressions),
+            kind="TABLE"
+        )
+
+    @staticmethod
+    def _alter_add_foreign_key(draft: _TableDraft, fk: tuple[str, str, str]) -> exp.Alter:
+        return exp.Alter(
+            this=exp.Table(this=identifier(draft.name)),
+            kind="TABLE",
+            actions=[exp.AddConstraint(expressions=[foreign_key_constraint(draft.name, fk)])]
+        )
+
+
+def foreign_key_name(table_name: str, column: str) -> str:
+    # Named the same way in CREATE TABLE and ALTER TABLE so migrations can drop them
+    return f"fk_{table_name}_{column}"
+
+
+def foreign_key_constraint(table_name: str, fk: tuple[str, str, str]) -> exp.Constraint:
+    return exp.Constraint(this=identifier(foreign_key_name(table_name, fk[0])), expressions=[_foreign_key(fk)])
+
+
+def _foreign_key(fk: tuple[str, str, str]) -> exp.ForeignKey:
+    column, referenced_table, referenced_column = fk
+    return exp.ForeignKey(
+        expressions=[identifier(column)],
+        reference=exp.Reference(
+            this=exp.Table(this=identifier(referenced_table)),
+            expressions=[identifier(referenced_column)]
+        )
+    )
+
+
+def identifier(name: str) -> exp.Identifier:
+    """
+    Identifier for a table, column or constraint name, quoted when it is a reserved word.
+    """
+    quoted = exp.to_identifier(name)
+    if name.lower() in RESERVED_WORDS:
+        quoted.set("quoted", True)
+    return quoted
+
+
+def data_type(column_type: str) -> exp.DataType:
+    """
+    sqlglot type of a schema column type, unknown types are passed through.
+    """
+    normalized = (column_type or "text").strip()
+    return exp.DataType.build(COLUMN_TYPES.get(normalized.lower(), normalized), udt=True)
+
+
+def _dialect_type(node: exp.Expression, column_types: dict[exp.DataType.Type, str]) -> exp.Expression:
+    if (isinstance(node, exp.DataType) and node.this in column_types
+            and (not node.expressions or node.this == exp.DataType.Type.VARCHAR)):
+        return exp.DataType.build(column_types[node.this], udt=True)
+    return node
+
+
+def _singular(name: str) -> str:
+    lowered = name.lower()
+    if lowered.endswith("ies") and len(name) > 3:
+        return name[:-3] + "y"
+    if lowered.endswith(("ses", "xes", "ches", "shes")):
+        return name[:-2]
+    if lowered.endswith("s") and not lowered.endswith("ss"):
+        return name[:-1]
+    return name
@@ -0,0 +1,137 @@
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Callable
+
+SUMMARY_PREFIX = "Summary of earlier requests (their effect is already in the current database state):"
+
+
+class HistoryCompactor:
+    """
+    Keeps prompt history within a token budget.
+
+    The newest turns are kept verbatim while they fit in `token_budget`. Older turns are
+    replaced by one rolling summary message built from the user requests only, which gets
+    `summary_share` of the budget, or dropped when `summarize` is False. The current schema
+    is always sent separately, so old turns rarely carry information the model still needs.
+    """
+
+    def __init__(
+        self,
+        estimate_tokens: Callable[..., int],
+        token_budget: int = 3000,
+        summarize: bool = True,
+        summary_share: float = 0.25,
+        summary_line_chars: int = 160,
+        cache_size: int = 512
+    ):
+        self.estimate_tokens = estimate_tokens
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.summary_share = summary_share
+        self.summary_line_chars = summary_line_chars
+        self.cache_size = cache_size
+        # running hash of a history prefix -> summary lines of that prefix
+        self._summaries: OrderedDict[str, list[str]] = OrderedDict()
+        self._token_counts: OrderedDict[str, int] = OrderedDict()
+
+    def compact(self, messages: list[dict[str, str]]) -> list[dict[str, str]]:
+        if not messages:
+            return messages
+
+        recent_budget = self.token_budget
+        if self.summarize:
+            recent_budget -= int(self.token_budget * self.summary_share)
+
+        kept: list[dict[str, str]] = []
+        used = 0
+        # The latest message is always kept, even if it alone exceeds the budget
+        for message in reversed(messages):
+            tokens = self._count_tokens(message)
+            if kept and used + tokens > recent_budget:
+                break
+            kept.append(message)
+            used += tokens
+        kept.reverse()
+
+        older = messages[:len(messages) - len(kept)]
+        if not older:
+            return messages
+        if not self.summarize:
+            return kept
+
+        summary = self._summary_message(older, self.token_budget - used)
+        return [summary] + kept if summary else kept
+
+    def _summary_message(self, older: list[dict[str, str]], budget: int) -> dict[str, str] | None:
+        lines = self._summary_lines(older)
+        if not lines or budget <= 0:
+            return None
+
+        # Keep the most recent requests that still fit into what is left of the budget
+        selected: list[str] = []
+        used = self.estimate_tokens(SUMMARY_PREFIX)
+        for line in reversed(lines):
+            tokens = self.estimate_tokens(line)
+            if used + tokens > budget:
+                break
+            selected.append(line)
+            used += tokens
+        if not selected:
+            return None
+
+        selected.reverse()
+        return {"role": "system", "content": "\n".join([SUMMARY_PREFIX] + selected)}
+
+    def _summary_lines(self, older: list[dict[str, str]]) -> list[str]:
+        """
+        Rolling summary: reuse the longest cached prefix and only summarize the new turns.
+        """
+        prefix_hashes = []
+        running = hashlib.sha256()
+        for message in older:
+            running.update(_message_key(message).encode())
+            prefix_hashes.append(running.hexdigest())
+
+        start, lines = 0, []
+        for index in range(len(prefix_hashes) - 1, -1, -1):
+            cached = self._summaries.get(prefix_hashes[index])
+            if cached is not None:
+                self._summaries.move_to_end(prefix_hashes[index])
+                start, lines = index + 1, cached
+                break
+
+        if start < len(older):
+            lines = lines + [self._summarize_message(message) for message in older[start:]]
+            lines = [line for line in lines if line]
+            self._remember(self._summaries, prefix_hashes[-1], lines)
+        return lines
+
+    def _summarize_message(self, message: dict[str, str]) -> str:
+        # Assistant answers only describe schema changes that currentDb already contains
+        if message.get("role", "user") != "user":
+            return ""
+        content = " ".join(str(message.get("content", "")).split())
+        if len(content) > self.summary_line_chars:
+            content = content[:self.summary_line_chars].rstrip() + "..."
+        return f"- {content}" if content else ""
+
+    def _count_tokens(self, message: dict[str, str]) -> int:
+        key = _message_key(message)
+        tokens = self._token_counts.get(key)
+        if tokens is None:
+            tokens = self.estimate_tokens(key)
+            self._remember(self._token_counts, key, tokens)
+        else:
+            self._token_counts.move_to_end(key)
+        return tokens
+
+    def _remember(self, cache: OrderedDict, key: str, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+
+def _message_key(message: dict[str, str]) -> str:
+    return json.dumps(message, sort_keys=True, ensure_ascii=False)
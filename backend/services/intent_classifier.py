@@ -0,0 +1,165 @@
+import json
+import re
+
+from models import DbSchema
+from services.metrics import metrics
+
+GREETING_ANSWER = "Hello! Describe the database you need and I will design the schema for you."
+THANKS_ANSWER = "Thank you, I'm glad I could help!"
+CAPABILITIES_ANSWER = ("I help with creating and updating database schemas. Describe your application "
+                       "or ask me to add, change or remove tables, columns and relations.")
+OFF_TOPIC_ANSWER = ("Sorry, I cannot help with this question. My job is to help with creating "
+                    "or updating database schema.")
+
+_WORD = re.compile(r"[a-z0-9_]+(?:'[a-z]+)?")
+
+GREETING_ANCHORS = {"hi", "hello", "hey", "heya", "hiya", "yo", "sup", "morning", "evening", "afternoon",
+                    "greetings", "howdy"}
+GREETING_PHRASES = ("how are you", "what's up", "whats up", "how's it going", "hows it going", "how is it going")
+GREETING_WORDS = {
+    "hi", "hello", "hey", "heya", "hiya", "yo", "sup", "morning", "evening", "afternoon", "good", "day",
+    "there", "greetings", "howdy", "welcome", "whats", "what's", "up", "how", "are", "you", "doing", "hows",
+    "it", "going",
+}
+# A thank-you needs one of these, the filler words alone ("is this good?", "that's it for the
+# users table") are just as likely a question about the schema
+THANKS_ANCHORS = {
+    "thanks", "thank", "thx", "ty", "cheers", "appreciate", "bye", "goodbye", "great", "awesome", "nice",
+    "cool", "perfect", "amazing", "excellent", "wonderful", "brilliant", "love",
+}
+THANKS_PHRASES = ("well done", "good job", "looks good")
+THANKS_WORDS = THANKS_ANCHORS | {
+    "you", "so", "much", "very", "a", "lot", "job", "work", "it", "that's", "thats", "good", "well", "done",
+    "ok", "okay", "for", "the", "help", "your", "this", "is", "looks",
+}
+CAPABILITY_PHRASES = (
+    "what can you do", "what do you do", "who are you", "what are you", "how can you help",
+    "what can i ask", "how do you work", "how does this work", "what is this",
+)
+
+# DDL and data modelling vocabulary, one of these makes a message a schema request
+SCHEMA_NOUNS = {
+    "table", "tables", "column", "columns", "field", "fields", "schema", "schemas", "database", "db",
+    "relation", "relations", "relationship", "relationships", "foreign", "primary", "key", "keys", "index",
+    "indexes", "entity", "entities", "attribute", "attributes", "constraint", "constraints", "junction",
+    "erd", "diagram", "model", "models", "normalize", "normalise", "varchar", "int", "integer", "bigint",
+    "text", "timestamp", "uuid", "boolean", "bool", "decimal", "json", "blob", "date", "nullable", "fk", "pk",
+    "one-to-many", "many-to-many", "one-to-one",
+}
+SCHEMA_PHRASES = ("one to many", "many to many", "one to one", "foreign key", "primary key", "data model")
+SCHEMA_VERBS = {
+    "add", "create", "remove", "delete", "drop", "rename", "change", "update", "alter", "make", "design",
+    "build", "generate", "store", "link", "connect", "split", "merge", "extend", "modify", "replace",
+    "include", "insert", "need", "want", "track", "keep", "save", "move",
+}
+# Application domains people describe when they want a new schema ("an app for a library")
+DOMAIN_WORDS = {
+    "app", "application", "system", "shop", "store", "e-commerce", "ecommerce", "platform", "website",
+    "service", "crm", "erp", "blog", "marketplace", "inventory", "booking", "management", "backend",
+}
+OFF_TOPIC_WORDS = {
+    "weather", "joke", "jokes", "poem", "song", "recipe", "movie", "movies", "football", "president",
+    "capital", "translate", "news", "stock", "bitcoin", "horoscope", "story", "essay", "homework",
+    "girlfriend", "boyfriend", "game", "politics", "meaning", "life",
+}
+
+
+class IntentClassifier:
+    """
+    Local rule-based intent check run before the LLM intent prompt.
+
+    Greetings, thanks, capability questions and clearly off-topic messages get a canned
+    answer; messages with DDL vocabulary, or a change verb together with a table or column
+    of the current schema, are schema requests. Anything scored below `threshold` is left to
+    the LLM, which also handles follow-ups that only make sense with the conversation history.
+    """
+
+    def __init__(self, threshold: float = 0.8):
+        self.threshold = threshold
+        self.stats = {"decided": 0, "ambiguous": 0}
+
+    def classify(self, messages: list[dict[str, str]], current_db: DbSchema = None) -> str | None:
+        """
+        Returns an intent response in the format of the LLM intent prompt, or None when unsure.
+        """
+        was_related, answer, confidence = self.score(messages, current_db)
+        if confidence < self.threshold:
+            self.stats["ambiguous"] += 1
+            metrics.inc("chat2db_intent_local_total", 1, "Local intent classifications", result="ambiguous")
+            return None
+        self.stats["decided"] += 1
+        metrics.inc("chat2db_intent_local_total", 1, "Local intent classifications", result="decided")
+        return json.dumps({"was_related": "yes" if was_related else "no", "answer": answer})
+
+    @staticmethod
+    def score(messages: list[dict[str, str]], current_db: DbSchema = None) -> tuple[bool, str, float]:
+        """
+        Returns (was_related, canned answer, confidence) for the latest user message.
+        """
+        message = _last_user_message(messages)
+        if not message:
+            return False, "", 0.0
+
+        text = " ".join(message.lower().split())
+        words = _WORD.findall(text.replace("-", "_"))
+        word_set = set(words) | {word.replace("_", "-") for word in words}
+        if not words:
+            return False, "", 0.0
+
+        schema_names = _schema_names(current_db)
+        has_schema_noun = bool(word_set & SCHEMA_NOUNS) or any(phrase in text for phrase in SCHEMA_PHRASES)
+        has_verb = bool(word_set & SCHEMA_VERBS)
+        mentions_schema = bool(word_set & schema_names)
+
+        if has_schema_noun and (has_verb or mentions_schema):
+            return True, "", 0.95
+        if has_verb and mentions_schema:
+            return True, "", 0.9
+        if has_verb and word_set & DOMAIN_WORDS:
+            return True, "", 0.85
+        if has_schema_noun:
+            return True, "", 0.75
+
+        if any(phrase in text for phrase in CAPABILITY_PHRASES):
+            return False, CAPABILITIES_ANSWER, 0.9
+        is_greeting = set(words) & GREETING_ANCHORS or any(phrase in text for phrase in GREETING_PHRASES)
+        if len(words) <= 8 and set(words) <= GREETING_WORDS and is_greeting:
+            return False, GREETING_ANSWER, 0.95
+        # A question ("is this good?") asks for a review, not for a canned thank-you
+        is_thanks = set(words) & THANKS_ANCHORS or any(phrase in text for phrase in THANKS_PHRASES)
+        if (len(words) <= 10 and not text.endswith("?") and set(words) <= THANKS_WORDS | GREETING_WORDS
+                and is_thanks):
+            return False, THANKS_ANSWER, 0.95
+        if word_set & OFF_TOPIC_WORDS and not mentions_schema:
+            return False, OFF_TOPIC_ANSWER, 0.85
+
+        return False, "", 0.0
+
+
+def _last_user_message(messages: list[dict[str, str]]) -> str:
+    for message in reversed(messages):
+        if message.get("role", "user") == "user":
+            return str(message.get("content", ""))
+    return ""
+
+
+def _schema_names(current_db: DbSchema | None) -> set[str]:
+    if current_db is None:
+        return set()
+    names = set()
+    for table in current_db.tables:
+        names.update(_name_variants(table.name))
+        for column in table.columns:
+            if column.name not in ("id",):
+                names.update(_name_variants(column.name))
+    return names
+
+
+def _name_variants(name: str) -> set[str]:
+    name = name.lower()
+    variants = {name}
+    if name.endswith("s"):
+        variants.add(name[:-1])
+    else:
+        variants.add(name + "s")
+    return variants
@@ -0,0 +1,55 @@
+import re
+
+_FENCE = re.compile(r"```[\w+-]*[ \t]*\n?(.*?)\n?[ \t]*```", re.DOTALL)
+
+
+def strip_code_fence(text: str) -> str:
+    """
+    Content of the first fenced block (```sql ... ```), or the text itself when there is none.
+    """
+    match = _FENCE.search(text)
+    return match.group(1).strip() if match else text.strip()
+
+
+def extract_json(text: str) -> str:
+    """
+    The JSON value in an LLM answer that is not only JSON: fenced in a code block, or with prose
+    before or after it. Returns the first balanced {...} or [...] and the stripped text when
+    there is none, so the parser reports the error. Answers constrained by a response schema
+    are plain JSON and come back unchanged.
+    """
+    text = text.strip()
+    if text[:1] in "{[" and text[-1:] in "}]":
+        return text
+
+    text = strip_code_fence(text)
+    starts = [index for index in (text.find("{"), text.find("[")) if index >= 0]
+    if not starts:
+        return text
+    start = min(starts)
+    end = _closing_bracket(text, start)
+    return text[start:end + 1] if end is not None else text[start:]
+
+
+def _closing_bracket(text: str, start: int) -> int | None:
+    depth = 0
+    in_string = False
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                return index
+    return None
@@ -1,177 +1,470 @@
+import asyncio
+import json
+import threading
+import time
 from abc import ABC, abstractmethod
-import requests
-import boto3
-import tiktoken
-from botocore.exceptions import ClientError
-from datetime import datetime
-import decimal
+from contextlib import contextmanager, asynccontextmanager
+from typing import AsyncIterator
+import httpx
+from pydantic import BaseModel
+from services import tokenizer
+from services.llm_transport import LLMTransport, LLMTransportError
+from services.response_schema import json_schema, strict_json_schema
+from services.metrics import (
+    metrics, span, log_event, record_llm_usage, record_llm_generation, PROMPT_TOKEN_PRICE, CACHED_PROMPT_TOKEN_PRICE
+)
+from services.token_ledger import TokenLedger, TokenStore, DynamoDBTokenStore, TokenLimitError
+
+# Fallback for requests that don't go through the transport, which sets its own per-attempt timeout
+DEFAULT_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
 
 
-
-class TokenLimitError(Exception):
-    pass
-
 class LLMClient(ABC):
     """
     Abstract base class for any Large Language Model client.
+    Sync and async variants share one keep-alive connection pool per client, requests go
+    through the transport for timeouts, retries and the circuit breaker.
+
+    Prompts given a response_model get an answer that validates against it: the provider
+    constrains the generation to its JSON schema, or with structured_output=False the schema
+    is added to the prompt.
     """
 
-    def __init__(self, url: str, model: str, token_limit: int):
+    def __init__(self, url: str, model: str, token_limit: int, max_connections: int = 20,
+                 token_store: TokenStore = None, transport: LLMTransport = None, structured_output: bool = True,
+                 token_block_size: int = 20000):
         self.url = url
         self.model = model
+        self.structured_output = structured_output
         self.token_limit = token_limit
-        self.year_month = datetime.now().strftime("%Y-%m")
-        self.dynamodb_table = "Chat2dbTokenUsage"
-        self.current_tokens = self._fetch_current_tokens()
+        self.token_ledger = TokenLedger(token_store or DynamoDBTokenStore(), token_limit, block_size=token_block_size)
+        # Updated on each reservation, fetching it here would put a store round trip on the cold start path
+        self.current_tokens = 0
+        self.http_limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections
+        )
+        self.transport = transport or LLMTransport()
+        self._http_client = None
+        self._http_client_lock = threading.Lock()
+        self._async_http_client = None
+        self._async_http_loop = None
 
     @abstractmethod
-    def send_prompt(self, user_prompt: str, system_prompt: str, temperature: float = 0) -> str:
+    def send_prompt(self, user_prompt: str, system_prompt: str, temperature: float = 0,
+                    response_model: type[BaseModel] = None) -> str:
         pass
 
-    def _fetch_current_tokens(self) -> int:
+    @abstractmethod
+    async def send_prompt_async(self, user_prompt: str, system_prompt: str, temperature: float = 0,
+                                response_model: type[BaseModel] = None) -> str:
+        pass
+
+    async def stream_prompt_async(self, user_prompt: str, system_prompt: str, temperature: float = 0,
+                                  response_model: type[BaseModel] = None) -> AsyncIterator[str]:
         """
-        Fetch current monthly token usage from DynamoDB.
+        Yields the response in chunks as the model generates it.
+        Clients without streaming support yield the whole response at once.
         """
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table(self.dynamodb_table)
+        yield await self.send_prompt_async(user_prompt, system_prompt, temperature, response_model)
 
-        try:
-            response = table.get_item(Key={'year_month': self.year_month})
-            item = response.get('Item', {})
-            return int(item.get('tokens_used', 0))
-        except ClientError as e:
-            print(f"DynamoDB get_item error: {e.response['Error']['Message']}")
-            return 0
+    @property
+    def http_client(self) -> httpx.Client:
+        """
+        The pooled sync client, opened on first use and again after close().
+        """
+        with self._http_client_lock:
+            if self._http_client is None or self._http_client.is_closed:
+                self._http_client = httpx.Client(limits=self.http_limits, timeout=DEFAULT_TIMEOUT)
+            return self._http_client
 
-    def _check_and_update_token_usage(self, estimated_tokens: int):
+    def _get_async_http_client(self) -> httpx.AsyncClient:
+        """
+        Return the pooled async client, recreating it if the running event loop changed
+        (httpx connections are bound to the loop they were opened on).
         """
-        Atomically check and update token usage in DynamoDB to avoid race conditions.
+        loop = asyncio.get_running_loop()
+        if self._async_http_client is None or self._async_http_loop is not loop:
+            self._async_http_client = httpx.AsyncClient(limits=self.http_limits, timeout=DEFAULT_TIMEOUT)
+            self._async_http_loop = loop
+        return self._async_http_client
+
+    async def aclose(self):
+        if self._async_http_client is not None:
+            await self._async_http_client.aclose()
+            self._async_http_client = None
+            self._async_http_loop = None
+
+    def close(self):
         """
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table(self.dynamodb_table)
+        Closes the connection pools and settles the token ledger. The client stays usable,
+        the next request opens a new pool.
+        """
+        with self._http_client_lock:
+            http_client, self._http_client = self._http_client, None
+        if http_client is not None:
+            http_client.close()
+        self.token_ledger.close()
+
+    def _build_messages(self, user_prompt: str, system_prompt: str,
+                        response_model: type[BaseModel] = None) -> list[dict[str, str]]:
+        if response_model is not None and not self.structured_output:
+            # The answer isn't constrained, the prompt has to describe its shape
+            user_prompt = (f"{user_prompt.strip()}\n\nRespond with JSON that matches this JSON schema:\n"
+                           f"{json.dumps(json_schema(response_model))}")
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt.strip()}
+        ]
 
-        try:
-            response = table.update_item(
-                Key={'year_month': self.year_month},
-                UpdateExpression="SET tokens_used = if_not_exists(tokens_used, :zero) + :inc",
-                ConditionExpression="tokens_used <= :limit OR attribute_not_exists(tokens_used)",
-                ExpressionAttributeValues={
-                    ':inc': decimal.Decimal(estimated_tokens),
-                    ':limit': decimal.Decimal(self.token_limit - estimated_tokens),
-                    ':zero': decimal.Decimal(0)
-                },
-                ReturnValues="UPDATED_NEW"
-            )
-            self.current_tokens = int(response["Attributes"]["tokens_used"])
-            print("tokens used ",self.current_tokens)
+    def _fetch_current_tokens(self) -> int:
+        """
+        Fetch current monthly token usage from the token store.
+        """
+        return self.token_ledger.store.get(self.token_ledger.year_month)
+
+    def _check_and_update_token_usage(self, estimated_tokens: int):
+        """
+        Charge the estimate against the local reservation, reserving a new block from the store if needed.
+        """
+        self.token_ledger.charge(estimated_tokens)
+        self.current_tokens = self.token_ledger.tokens_used
 
-        except ClientError as e:
-            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
-                raise TokenLimitError("Token limit exceeded. Please try again later.")
-            else:
-                raise
+    async def _check_and_update_token_usage_async(self, estimated_tokens: int):
+        if self.token_ledger.try_charge(estimated_tokens):
+            return
+        # reserving a new block talks to the store, keep it off the event loop
+        await asyncio.to_thread(self._check_and_update_token_usage, estimated_tokens)
 
     def _estimate_tokens(self, *texts: str) -> int:
         """
         Estimate token usage as word count sum.
         """
-        encoding = tiktoken.get_encoding("o200k_base")
-        return sum(len(encoding.encode(text)) for text in texts)
+        return tokenizer.count_tokens(*texts)
 
 class OpenAiClient(LLMClient):
     """
     Implementation of LLMClient using OpenAI API.
     """
 
-    def __init__(self, api_key: str, token_limit: int, model: str):
-        super().__init__(url="https://api.openai.com/v1/chat/completions", model=model, token_limit=token_limit)
+    def __init__(self, api_key: str, token_limit: int, model: str, token_store: TokenStore = None,
+                 transport: LLMTransport = None, url: str = "https://api.openai.com/v1/chat/completions",
+                 structured_output: bool = True, token_block_size: int = 20000,
+                 discount_cached_tokens: bool = False):
+        super().__init__(
+            url=url,
+            model=model,
+            token_limit=token_limit,
+            token_store=token_store,
+            transport=transport,
+            structured_output=structured_output,
+            token_block_size=token_block_size
+        )
         self.api_key = api_key
+        # The monthly limit counts raw tokens unless cached prompt tokens should count by what they cost
+        self.discount_cached_tokens = discount_cached_tokens
 
-    def send_prompt(self, user_prompt: str, system_prompt: str, temperature: float = 0.7) -> str:
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt.strip()}
-        ]
-
+    def send_prompt(self, user_prompt: str, system_prompt: str, temperature: float = 0.7,
+                    response_model: type[BaseModel] = None) -> str:
         estimated_tokens = self._estimate_tokens(system_prompt, user_prompt)
         self._check_and_update_token_usage(estimated_tokens)
 
-        headers = {
+        with span("llm_call"):
+            response = self.transport.post(
+                self.http_client,
+                self.url,
+                headers=self._headers(),
+                json=self._build_payload(user_prompt, system_prompt, temperature, response_model)
+            )
+
+        content, usage = self._parse_response(response)
+        self._record_usage(estimated_tokens, usage)
+        return content
+
+    async def send_prompt_async(self, user_prompt: str, system_prompt: str, temperature: float = 0.7,
+                                response_model: type[BaseModel] = None) -> str:
+        estimated_tokens = self._estimate_tokens(system_prompt, user_prompt)
+        await self._check_and_update_token_usage_async(estimated_tokens)
+
+        with span("llm_call"):
+            response = await self.transport.post_async(
+                self._get_async_http_client(),
+                self.url,
+                headers=self._headers(),
+                json=self._build_payload(user_prompt, system_prompt, temperature, response_model)
+            )
+
+        content, usage = self._parse_response(response)
+        self._record_usage(estimated_tokens, usage)
+        return content
+
+    async def stream_prompt_async(self, user_prompt: str, system_prompt: str, temperature: float = 0.7,
+                                  response_model: type[BaseModel] = None) -> AsyncIterator[str]:
+        estimated_tokens = self._estimate_tokens(system_prompt, user_prompt)
+        await self._check_and_update_token_usage_async(estimated_tokens)
+
+        payload = self._build_payload(user_prompt, system_prompt, temperature, response_model)
+        payload["stream"] = True
+        # The last chunk then carries the usage of the whole completion
+        payload["stream_options"] = {"include_usage": True}
+
+        usage = {}
+        with span("llm_call"):
+            async for content in self._stream_chunks(payload, usage):
+                yield content
+        self._record_usage(estimated_tokens, usage)
+
+    async def _stream_chunks(self, payload: dict, usage: dict) -> AsyncIterator[str]:
+        response = await self.transport.send_stream_async(
+            self._get_async_http_client(), self.url, headers=self._headers(), json=payload
+        )
+        try:
+            if response.status_code != 200:
+                raise LLMTransportError(
+                    f"OpenAI API error: {response.status_code} - {response.text}", status_code=response.status_code
+                )
+
+            # Server-sent events, one `data: {...}` line per chunk
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if chunk.get("usage"):
+                    usage.update(chunk["usage"])
+                for choice in chunk.get("choices", []):
+                    content = choice.get("delta", {}).get("content")
+                    if content:
+                        yield content
+        finally:
+            await response.aclose()
+
+    def _headers(self) -> dict[str, str]:
+        return {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
 
+    def _build_payload(self, user_prompt: str, system_prompt: str, temperature: float,
+                       response_model: type[BaseModel] = None) -> dict:
         payload = {
             "model": self.model,
-            "messages": messages,
+            "messages": self._build_messages(user_prompt, system_prompt, response_model),
             "temperature": temperature
         }
-
-        response = requests.post(self.url, headers=headers, json=payload)
-
-        if response.status_code != 200:
-            raise Exception(f"OpenAI API error: {response.status_code} - {response.text}")
-
-        json_response = response.json()
-        content = json_response["choices"][0]["message"]["content"]
-
-        total_tokens = json_response.get("usage", {}).get("total_tokens")
-        if total_tokens is not None:
-            self._add_token_usage(total_tokens)
-
-        return content
-
-    def _add_token_usage(self, tokens: int):
+        if response_model is not None and self.structured_output:
+            payload["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": response_model.__name__,
+                    "strict": True,
+                    "schema": strict_json_schema(response_model)
+                }
+            }
+        return payload
+
+    def _record_usage(self, estimated_tokens: int, usage: dict):
+        cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        if usage.get("total_tokens") is not None:
+            discount = self._cache_discount(cached_tokens) if self.discount_cached_tokens else 0
+            self.token_ledger.settle(estimated_tokens, usage["total_tokens"] - discount)
+        # Cached tokens are always reported in the metrics, whether or not the limit discounts them
+        record_llm_usage(usage.get("prompt_tokens"), usage.get("completion_tokens"), cached_tokens=cached_tokens)
+
+    @staticmethod
+    def _cache_discount(cached_tokens: int) -> int:
         """
-        Add actual token usage (from OpenAI API response) to DynamoDB without condition.
+        Tokens to take off the total so cached prompt tokens count by what they cost, they are billed at a discount.
         """
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table(self.dynamodb_table)
+        if not cached_tokens or not PROMPT_TOKEN_PRICE:
+            return 0
+        return int(cached_tokens * max(0.0, 1 - CACHED_PROMPT_TOKEN_PRICE / PROMPT_TOKEN_PRICE))
 
-        try:
-            table.update_item(
-                Key={'year_month': self.year_month},
-                UpdateExpression="SET tokens_used = if_not_exists(tokens_used, :zero) + :inc",
-                ExpressionAttributeValues={
-                    ':inc': decimal.Decimal(tokens),
-                    ':zero': decimal.Decimal(0)
-                }
+    @staticmethod
+    def _parse_response(response: httpx.Response) -> tuple[str, dict]:
+        if response.status_code != 200:
+            raise LLMTransportError(
+                f"OpenAI API error: {response.status_code} - {response.text}", status_code=response.status_code
             )
-        except ClientError as e:
-            print(f"Failed to update output tokens: {e}")
+
+        json_response = response.json()
+        message = json_response["choices"][0]["message"]
+        if message.get("refusal"):
+            # Structured outputs answer a refused request with a refusal instead of content
+            log_event("llm_refusal", level="warning", refusal=message["refusal"])
+        return message.get("content") or "", json_response.get("usage") or {}
 
 
 class OllamaClient(LLMClient):
     """
     Implementation of LLMClient using Ollama.
     Ollama does not enforce or require token limits.
-    """
 
-    def __init__(self, url: str = "http://localhost:11434/api/chat", model: str = "llama3"):
-        super().__init__(url=url, model=model, token_limit=0)
+    The model stays loaded for keep_alive after each request (-1 keeps it loaded) and preload()
+    loads it before the first request. Sampling and context size go in options. At most
+    max_concurrency generations run at once, the other requests wait for a free slot instead
+    of making the local model slower for all of them (0 doesn't limit). With stream=True,
+    send_prompt_async streams the answer too, so the time to the first token is measured.
+    """
 
-    def send_prompt(self, user_prompt: str, system_prompt: str, temperature: float = 0) -> str:
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt.strip()}
-        ]
+    def __init__(self, url: str = "http://localhost:11434/api/chat", model: str = "llama3",
+                 transport: LLMTransport = None, keep_alive: str | int | None = None,
+                 num_ctx: int | None = None, options: dict | None = None,
+                 max_concurrency: int = 0, stream: bool = False, structured_output: bool = True):
+        super().__init__(url=url, model=model, token_limit=0, transport=transport,
+                         structured_output=structured_output)
+        self.keep_alive = keep_alive
+        self.options = dict(options or {})
+        if num_ctx:
+            self.options["num_ctx"] = num_ctx
+        self.max_concurrency = max_concurrency
+        self.stream = stream
+        self._slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency > 0 else None
+        # asyncio semaphores are bound to one event loop, like the async http client
+        self._async_slots = None
+        self._async_slots_loop = None
+
+    def preload(self):
+        """
+        Loads the model into memory, an empty chat request only loads it.
+        """
+        payload = {"model": self.model, "messages": []}
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        with span("llm_preload"):
+            response = self.transport.post(self.http_client, self.url, json=payload)
+        if response.status_code != 200:
+            raise LLMTransportError(
+                f"Ollama error: {response.status_code} - {response.text}", status_code=response.status_code
+            )
+        log_event("llm_preloaded", model=self.model, keep_alive=self.keep_alive,
+                  load_ms=round(response.json().get("load_duration", 0) / 1e6, 1))
 
+    def send_prompt(self, user_prompt: str, system_prompt: str, temperature: float = 0,
+                    response_model: type[BaseModel] = None) -> str:
         # Skip token tracking entirely for Ollama
-        response = requests.post(
-            self.url,
-            json={
-                "model": self.model,
-                "messages": messages,
-                "stream": False,
-                "temperature": temperature
-            }
-        )
-
+        with self._generation_slot(), span("llm_call"):
+            response = self.transport.post(
+                self.http_client,
+                self.url,
+                json=self._build_payload(user_prompt, system_prompt, temperature, response_model)
+            )
+        return self._parse_response(response)
+
+    async def send_prompt_async(self, user_prompt: str, system_prompt: str, temperature: float = 0,
+                                response_model: type[BaseModel] = None) -> str:
+        if self.stream:
+            return "".join([chunk async for chunk in self.stream_prompt_async(
+                user_prompt, system_prompt, temperature, response_model
+            )])
+
+        async with self._generation_slot_async():
+            with span("llm_call"):
+                response = await self.transport.post_async(
+                    self._get_async_http_client(),
+                    self.url,
+                    json=self._build_payload(user_prompt, system_prompt, temperature, response_model)
+                )
+        return self._parse_response(response)
+
+    async def stream_prompt_async(self, user_prompt: str, system_prompt: str, temperature: float = 0,
+                                  response_model: type[BaseModel] = None) -> AsyncIterator[str]:
+        payload = self._build_payload(user_prompt, system_prompt, temperature, response_model)
+        payload["stream"] = True
+
+        async with self._generation_slot_async():
+            with span("llm_call"):
+                async for content in self._stream_chunks(payload):
+                    yield content
+
+    async def _stream_chunks(self, payload: dict) -> AsyncIterator[str]:
+        started = time.perf_counter()
+        first_token = None
+        response = await self.transport.send_stream_async(self._get_async_http_client(), self.url, json=payload)
+        try:
+            if response.status_code != 200:
+                raise LLMTransportError(
+                    f"Ollama error: {response.status_code} - {response.text}", status_code=response.status_code
+                )
+
+            # Newline delimited JSON, one message chunk per line
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                content = chunk.get("message", {}).get("content")
+                if content:
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                    yield content
+                if chunk.get("done"):
+                    self._record_generation(chunk, first_token)
+                    break
+        finally:
+            await response.aclose()
+
+    @contextmanager
+    def _generation_slot(self):
+        if self._slots is None:
+            yield
+            return
+        started = time.perf_counter()
+        with self._slots:
+            _observe_queue_wait(started)
+            yield
+
+    @asynccontextmanager
+    async def _generation_slot_async(self):
+        if self.max_concurrency <= 0:
+            yield
+            return
+        loop = asyncio.get_running_loop()
+        if self._async_slots is None or self._async_slots_loop is not loop:
+            self._async_slots = asyncio.Semaphore(self.max_concurrency)
+            self._async_slots_loop = loop
+        started = time.perf_counter()
+        async with self._async_slots:
+            _observe_queue_wait(started)
+            yield
+
+    def _build_payload(self, user_prompt: str, system_prompt: str, temperature: float,
+                       response_model: type[BaseModel] = None) -> dict:
+        # Ollama ignores sampling parameters outside of options
+        payload = {
+            "model": self.model,
+            "messages": self._build_messages(user_prompt, system_prompt, response_model),
+            "stream": False,
+            "options": {**self.options, "temperature": temperature}
+        }
+        if response_model is not None and self.structured_output:
+            payload["format"] = json_schema(response_model)
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        return payload
+
+    @staticmethod
+    def _record_generation(result: dict, time_to_first_token: float | None):
+        # Ollama reports durations in nanoseconds
+        load_seconds = result.get("load_duration", 0) / 1e9
+        if time_to_first_token is None:
+            # Not streamed, the server side time until generation started is the closest measure
+            time_to_first_token = load_seconds + result.get("prompt_eval_duration", 0) / 1e9
+        record_llm_usage(result.get("prompt_eval_count"), result.get("eval_count"), priced=False)
+        record_llm_generation(time_to_first_token, result.get("eval_duration", 0) / 1e9,
+                              result.get("eval_count"), load_seconds)
+
+    @staticmethod
+    def _parse_response(response: httpx.Response) -> str:
         if response.status_code != 200:
-            raise Exception(f"Ollama error: {response.status_code} - {response.text}")
+            raise LLMTransportError(
+                f"Ollama error: {response.status_code} - {response.text}", status_code=response.status_code
+            )
 
-        result = response.json()["message"]["content"]
-        return result
+        json_response = response.json()
+        OllamaClient._record_generation(json_response, None)
+        return json_response["message"]["content"]
 
     def _fetch_current_tokens(self) -> int:
         # Override to avoid DynamoDB call
@@ -181,3 +474,10 @@ class OllamaClient(LLMClient):
         # Override to skip any token tracking
         pass
 
+    async def _check_and_update_token_usage_async(self, estimated_tokens: int):
+        pass
+
+
+def _observe_queue_wait(started: float):
+    metrics.observe("chat2db_llm_queue_seconds", time.perf_counter() - started,
+                    "Time generations waited for a free local model slot")
@@ -0,0 +1,265 @@
+import asyncio
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import httpx
+
+from services.metrics import metrics, log_event
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class LLMTransportError(Exception):
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LLMUnavailableError(LLMTransportError):
+    """
+    Raised without calling the API while the circuit breaker is open.
+    """
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failed calls and fails fast for `reset_timeout`
+    seconds, then lets one trial call through (half-open) to decide whether to close again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self) -> bool:
+        """
+        Raises LLMUnavailableError while open, returns True when the call is the half-open trial.
+        """
+        with self._lock:
+            state = self.state
+            if state == "open" or (state == "half-open" and self._trial_running):
+                metrics.inc("chat2db_llm_breaker_rejected_total", 1, "LLM calls rejected by the open circuit breaker")
+                raise LLMUnavailableError("LLM API is unavailable, circuit breaker is open")
+            if state == "half-open":
+                self._trial_running = True
+                return True
+            return False
+
+    @contextmanager
+    def call(self):
+        """
+        Guards one call, including its retries. A trial call that ends without a recorded
+        result (cancelled, timed out or answered 429) counts as failed, otherwise the breaker
+        would wait for its result forever and reject every later call.
+        """
+        trial = self.before_call()
+        try:
+            yield
+        finally:
+            if trial:
+                with self._lock:
+                    trial = self._trial_running
+                if trial:
+                    self.record_failure()
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._trial_running:
+                    log_event("llm_breaker_opened", level="warning", failures=self.failures)
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class LLMTransport:
+    """
+    Sends LLM API requests with a deadline per call, retries, optional hedging and a circuit breaker.
+
+    Each attempt gets at most `attempt_timeout` seconds and the whole call at most `deadline`.
+    429, 5xx and network errors are retried up to `max_retries` times with full-jitter
+    exponential backoff (Retry-After is honoured). With `hedge_after` set, async calls still
+    running after that many seconds (e.g. the p95 latency) get a duplicate request and the
+    first answer wins. A hedged duplicate can spend tokens that are not reported back.
+    """
+
+    def __init__(
+        self,
+        attempt_timeout: float = 60.0,
+        deadline: float = 120.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        hedge_after: float = None,
+        breaker: CircuitBreaker = None,
+        seed: int = None
+    ):
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.breaker = breaker or CircuitBreaker()
+        self._random = random.Random(seed)
+
+    def post(self, client: httpx.Client, url: str, **kwargs) -> httpx.Response:
+        with self.breaker.call():
+            call_deadline = time.monotonic() + self.deadline
+
+            for attempt in range(self.max_retries + 1):
+                timeout = self._attempt_timeout(call_deadline)
+                try:
+                    response = client.post(url, timeout=timeout, **kwargs)
+                except httpx.TransportError as e:
+                    response, error = None, e
+                else:
+                    error = None
+
+                delay = self._retry_delay(response, error, attempt, call_deadline)
+                if delay is None:
+                    return self._finish(response, error)
+                time.sleep(delay)
+
+            raise AssertionError("unreachable")
+
+    async def post_async(self, client: httpx.AsyncClient, url: str, **kwargs) -> httpx.Response:
+        with self.breaker.call():
+            call_deadline = time.monotonic() + self.deadline
+
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response, error = await self._hedged(client, url, call_deadline, kwargs), None
+                except (httpx.TransportError, asyncio.TimeoutError) as e:
+                    response, error = None, e
+
+                delay = self._retry_delay(response, error, attempt, call_deadline)
+                if delay is None:
+                    return self._finish(response, error)
+                await asyncio.sleep(delay)
+
+            raise AssertionError("unreachable")
+
+    async def send_stream_async(self, client: httpx.AsyncClient, url: str, **kwargs) -> httpx.Response:
+        """
+        Opens a streamed response, retrying until the status is known; the caller must aclose() it.
+        Once the body is being read a failure can't be retried without repeating the output.
+        """
+        with self.breaker.call():
+            call_deadline = time.monotonic() + self.deadline
+
+            for attempt in range(self.max_retries + 1):
+                timeout = self._attempt_timeout(call_deadline)
+                request = client.build_request("POST", url, timeout=timeout, **kwargs)
+                try:
+                    response, error = await client.send(request, stream=True), None
+                except httpx.TransportError as e:
+                    response, error = None, e
+
+                if response is not None and response.status_code != 200:
+                    await response.aread()
+                    await response.aclose()
+
+                delay = self._retry_delay(response, error, attempt, call_deadline)
+                if delay is None:
+                    return self._finish(response, error)
+                await asyncio.sleep(delay)
+
+            raise AssertionError("unreachable")
+
+    async def _hedged(self, client: httpx.AsyncClient, url: str, call_deadline: float, kwargs: dict) -> httpx.Response:
+        timeout = self._attempt_timeout(call_deadline)
+
+        async def attempt():
+            return await asyncio.wait_for(client.post(url, timeout=timeout, **kwargs), timeout)
+
+        if not self.hedge_after or self.hedge_after >= timeout:
+            return await attempt()
+
+        primary = asyncio.create_task(attempt())
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_after)
+        if done:
+            return primary.result()
+
+        metrics.inc("chat2db_llm_hedged_total", 1, "Hedged duplicate LLM requests")
+        hedge = asyncio.create_task(attempt())
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code == 200:
+                        return task.result()
+                if not pending:
+                    # Both finished without a usable answer, let the retry logic look at one of them
+                    return await next(iter(done))
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _attempt_timeout(self, call_deadline: float) -> float:
+        remaining = call_deadline - time.monotonic()
+        if remaining <= 0:
+            raise LLMTransportError("LLM call deadline exceeded")
+        return min(self.attempt_timeout, remaining)
+
+    def _retry_delay(self, response: httpx.Response | None, error: Exception | None,
+                     attempt: int, call_deadline: float) -> float | None:
+        """
+        Seconds to wait before the next attempt, None when the result is final.
+        """
+        status_code = response.status_code if response is not None else None
+        if error is None and status_code not in RETRYABLE_STATUS_CODES:
+            return None
+        if attempt >= self.max_retries:
+            return None
+
+        delay = self._random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        if time.monotonic() + delay >= call_deadline:
+            return None
+
+        metrics.inc("chat2db_llm_retries_total", 1, "Retried LLM requests", reason=str(status_code or "network"))
+        log_event("llm_retry", level="warning", attempt=attempt + 1, status_code=status_code,
+                  error=str(error) if error else None, delay=round(delay, 3))
+        return delay
+
+    def _finish(self, response: httpx.Response | None, error: Exception | None) -> httpx.Response:
+        if error is not None:
+            self.breaker.record_failure()
+            raise LLMTransportError(f"LLM API request failed: {error!r}") from error
+        if response.status_code >= 500 or response.status_code in (408, 429):
+            # 429 alone doesn't open the breaker, the API answers it quickly
+            if response.status_code != 429:
+                self.breaker.record_failure()
+            raise LLMTransportError(
+                f"LLM API error: {response.status_code} - {response.text}", status_code=response.status_code
+            )
+        self.breaker.record_success()
+        return response
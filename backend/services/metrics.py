@@ -0,0 +1,229 @@
+import contextvars
+import json
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Label values of the code currently running, set by the request middleware and by stage()
+current_endpoint = contextvars.ContextVar("current_endpoint", default="none")
+current_stage = contextvars.ContextVar("current_stage", default="none")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# USD per 1M tokens, defaults are gpt-4.1-mini prices
+PROMPT_TOKEN_PRICE = float(os.getenv("LLM_PROMPT_TOKEN_PRICE", "0.40"))
+COMPLETION_TOKEN_PRICE = float(os.getenv("LLM_COMPLETION_TOKEN_PRICE", "1.60"))
+# Prompt tokens served from the provider's prompt cache
+CACHED_PROMPT_TOKEN_PRICE = float(os.getenv("LLM_CACHED_PROMPT_TOKEN_PRICE", "0.10"))
+# Share of info events that are logged, warnings and errors are always logged
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+LOG_LEVEL = LOG_LEVELS.get(os.getenv("LOG_LEVEL", "info").lower(), 20)
+
+
+class Metrics:
+    """
+    In-process counters and latency histograms rendered in the Prometheus text format.
+    Each Lambda container or server process reports its own values.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._counters: dict[tuple[str, tuple], float] = {}
+        self._histograms: dict[tuple[str, tuple], list] = {}
+        self._help: dict[str, tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, help_text: str = "", **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ("counter", help_text))
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, help_text: str = "", **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ("histogram", help_text))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # per bucket counts, sum, count
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def value(self, name: str, **labels: str) -> float:
+        return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def totals(self, name: str, label: str) -> dict[str, tuple[float, int]]:
+        """
+        Histogram sum and count of `name` grouped by one label.
+        """
+        grouped: dict[str, tuple[float, int]] = {}
+        with self._lock:
+            for (metric, labels), (_, total, count) in self._histograms.items():
+                if metric != name:
+                    continue
+                value = dict(labels).get(label, "none")
+                previous_total, previous_count = grouped.get(value, (0.0, 0))
+                grouped[value] = (previous_total + total, previous_count + count)
+        return grouped
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, (metric_type, help_text) in sorted(self._help.items()):
+                if help_text:
+                    lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                if metric_type == "counter":
+                    for (metric, labels), value in sorted(self._counters.items()):
+                        if metric == name:
+                            lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                    continue
+                for (metric, labels), (bucket_counts, total, count) in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, bucket_count in zip(self.buckets, bucket_counts):
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {bucket_count}")
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+                    lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._help.clear()
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def span(name: str):
+    """
+    Times a block of work (LLM call, token store call, JSON parse, sqlglot parse...).
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe(
+            "chat2db_span_seconds", time.perf_counter() - start, "Duration of instrumented operations",
+            span=name, stage=current_stage.get(), endpoint=current_endpoint.get()
+        )
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Names the pipeline step (intent, schema, summary, script...) that spans and tokens are attributed to.
+    """
+    token = current_stage.set(name)
+    try:
+        with span(name):
+            yield
+    finally:
+        current_stage.reset(token)
+
+
+async def in_stage(name: str, awaitable):
+    """
+    Awaits inside stage(name), for work started as a separate task.
+    """
+    with stage(name):
+        return await awaitable
+
+
+def record_llm_usage(prompt_tokens: int | None, completion_tokens: int | None, priced: bool = True,
+                     cached_tokens: int | None = None):
+    """
+    Counts the tokens of one LLM call, priced=False for self-hosted models.
+    cached_tokens is the part of prompt_tokens the provider served from its prompt cache,
+    the cache hit rate is chat2db_llm_tokens_total{kind="cached"} / {kind="prompt"}.
+    """
+    labels = {"stage": current_stage.get(), "endpoint": current_endpoint.get()}
+    help_text = "LLM tokens by stage, endpoint and kind"
+    cost = 0.0
+    if prompt_tokens:
+        cached_tokens = min(cached_tokens or 0, prompt_tokens)
+        metrics.inc("chat2db_llm_tokens_total", prompt_tokens, help_text, kind="prompt", **labels)
+        if cached_tokens:
+            metrics.inc("chat2db_llm_tokens_total", cached_tokens, help_text, kind="cached", **labels)
+        cost += ((prompt_tokens - cached_tokens) * PROMPT_TOKEN_PRICE
+                 + cached_tokens * CACHED_PROMPT_TOKEN_PRICE) / 1_000_000
+    if completion_tokens:
+        metrics.inc("chat2db_llm_tokens_total", completion_tokens, help_text, kind="completion", **labels)
+        cost += completion_tokens * COMPLETION_TOKEN_PRICE / 1_000_000
+    metrics.inc("chat2db_llm_calls_total", 1, "LLM calls by stage and endpoint", **labels)
+    if cost and priced:
+        metrics.inc("chat2db_llm_cost_usd_total", cost, "Estimated LLM cost in USD", **labels)
+
+
+def record_llm_generation(time_to_first_token: float | None, generation_seconds: float | None,
+                          completion_tokens: int | None, load_seconds: float | None = None):
+    """
+    Latency profile of one generation of a self-hosted model, load_seconds is the time it took to
+    load the model before generating (close to 0 when it was loaded). Tokens per second is
+    rate(chat2db_llm_tokens_total{kind="completion"}) / rate(chat2db_llm_generation_seconds_sum).
+    """
+    labels = {"stage": current_stage.get(), "endpoint": current_endpoint.get()}
+    if time_to_first_token is not None:
+        metrics.observe("chat2db_llm_time_to_first_token_seconds", time_to_first_token,
+                        "Time until the LLM produced the first token", **labels)
+    if generation_seconds:
+        metrics.observe("chat2db_llm_generation_seconds", generation_seconds,
+                        "Time the LLM spent generating tokens", **labels)
+
+    log_event(
+        "llm_generation",
+        ttft_ms=round(time_to_first_token * 1000, 1) if time_to_first_token is not None else None,
+        tokens=completion_tokens,
+        tokens_per_second=round(completion_tokens / generation_seconds, 1)
+        if completion_tokens and generation_seconds else None,
+        load_ms=round(load_seconds * 1000, 1) if load_seconds else None
+    )
+
+
+def log_event(event: str, level: str = "info", sample_rate: float = None, **fields):
+    """
+    Writes one JSON log line. Info and debug events are sampled with LOG_SAMPLE_RATE.
+    """
+    severity = LOG_LEVELS.get(level, 20)
+    if severity < LOG_LEVEL:
+        return
+    rate = LOG_SAMPLE_RATE if sample_rate is None else sample_rate
+    if severity < LOG_LEVELS["warning"] and rate < 1 and random.random() >= rate:
+        return
+
+    record = {
+        "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        "level": level,
+        "event": event,
+        "endpoint": current_endpoint.get(),
+        "stage": current_stage.get(),
+        **fields,
+    }
+    sys.stdout.write(json.dumps(record, default=str) + "\n")
+    sys.stdout.flush()
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
@@ -0,0 +1,275 @@
+from sqlglot import exp
+
+from models import DbSchema
+from services.ddl_compiler import (
+    DDLCompiler, normalize_dialect, foreign_key_name, foreign_key_constraint, identifier, data_type
+)
+from services.schema_diff import SchemaDiffer
+
+# Dialects with ALTER TABLE ... RENAME CONSTRAINT, the others drop the foreign key and add it again
+# (SQL Server renames with sp_rename)
+RENAMES_CONSTRAINTS = {"postgres", "oracle", "snowflake", "tsql"}
+
+
+class MigrationCompiler:
+    """
+    Migration script from one schema version to the next, without the LLM.
+
+    Tables are matched by table_id (renames come from SchemaDiffer), the columns and
+    foreign keys compared are the ones DDLCompiler would create, so junction tables and
+    relation columns are migrated too. Statements are ordered so they can run top to bottom:
+    drop foreign keys, drop tables, rename tables, alter columns, rename foreign keys, create
+    tables, add foreign keys. Operations the dialect has no ALTER for are reported as notes instead.
+
+    Foreign key constraints are named after their table and column (foreign_key_name). When
+    either is renamed the constraint is renamed too, so the name derived from the previous
+    version is the one in the database when the next migration drops it.
+    """
+
+    @staticmethod
+    def to_sql(previous: DbSchema | None, current: DbSchema, dialect: str = "postgres",
+               pretty: bool = True) -> tuple[str, list[str]]:
+        statements, notes = MigrationCompiler.compile(previous, current, dialect)
+        return DDLCompiler.render(statements, dialect, pretty) if statements else "", notes
+
+    @staticmethod
+    def compile(previous: DbSchema | None, current: DbSchema,
+                dialect: str = "postgres") -> tuple[list[exp.Expression], list[str]]:
+        previous = previous or DbSchema(tables=[], relations=[])
+        is_sqlite = normalize_dialect(dialect) == "sqlite"
+        diff = SchemaDiffer.diff(previous, current)
+        before = DDLCompiler.drafts(previous)
+        after = DDLCompiler.drafts(current)
+        notes: list[str] = []
+
+        # Draft key before -> draft key after, None for dropped tables
+        removed = {table.name.lower() for table in diff.removed_tables}
+        renamed = {change.old_name.lower(): change.name.lower() for change in diff.changed_tables if change.old_name}
+        added = {table.name.lower() for table in diff.added_tables}
+        kept: dict[str, str] = {}
+        for key in before:
+            target = renamed.get(key, key)
+            if key not in removed and target in after and target not in added:
+                kept[key] = target
+        # A generated junction table follows the renames of the tables it links
+        table_keys = {table.name.lower() for table in previous.tables}
+        junction_renames: dict[str, dict[str, str]] = {}
+        for key, draft in before.items():
+            if key in kept or key in table_keys or len(draft.foreign_keys) != 2:
+                continue
+            linked = [kept.get(fk[1].lower()) for fk in draft.foreign_keys]
+            if None not in linked:
+                target = f"{after[linked[0]].name}_{after[linked[1]].name}".lower()
+                if target in after and target not in kept.values():
+                    kept[key] = target
+                    junction_renames[target] = {
+                        fk[0].lower(): new_fk[0] for fk, new_fk in zip(draft.foreign_keys, after[target].foreign_keys)
+                    }
+        created = [key for key in after if key not in kept.values()]
+
+        declared_columns = {table.name.lower(): {column.name.lower() for column in table.columns}
+                            for table in current.tables}
+        for key, target in kept.items():
+            MigrationCompiler._keep_reference_columns(
+                before[key], after[target], kept, declared_columns.get(target, set())
+            )
+
+        column_renames: dict[str, dict[str, str]] = {
+            change.name.lower(): {
+                column.old_name.lower(): column.name for column in change.changed_columns if column.old_name
+            }
+            for change in diff.changed_tables
+        }
+        column_renames.update(junction_renames)
+        for key, target in kept.items():
+            MigrationCompiler._rename_reference_columns(
+                before[key], after[target], kept, column_renames.setdefault(target, {})
+            )
+
+        def after_foreign_keys(key: str) -> set[tuple[str, str, str]]:
+            return {(column.lower(), table.lower(), referenced.lower())
+                    for column, table, referenced in after[key].foreign_keys}
+
+        def before_foreign_keys(key: str) -> dict[tuple[str, str, str], tuple[str, str, str]]:
+            renames = column_renames.get(kept[key], {})
+            foreign_keys = {}
+            for fk in before[key].foreign_keys:
+                column, table, referenced = fk
+                target = kept.get(table.lower())
+                foreign_keys[(renames.get(column.lower(), column).lower(), target or "", referenced.lower())] = fk
+            return foreign_keys
+
+        drop_foreign_keys: list[exp.Expression] = []
+        add_foreign_keys: list[exp.Expression] = []
+        alter_columns: list[exp.Expression] = []
+        rename_foreign_keys: list[exp.Expression] = []
+        for key, target in kept.items():
+            draft, new_draft = before[key], after[target]
+            previous_keys = before_foreign_keys(key)
+            current_keys = after_foreign_keys(target)
+
+            for fk_key, fk in previous_keys.items():
+                if fk_key not in current_keys:
+                    if is_sqlite:
+                        notes.append(f"SQLite can't drop foreign key {foreign_key_name(draft.name, fk[0])}, "
+                                     f"rebuild table {new_draft.name} to remove it")
+                    else:
+                        drop_foreign_keys.append(_alter(draft.name, exp.Drop(
+                            kind="CONSTRAINT", tables=[exp.Table(this=identifier(foreign_key_name(draft.name, fk[0])))]
+                        )))
+
+            alter_columns.extend(MigrationCompiler._alter_columns(
+                draft, new_draft, column_renames.get(target, {}), dialect, notes
+            ))
+
+            for fk in new_draft.foreign_keys:
+                previous_fk = previous_keys.get((fk[0].lower(), fk[1].lower(), fk[2].lower()))
+                if previous_fk is not None:
+                    old_name = foreign_key_name(draft.name, previous_fk[0])
+                    new_name = foreign_key_name(new_draft.name, fk[0])
+                    if old_name == new_name or is_sqlite:
+                        # SQLite constraints can't be dropped by name anyway
+                        continue
+                    if normalize_dialect(dialect) in RENAMES_CONSTRAINTS:
+                        rename_foreign_keys.append(_rename_constraint(new_draft.name, old_name, new_name, dialect))
+                        continue
+                    drop_foreign_keys.append(_alter(draft.name, exp.Drop(
+                        kind="CONSTRAINT", tables=[exp.Table(this=identifier(old_name))]
+                    )))
+                existing_column = any(name.lower() == fk[0].lower() for name, _ in draft.columns) or \
+                    fk[0].lower() in column_renames.get(target, {}).values()
+                if is_sqlite:
+                    if existing_column:
+                        notes.append(f"SQLite can't add foreign key {foreign_key_name(new_draft.name, fk[0])} "
+                                     f"to an existing column, rebuild table {new_draft.name} to add it")
+                    continue
+                add_foreign_keys.append(_alter(new_draft.name, exp.AddConstraint(
+                    expressions=[foreign_key_constraint(new_draft.name, fk)]
+                )))
+
+        # Children before the tables they reference
+        dropped = [draft for draft in reversed(DDLCompiler.order_by_dependencies(before))
+                   if draft.name.lower() not in kept]
+        drop_tables = [exp.Drop(kind="TABLE", exists=True, tables=[exp.Table(this=identifier(draft.name))])
+                       for draft in dropped]
+
+        rename_tables = [
+            _alter(before[key].name, exp.AlterRename(this=exp.Table(this=identifier(after[target].name))))
+            for key, target in kept.items() if before[key].name != after[target].name
+        ]
+
+        create_tables = []
+        for draft in DDLCompiler.order_by_dependencies({key: after[key] for key in created}):
+            # SQLite can only declare foreign keys in CREATE TABLE
+            create_tables.append(DDLCompiler.create_table(draft, draft.foreign_keys if is_sqlite else []))
+            if not is_sqlite:
+                add_foreign_keys.extend(
+                    _alter(draft.name, exp.AddConstraint(expressions=[foreign_key_constraint(draft.name, fk)]))
+                    for fk in draft.foreign_keys
+                )
+
+        return (drop_foreign_keys + drop_tables + rename_tables + alter_columns + rename_foreign_keys
+                + create_tables + add_foreign_keys), notes
+
+    @staticmethod
+    def _keep_reference_columns(draft, new_draft, kept: dict[str, str], declared_columns: set[str]):
+        # A foreign key column the schema declares (user_id) is not recognised as one once the referenced
+        # table is renamed, the compiler would add renamed_id next to it. The existing column keeps the
+        # foreign key instead, pointing to the renamed table
+        for column, table, referenced in draft.foreign_keys:
+            target = kept.get(table.lower())
+            if target is None or target == table.lower() or column.lower() not in declared_columns:
+                continue
+            for index, (new_column, new_table, new_referenced) in enumerate(new_draft.foreign_keys):
+                if (new_table.lower(), new_referenced.lower()) == (target, referenced.lower()) \
+                        and new_column.lower() not in declared_columns:
+                    kept_column = next(name for name, _ in new_draft.columns if name.lower() == column.lower())
+                    new_draft.foreign_keys[index] = (kept_column, new_table, new_referenced)
+                    new_draft.columns = [(name, column_type) for name, column_type in new_draft.columns
+                                         if name.lower() != new_column.lower()]
+                    break
+
+    @staticmethod
+    def _rename_reference_columns(draft, new_draft, kept: dict[str, str], renames: dict[str, str]):
+        # A foreign key column named after a renamed table (user_id -> customer_id) is renamed
+        # along with it instead of dropped and added again
+        before_columns = {name.lower() for name, _ in draft.columns}
+        after_columns = {name.lower() for name, _ in new_draft.columns}
+        for column, table, referenced in draft.foreign_keys:
+            if column.lower() in renames or column.lower() in after_columns:
+                continue
+            for new_column, new_table, new_referenced in new_draft.foreign_keys:
+                if (new_table.lower(), new_referenced.lower()) == (kept.get(table.lower()), referenced.lower()) \
+                        and new_column.lower() not in before_columns \
+                        and new_column.lower() not in (name.lower() for name in renames.values()):
+                    renames[column.lower()] = new_column
+                    break
+
+    @staticmethod
+    def _alter_columns(draft, new_draft, renames: dict[str, str], dialect: str,
+                       notes: list[str]) -> list[exp.Expression]:
+        is_sqlite = normalize_dialect(dialect) == "sqlite"
+        statements = []
+        table = new_draft.name
+        before_columns = {}
+        for name, column_type in draft.columns:
+            new_name = renames.get(name.lower())
+            if new_name is not None and new_name != name:
+                statements.append(_rename_column(table, name, new_name, dialect))
+                name = new_name
+            before_columns[name.lower()] = (name, column_type)
+
+        after_columns = {name.lower(): (name, column_type) for name, column_type in new_draft.columns}
+        foreign_keys = {fk[0].lower(): fk for fk in new_draft.foreign_keys}
+
+        for key, (name, column_type) in before_columns.items():
+            if key not in after_columns:
+                statements.append(_alter(table, exp.Drop(kind="COLUMN", tables=[exp.Column(this=identifier(name))])))
+
+        for key, (name, column_type) in after_columns.items():
+            if key not in before_columns:
+                constraints = []
+                if is_sqlite and key in foreign_keys:
+                    # SQLite accepts a foreign key only inline on a new column
+                    fk = foreign_keys[key]
+                    constraints.append(exp.ColumnConstraint(kind=exp.Reference(
+                        this=exp.Table(this=identifier(fk[1])), expressions=[identifier(fk[2])]
+                    )))
+                statements.append(_alter(table, exp.ColumnDef(
+                    this=identifier(name), kind=data_type(column_type), constraints=constraints
+                )))
+            elif before_columns[key][1].lower() != column_type.lower():
+                if is_sqlite:
+                    notes.append(f"SQLite can't change the type of {table}.{name} to {column_type}, "
+                                 f"rebuild the table to change it")
+                    continue
+                statements.append(_alter(table, exp.AlterColumn(this=identifier(name), dtype=data_type(column_type))))
+
+        primary_key = [renames.get(name.lower(), name).lower() for name in draft.primary_key]
+        if primary_key != [name.lower() for name in new_draft.primary_key]:
+            notes.append(f"Primary key of {table} changed, it is not migrated")
+        return statements
+
+
+def _alter(table_name: str, action: exp.Expression) -> exp.Alter:
+    return exp.Alter(this=exp.Table(this=identifier(table_name)), kind="TABLE", actions=[action])
+
+
+def _rename_column(table_name: str, name: str, new_name: str, dialect: str) -> exp.Expression:
+    if normalize_dialect(dialect) == "tsql":
+        # SQL Server has no RENAME COLUMN and sqlglot renders it as is
+        return exp.Command(this="EXEC", expression=exp.Literal.string(
+            f"sp_rename '{table_name}.{name}', '{new_name}', 'COLUMN'"
+        ))
+    return _alter(table_name, exp.RenameColumn(
+        this=exp.Column(this=identifier(name)), to=exp.Column(this=identifier(new_name))
+    ))
+
+
+def _rename_constraint(table_name: str, name: str, new_name: str, dialect: str) -> exp.Expression:
+    dialect = normalize_dialect(dialect)
+    if dialect == "tsql":
+        return exp.Command(this="EXEC", expression=exp.Literal.string(f"sp_rename '{name}', '{new_name}', 'OBJECT'"))
+    # sqlglot parses RENAME CONSTRAINT only as a command, so it is rendered here
+    table, old, new = (identifier(value).sql(dialect=dialect) for value in (table_name, name, new_name))
+    return exp.Command(this="ALTER", expression=f"TABLE {table} RENAME CONSTRAINT {old} TO {new}")
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from models import DbSchema
+from services.metrics import metrics
+
+
+def schema_fingerprint(schema: DbSchema | None) -> str:
+    """
+    Hash of a schema in its request order. Table, column and relation order all show up in the
+    generated DDL, so schemas that differ only in order get different entries.
+    """
+    if schema is None:
+        return "empty"
+    return _hash(schema.model_dump())
+
+
+def messages_fingerprint(messages: list[dict[str, str]]) -> str:
+    return _hash([{"role": message.get("role", "user"), "content": " ".join(str(message.get("content", "")).split())}
+                  for message in messages])
+
+
+def _hash(value) -> str:
+    canonical = json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU cache with TTL for finished responses (string values).
+
+    Entries live in process memory, so a warm Lambda container or a local server answers
+    repeated requests without calling the LLM again. With `path` set, entries are also
+    written to a SQLite file that survives restarts and is shared between processes. close()
+    only closes the file, it is opened again on the next lookup.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600.0, path: str = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0}
+        # key -> (expires_at, value)
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.path = path
+        self._connection = None
+        if path:
+            self._open()
+
+    @staticmethod
+    def key(namespace: str, *parts: str) -> str:
+        return f"{namespace}:{_hash(parts)}"
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        namespace = key.split(":", 1)[0]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                entry = self._load(key, now)
+                if entry is not None:
+                    self._remember(key, entry)
+            else:
+                self._entries.move_to_end(key)
+
+            counter = "hits" if entry is not None else "misses"
+            self.stats[counter] += 1
+            namespace_stats = self.stats.setdefault(namespace, {"hits": 0, "misses": 0})
+            namespace_stats[counter] += 1
+        metrics.inc("chat2db_cache_requests_total", 1, "Response cache lookups", namespace=namespace, result=counter)
+        return entry[1] if entry is not None else None
+
+    def set(self, key: str, value: str):
+        entry = (time.time() + self.ttl, value)
+        with self._lock:
+            self._remember(key, entry)
+            if self._open() is not None:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, entry[0])
+                )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._open() is not None:
+                self._connection.execute("DELETE FROM response_cache")
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _open(self) -> sqlite3.Connection | None:
+        # caller holds the lock (or is __init__)
+        if self._connection is None and self.path:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+        return self._connection
+
+    def _load(self, key: str, now: float) -> tuple[float, str] | None:
+        # caller holds the lock
+        if self._open() is None:
+            return None
+        row = self._connection.execute(
+            "SELECT expires_at, value FROM response_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[0] <= now:
+            self._connection.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            return None
+        return row[0], row[1]
+
+    def _remember(self, key: str, entry: tuple[float, str]):
+        # caller holds the lock
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
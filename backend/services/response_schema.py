@@ -0,0 +1,43 @@
+import copy
+import functools
+
+from pydantic import BaseModel
+
+
+@functools.lru_cache(maxsize=None)
+def json_schema(model: type[BaseModel]) -> dict:
+    """
+    JSON schema of an answer model, fields named by their aliases.
+    """
+    return model.model_json_schema(by_alias=True)
+
+
+@functools.lru_cache(maxsize=None)
+def strict_json_schema(model: type[BaseModel]) -> dict:
+    """
+    JSON schema in the subset accepted by OpenAI structured outputs in strict mode: every object
+    closed and with all of its properties required (optional fields are already nullable),
+    without titles and defaults.
+    """
+    return _strict(copy.deepcopy(json_schema(model)))
+
+
+def _strict(schema):
+    if isinstance(schema, list):
+        return [_strict(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+
+    strict = {}
+    for key, value in schema.items():
+        if key in ("title", "default"):
+            continue
+        if key in ("properties", "$defs"):
+            # Keys of these are names, not keywords
+            strict[key] = {name: _strict(item) for name, item in value.items()}
+        else:
+            strict[key] = _strict(value)
+    if "properties" in strict:
+        strict["additionalProperties"] = False
+        strict["required"] = list(strict["properties"])
+    return strict
@@ -0,0 +1,159 @@
+import json
+import re
+
+from models import DbSchema, Table, Column, Relation
+
+RELATION_CODES = {
+    "one-to-one": "1:1",
+    "one-to-many": "1:N",
+    "many-to-many": "N:N",
+}
+RELATION_TYPES = {code: relation_type for relation_type, code in RELATION_CODES.items()}
+
+ALIAS_PREFIXES = ("T", "TB", "TBL", "TABLE_")
+
+_SAFE_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_SAFE_TYPE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\([0-9]*\))?$")
+_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|(?<!\S)[1N]:[1N](?!\S)|[^\s,:|"]+|[,:|]')
+
+
+class SchemaCodecError(Exception):
+    pass
+
+
+class SchemaCodec:
+    """
+    Compact, lossless text encoding of DbSchema for prompts.
+
+        T1 users: id int, email varchar
+        T2 orders: id int, user_id int
+        R T1 1:N T2
+
+    Table ids are replaced with short aliases (T1, T2, ...) assigned by table position,
+    `aliases_for` gives the alias -> table_id map needed to decode LLM output.
+    Names or types that are not plain identifiers are written as JSON strings.
+    """
+
+    @staticmethod
+    def aliases_for(schema: DbSchema | None) -> dict[str, str]:
+        if schema is None:
+            return {}
+        table_ids = {table.table_id for table in schema.tables}
+        for prefix in ALIAS_PREFIXES:
+            aliases = {f"{prefix}{index}": table.table_id for index, table in enumerate(schema.tables, start=1)}
+            # Aliases must never be mistaken for a real table_id of another table
+            if not any(alias in table_ids and table_id != alias for alias, table_id in aliases.items()):
+                return aliases
+        raise SchemaCodecError("Can't find table aliases that don't collide with table ids")
+
+    @staticmethod
+    def encode(schema: DbSchema) -> str:
+        aliases = SchemaCodec.aliases_for(schema)
+        alias_by_id = {table_id: alias for alias, table_id in aliases.items()}
+        names_by_id = {table.table_id: table.name for table in schema.tables}
+
+        lines = []
+        for alias, table in zip(aliases, schema.tables):
+            columns = ", ".join(f"{_name(column.name)} {_type(column.type)}" for column in table.columns)
+            lines.append(f"{alias} {_name(table.name)}: {columns}".rstrip())
+
+        for relation in schema.relations:
+            from_table = _endpoint(relation.from_table_id, relation.from_table, alias_by_id, names_by_id)
+            to_table = _endpoint(relation.to_table_id, relation.to_table, alias_by_id, names_by_id)
+            lines.append(f"R {from_table} {RELATION_CODES[relation.type]} {to_table}")
+
+        return "\n".join(lines)
+
+    @staticmethod
+    def decode(text: str, aliases: dict[str, str]) -> DbSchema:
+        tables: list[Table] = []
+        names_by_alias: dict[str, str] = {}
+        relations: list[Relation] = []
+
+        for line_number, line in enumerate(text.splitlines(), start=1):
+            tokens = _TOKEN.findall(line)
+            if not tokens:
+                continue
+            try:
+                if tokens[0] == "R":
+                    relations.append(_decode_relation(tokens, aliases, names_by_alias))
+                else:
+                    table = _decode_table(tokens, aliases)
+                    names_by_alias[tokens[0]] = table.name
+                    tables.append(table)
+            except (IndexError, KeyError, ValueError) as e:
+                raise SchemaCodecError(f"Invalid schema notation in line {line_number}: {line!r} ({e})")
+
+        return DbSchema(tables=tables, relations=relations)
+
+    @staticmethod
+    def resolve_aliases(raw_schema: dict, aliases: dict[str, str]) -> dict:
+        """
+        Replaces aliases the LLM used as table ids with the real table ids, in place.
+        """
+        for table in raw_schema.get("tables", []):
+            if isinstance(table, dict) and table.get("table_id") in aliases:
+                table["table_id"] = aliases[table["table_id"]]
+        for relation in raw_schema.get("relations", []):
+            if not isinstance(relation, dict):
+                continue
+            for key in ("from_table_id", "to_table_id"):
+                if relation.get(key) in aliases:
+                    relation[key] = aliases[relation[key]]
+        return raw_schema
+
+
+def _name(name: str) -> str:
+    return name if _SAFE_NAME.match(name) else json.dumps(name)
+
+
+def _type(column_type: str) -> str:
+    return column_type if _SAFE_TYPE.match(column_type) else json.dumps(column_type)
+
+
+def _endpoint(table_id: str, table_name: str, alias_by_id: dict[str, str], names_by_id: dict[str, str]) -> str:
+    alias = alias_by_id.get(table_id)
+    if alias is not None and names_by_id[table_id] == table_name:
+        return alias
+    # Dangling or stale reference, keep the raw values so decoding stays lossless
+    return f"{json.dumps(table_id)}|{_name(table_name)}"
+
+
+def _token_value(token: str) -> str:
+    return json.loads(token) if token.startswith('"') else token
+
+
+def _decode_table(tokens: list[str], aliases: dict[str, str]) -> Table:
+    alias, name, separator = tokens[0], _token_value(tokens[1]), tokens[2]
+    if separator != ":":
+        raise ValueError("expected ':' after table name")
+
+    columns = []
+    column_tokens = [token for token in tokens[3:] if token != ","]
+    for index in range(0, len(column_tokens), 2):
+        columns.append(Column(
+            name=_token_value(column_tokens[index]),
+            type=_token_value(column_tokens[index + 1])
+        ))
+    return Table(table_id=aliases.get(alias, alias), name=name, columns=columns)
+
+
+def _decode_relation(tokens: list[str], aliases: dict[str, str], names_by_alias: dict[str, str]) -> Relation:
+    from_id, from_name, position = _decode_endpoint(tokens, 1, aliases, names_by_alias)
+    relation_type = RELATION_TYPES[tokens[position]]
+    to_id, to_name, _ = _decode_endpoint(tokens, position + 1, aliases, names_by_alias)
+    return Relation(
+        from_table=from_name,
+        from_table_id=from_id,
+        to_table=to_name,
+        to_table_id=to_id,
+        type=relation_type
+    )
+
+
+def _decode_endpoint(tokens: list[str], position: int, aliases: dict[str, str],
+                     names_by_alias: dict[str, str]) -> tuple[str, str, int]:
+    if position + 1 < len(tokens) and tokens[position + 1] == "|":
+        return _token_value(tokens[position]), _token_value(tokens[position + 2]), position + 3
+    alias = tokens[position]
+    return aliases.get(alias, alias), names_by_alias[alias], position + 1
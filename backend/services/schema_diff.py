@@ -0,0 +1,159 @@
+from models import DbSchema, Table, Relation, SchemaDiff, TableChange, ColumnChange, RelationChange
+
+MAX_LISTED_NAMES = 5
+
+
+class SchemaDiffer:
+    """
+    Structural diff between two DbSchema versions.
+    Tables are matched by table_id, columns by name and relations by the pair of table ids.
+    """
+
+    @staticmethod
+    def diff(previous: DbSchema | None, current: DbSchema) -> SchemaDiff:
+        previous = previous or DbSchema(tables=[], relations=[])
+        previous_tables = {table.table_id: table for table in previous.tables}
+        current_tables = {table.table_id: table for table in current.tables}
+
+        diff = SchemaDiff(
+            added_tables=[table for table in current.tables if table.table_id not in previous_tables],
+            removed_tables=[table for table in previous.tables if table.table_id not in current_tables],
+        )
+
+        for table in current.tables:
+            before = previous_tables.get(table.table_id)
+            if before is not None:
+                change = SchemaDiffer._diff_table(before, table)
+                if change is not None:
+                    diff.changed_tables.append(change)
+
+        SchemaDiffer._diff_relations(previous.relations, current.relations, diff)
+        return diff
+
+    @staticmethod
+    def is_empty(diff: SchemaDiff) -> bool:
+        return not any((diff.added_tables, diff.removed_tables, diff.changed_tables,
+                        diff.added_relations, diff.removed_relations, diff.changed_relations))
+
+    @staticmethod
+    def _diff_table(before: Table, after: Table) -> TableChange | None:
+        before_columns = {column.name: column for column in before.columns}
+        after_columns = {column.name: column for column in after.columns}
+
+        added = [column for column in after.columns if column.name not in before_columns]
+        removed = [column for column in before.columns if column.name not in after_columns]
+        changed = [
+            ColumnChange(name=column.name, old_type=before_columns[column.name].type, new_type=column.type)
+            for column in after.columns
+            if column.name in before_columns and before_columns[column.name].type != column.type
+        ]
+
+        # A column that disappeared and a column of the same type that appeared
+        # at the same position is reported as a rename
+        before_positions = {column.name: index for index, column in enumerate(before.columns)}
+        after_positions = {column.name: index for index, column in enumerate(after.columns)}
+        for old in list(removed):
+            for new in added:
+                if new.type == old.type and after_positions[new.name] == before_positions[old.name]:
+                    changed.append(ColumnChange(name=new.name, old_name=old.name))
+                    removed.remove(old)
+                    added.remove(new)
+                    break
+
+        old_name = before.name if before.name != after.name else None
+        if not (added or removed or changed or old_name):
+            return None
+
+        return TableChange(
+            table_id=after.table_id,
+            name=after.name,
+            old_name=old_name,
+            added_columns=added,
+            removed_columns=removed,
+            changed_columns=changed
+        )
+
+    @staticmethod
+    def _diff_relations(previous: list[Relation], current: list[Relation], diff: SchemaDiff):
+        previous_by_key = {SchemaDiffer._relation_key(relation): relation for relation in previous}
+        current_by_key = {SchemaDiffer._relation_key(relation): relation for relation in current}
+
+        for key, relation in current_by_key.items():
+            before = previous_by_key.get(key)
+            if before is None:
+                diff.added_relations.append(relation)
+            elif (before.type, before.from_table_id) != (relation.type, relation.from_table_id):
+                diff.changed_relations.append(RelationChange(before=before, after=relation))
+
+        diff.removed_relations.extend(
+            relation for key, relation in previous_by_key.items() if key not in current_by_key
+        )
+
+    @staticmethod
+    def _relation_key(relation: Relation) -> tuple[str, str]:
+        return tuple(sorted((relation.from_table_id, relation.to_table_id)))
+
+    @staticmethod
+    def summarize(diff: SchemaDiff, is_first_schema: bool = False) -> str:
+        """
+        Short user-facing description of the diff, replaces the LLM summary call.
+        """
+        if SchemaDiffer.is_empty(diff):
+            return "The schema already matches your request, I didn't need to change anything."
+
+        if is_first_schema and diff.added_tables and not diff.removed_tables:
+            return f"I have created new schema with tables: {_names(t.name for t in diff.added_tables)}."
+
+        sentences = []
+        if diff.added_tables:
+            sentences.append(f"I have added tables: {_names(t.name for t in diff.added_tables)}.")
+        if diff.removed_tables:
+            sentences.append(f"I have removed tables: {_names(t.name for t in diff.removed_tables)}.")
+
+        renamed = [change for change in diff.changed_tables if change.old_name]
+        if renamed:
+            sentences.append(
+                f"I have renamed table{'s' if len(renamed) > 1 else ''} "
+                f"{_names(f'{c.old_name} to {c.name}' for c in renamed)}."
+            )
+
+        updated = [change for change in diff.changed_tables
+                   if change.added_columns or change.removed_columns or change.changed_columns]
+        if len(updated) == 1:
+            sentences.append(f"I have updated the {updated[0].name} table ({_describe_columns(updated[0])}).")
+        elif updated:
+            sentences.append(f"I have updated tables: {_names(change.name for change in updated)}.")
+
+        relation_count = len(diff.added_relations) + len(diff.removed_relations) + len(diff.changed_relations)
+        if diff.added_relations and relation_count == len(diff.added_relations):
+            sentences.append(f"I have added relations: {_names(_relation(r) for r in diff.added_relations)}.")
+        elif relation_count:
+            sentences.append(f"I have updated {relation_count} relation{'s' if relation_count > 1 else ''}.")
+
+        return " ".join(sentences)
+
+
+def _names(names) -> str:
+    names = list(names)
+    if len(names) > MAX_LISTED_NAMES:
+        return f"{', '.join(names[:MAX_LISTED_NAMES])} and {len(names) - MAX_LISTED_NAMES} more"
+    return ", ".join(names)
+
+
+def _relation(relation: Relation) -> str:
+    return f"{relation.from_table} - {relation.to_table} ({relation.type})"
+
+
+def _describe_columns(change: TableChange) -> str:
+    parts = []
+    if change.added_columns:
+        parts.append(f"added {_names(column.name for column in change.added_columns)}")
+    if change.removed_columns:
+        parts.append(f"removed {_names(column.name for column in change.removed_columns)}")
+    renamed = [column for column in change.changed_columns if column.old_name]
+    if renamed:
+        parts.append(f"renamed {_names(f'{c.old_name} to {c.name}' for c in renamed)}")
+    retyped = [column for column in change.changed_columns if column.new_type]
+    if retyped:
+        parts.append(f"changed type of {_names(f'{c.name} to {c.new_type}' for c in retyped)}")
+    return "; ".join(parts)
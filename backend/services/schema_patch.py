@@ -0,0 +1,151 @@
+from pydantic import ValidationError
+from models import DbSchema, Table, Column, Relation, SchemaOperation, SchemaPatch
+from services.json_extract import extract_json
+
+
+class SchemaPatchError(Exception):
+    pass
+
+
+class SchemaPatcher:
+    """
+    Applies edit operations returned by the LLM to the current schema.
+    Operations are keyed by table_id (or its prompt alias), the input schema is never modified.
+    """
+
+    @staticmethod
+    def parse(raw_response: str) -> list[SchemaOperation]:
+        try:
+            return SchemaPatch.model_validate_json(extract_json(raw_response)).operations
+        except ValidationError as e:
+            if any(error["type"] == "json_invalid" for error in e.errors()):
+                raise SchemaPatchError(f"Invalid JSON returned from LLM: {e}")
+            raise SchemaPatchError(f"Wrong patch structure: {e}")
+
+    @staticmethod
+    def apply(current_db_state: DbSchema, operations: list[SchemaOperation],
+              aliases: dict[str, str] = None) -> DbSchema:
+        schema = current_db_state.model_copy(deep=True)
+        tables = {table.table_id: table for table in schema.tables}
+        aliases = aliases or {}
+
+        for operation in operations:
+            operation = operation.model_copy(update={
+                "table_id": aliases.get(operation.table_id, operation.table_id),
+                "to_table_id": aliases.get(operation.to_table_id, operation.to_table_id),
+            })
+            handler = getattr(SchemaPatcher, f"_{operation.op}")
+            handler(schema, tables, operation)
+
+        return schema
+
+    @staticmethod
+    def _table(tables: dict[str, Table], table_id: str) -> Table:
+        table = tables.get(table_id)
+        if table is None:
+            raise SchemaPatchError(f"Unknown table_id: {table_id}")
+        return table
+
+    @staticmethod
+    def _column(table: Table, name: str) -> Column:
+        for column in table.columns:
+            if column.name == name:
+                return column
+        raise SchemaPatchError(f"Column {name} does not exist in table {table.name}")
+
+    @staticmethod
+    def _require(operation: SchemaOperation, *fields: str):
+        missing = [field for field in fields if getattr(operation, field) is None]
+        if missing:
+            raise SchemaPatchError(f"{operation.op} requires: {', '.join(missing)}")
+
+    @staticmethod
+    def _add_table(schema: DbSchema, tables: dict[str, Table], operation: SchemaOperation):
+        SchemaPatcher._require(operation, "name")
+        if operation.table_id in tables:
+            raise SchemaPatchError(f"table_id {operation.table_id} is already used")
+        if any(table.name == operation.name for table in schema.tables):
+            raise SchemaPatchError(f"Table {operation.name} already exists")
+
+        table = Table(table_id=operation.table_id, name=operation.name, columns=operation.columns or [])
+        schema.tables.append(table)
+        tables[table.table_id] = table
+
+    @staticmethod
+    def _drop_table(schema: DbSchema, tables: dict[str, Table], operation: SchemaOperation):
+        table = SchemaPatcher._table(tables, operation.table_id)
+        schema.tables.remove(table)
+        del tables[table.table_id]
+        schema.relations = [
+            relation for relation in schema.relations
+            if table.table_id not in (relation.from_table_id, relation.to_table_id)
+        ]
+
+    @staticmethod
+    def _rename_table(schema: DbSchema, tables: dict[str, Table], operation: SchemaOperation):
+        SchemaPatcher._require(operation, "name")
+        table = SchemaPatcher._table(tables, operation.table_id)
+        table.name = operation.name
+        for relation in schema.relations:
+            if relation.from_table_id == table.table_id:
+                relation.from_table = table.name
+            if relation.to_table_id == table.table_id:
+                relation.to_table = table.name
+
+    @staticmethod
+    def _add_column(schema: DbSchema, tables: dict[str, Table], operation: SchemaOperation):
+        SchemaPatcher._require(operation, "name", "type")
+        table = SchemaPatcher._table(tables, operation.table_id)
+        if any(column.name == operation.name for column in table.columns):
+            raise SchemaPatchError(f"Column {operation.name} already exists in table {table.name}")
+        table.columns.append(Column(name=operation.name, type=operation.type))
+
+    @staticmethod
+    def _drop_column(schema: DbSchema, tables: dict[str, Table], operation: SchemaOperation):
+        SchemaPatcher._require(operation, "name")
+        table = SchemaPatcher._table(tables, operation.table_id)
+        table.columns.remove(SchemaPatcher._column(table, operation.name))
+
+    @staticmethod
+    def _rename_column(schema: DbSchema, tables: dict[str, Table], operation: SchemaOperation):
+        SchemaPatcher._require(operation, "name", "new_name")
+        table = SchemaPatcher._table(tables, operation.table_id)
+        if any(column.name == operation.new_name for column in table.columns):
+            raise SchemaPatchError(f"Column {operation.new_name} already exists in table {table.name}")
+        SchemaPatcher._column(table, operation.name).name = operation.new_name
+
+    @staticmethod
+    def _alter_type(schema: DbSchema, tables: dict[str, Table], operation: SchemaOperation):
+        SchemaPatcher._require(operation, "name", "type")
+        table = SchemaPatcher._table(tables, operation.table_id)
+        SchemaPatcher._column(table, operation.name).type = operation.type
+
+    @staticmethod
+    def _add_relation(schema: DbSchema, tables: dict[str, Table], operation: SchemaOperation):
+        SchemaPatcher._require(operation, "to_table_id", "type")
+        from_table = SchemaPatcher._table(tables, operation.table_id)
+        to_table = SchemaPatcher._table(tables, operation.to_table_id)
+        try:
+            relation = Relation(
+                from_table=from_table.name,
+                from_table_id=from_table.table_id,
+                to_table=to_table.name,
+                to_table_id=to_table.table_id,
+                type=operation.type
+            )
+        except ValidationError as e:
+            raise SchemaPatchError(f"Invalid relation: {e}")
+
+        pair = {from_table.table_id, to_table.table_id}
+        if any({r.from_table_id, r.to_table_id} == pair for r in schema.relations):
+            raise SchemaPatchError(f"Relation between {from_table.name} and {to_table.name} already exists")
+        schema.relations.append(relation)
+
+    @staticmethod
+    def _drop_relation(schema: DbSchema, tables: dict[str, Table], operation: SchemaOperation):
+        SchemaPatcher._require(operation, "to_table_id")
+        pair = {operation.table_id, operation.to_table_id}
+        remaining = [r for r in schema.relations if {r.from_table_id, r.to_table_id} != pair]
+        if len(remaining) == len(schema.relations):
+            raise SchemaPatchError(f"No relation between {operation.table_id} and {operation.to_table_id}")
+        schema.relations = remaining
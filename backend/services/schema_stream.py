@@ -0,0 +1,114 @@
+import json
+
+# Paths (keys of the enclosing containers) of the arrays whose items are emitted
+STREAMED_ARRAYS = {
+    ("schema", "tables"): "table",
+    ("schema", "relations"): "relation",
+}
+
+
+class SchemaStreamParser:
+    """
+    Incremental parser for the streamed `{"schema": {"tables": [...], "relations": [...]}}` response.
+
+    Chunks of LLM output are fed as they arrive. Each table or relation object is returned
+    as soon as its closing brace has been received, without waiting for the whole document.
+    Text around the JSON document (e.g. markdown fences) is ignored. The complete text is
+    kept in `text` so the final response can still be mapped the usual way.
+
+    Each chunk is scanned once. Only the text of the item or string still open is buffered,
+    so a long answer isn't copied again on every chunk.
+    """
+
+    def __init__(self):
+        self._chunks: list[str] = []
+        # Text from offset _buffer_start on, enough to slice out the open item or string
+        self._buffer = ""
+        self._buffer_start = 0
+        self._position = 0
+        # one entry per open container: [kind, key in parent, start offset, expecting key]
+        self._stack: list[list] = []
+        self._pending_key = None
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+        self._finished = False
+
+    def feed(self, chunk: str) -> list[tuple[str, dict]]:
+        """
+        Returns ("table" | "relation", raw object) for every item completed by this chunk.
+        """
+        self._chunks.append(chunk)
+        self._buffer += chunk
+        items = []
+        text, offset = self._buffer, self._buffer_start
+
+        while self._position < offset + len(text) and not self._finished:
+            index = self._position
+            char = text[index - offset]
+            self._position += 1
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    self._end_string(text[self._string_start - offset:index - offset + 1])
+                continue
+
+            if not self._stack and char != "{":
+                # Outside of the document
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = index
+            elif char in "{[":
+                self._stack.append(["object" if char == "{" else "array", self._pending_key, index, char == "{"])
+                self._pending_key = None
+            elif char in "}]":
+                kind, _, start, _ = self._stack.pop()
+                item_kind = self._streamed_item(kind)
+                if item_kind:
+                    items.append((item_kind, json.loads(text[start - offset:index - offset + 1])))
+                self._finished = not self._stack
+            elif char == ",":
+                if self._stack[-1][0] == "object":
+                    self._stack[-1][3] = True
+            elif char == ":":
+                self._stack[-1][3] = False
+
+        self._trim()
+        return items
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def _trim(self):
+        keep = self._position
+        # Items are the objects inside arrays, the outermost open one holds any nested item
+        for parent, entry in zip(self._stack, self._stack[1:]):
+            if parent[0] == "array":
+                keep = min(keep, entry[2])
+                break
+        if self._in_string:
+            keep = min(keep, self._string_start)
+        self._buffer = self._buffer[keep - self._buffer_start:]
+        self._buffer_start = keep
+
+    def _end_string(self, token: str):
+        top = self._stack[-1] if self._stack else None
+        if top is not None and top[0] == "object" and top[3]:
+            self._pending_key = json.loads(token)
+        else:
+            self._pending_key = None
+
+    def _streamed_item(self, kind: str) -> str | None:
+        # The stack no longer holds the closed object, its parent must be one of the streamed arrays
+        if kind != "object" or len(self._stack) < 2 or self._stack[-1][0] != "array":
+            return None
+        path = tuple(entry[1] for entry in self._stack[1:])
+        return STREAMED_ARRAYS.get(path)
@@ -0,0 +1,166 @@
+import re
+import uuid
+from collections import deque
+
+from models import DbSchema, Table, Relation
+
+_WORD = re.compile(r"[a-z0-9]+")
+# Requests about the whole schema need every table in the prompt
+GLOBAL_WORDS = {"all", "every", "each", "whole", "entire", "everything", "everywhere"}
+
+
+class SchemaSubgraph:
+    """
+    Selects the part of a large schema a message is about, so the prompt only carries the
+    tables being edited.
+
+    Tables are matched by name and by column names that are rare across the schema, then
+    extended with their `hops`-hop neighbours through relations (at most `max_tables`).
+    Schemas with fewer than `min_tables` tables, messages that match nothing and messages
+    about the whole schema use the full schema. `merge` puts the LLM result back by table_id.
+    """
+
+    def __init__(self, min_tables: int = 40, hops: int = 1, max_tables: int = 30, rare_column_tables: int = 3):
+        self.min_tables = min_tables
+        self.hops = hops
+        self.max_tables = max_tables
+        self.rare_column_tables = rare_column_tables
+
+    def select(self, schema: DbSchema | None, messages: list[dict[str, str]]) -> DbSchema | None:
+        """
+        Returns the sub-schema relevant to the latest user message, or None to use the full schema.
+        """
+        if schema is None or len(schema.tables) < self.min_tables:
+            return None
+
+        words = _words(_last_user_message(messages))
+        if not words or set(words) & GLOBAL_WORDS:
+            return None
+
+        seeds = self._seed_tables(schema, words)
+        if not seeds:
+            return None
+
+        selected = self._expand(schema, seeds)
+        if len(selected) >= len(schema.tables):
+            return None
+
+        return DbSchema(
+            tables=[table for table in schema.tables if table.table_id in selected],
+            relations=[
+                relation for relation in schema.relations
+                if relation.from_table_id in selected and relation.to_table_id in selected
+            ]
+        )
+
+    def _seed_tables(self, schema: DbSchema, words: list[str]) -> list[str]:
+        text = f" {' '.join(words)} "
+        seeds = [table.table_id for table in schema.tables if _mentions(text, table.name)]
+
+        tables_by_column: dict[str, list[str]] = {}
+        for table in schema.tables:
+            for column in table.columns:
+                tables_by_column.setdefault(column.name.lower(), []).append(table.table_id)
+        for column_name, table_ids in tables_by_column.items():
+            # Common columns like id, name or created_at don't point to a table
+            if len(table_ids) <= self.rare_column_tables and _mentions(text, column_name):
+                seeds.extend(table_id for table_id in table_ids if table_id not in seeds)
+        return seeds
+
+    def _expand(self, schema: DbSchema, seeds: list[str]) -> set[str]:
+        neighbours: dict[str, list[str]] = {table.table_id: [] for table in schema.tables}
+        for relation in schema.relations:
+            if relation.from_table_id in neighbours and relation.to_table_id in neighbours:
+                neighbours[relation.from_table_id].append(relation.to_table_id)
+                neighbours[relation.to_table_id].append(relation.from_table_id)
+
+        # Seeds are always included, neighbours in breadth-first order while they fit
+        selected = set(seeds)
+        queue = deque((table_id, 0) for table_id in seeds)
+        while queue:
+            table_id, distance = queue.popleft()
+            if distance >= self.hops:
+                continue
+            for neighbour in neighbours[table_id]:
+                if neighbour in selected:
+                    continue
+                if len(selected) >= self.max_tables:
+                    return selected
+                selected.add(neighbour)
+                queue.append((neighbour, distance + 1))
+        return selected
+
+    @staticmethod
+    def merge(full: DbSchema, subgraph: DbSchema, updated: DbSchema) -> DbSchema:
+        """
+        Applies the LLM result for the sub-schema to the full schema.
+        Sub-schema tables missing from the result were dropped, tables outside it are kept.
+        """
+        subgraph_ids = {table.table_id for table in subgraph.tables}
+        outside_ids = {table.table_id for table in full.tables} - subgraph_ids
+
+        # The LLM doesn't know the ids of tables outside the sub-schema and may reuse one for a new table
+        renamed_ids = {
+            table.table_id: str(uuid.uuid4()) for table in updated.tables if table.table_id in outside_ids
+        }
+        updated_tables = {}
+        for table in updated.tables:
+            table_id = renamed_ids.get(table.table_id, table.table_id)
+            updated_tables[table_id] = table.model_copy(update={"table_id": table_id})
+
+        tables: list[Table] = []
+        for table in full.tables:
+            if table.table_id not in subgraph_ids:
+                tables.append(table)
+            elif table.table_id in updated_tables:
+                tables.append(updated_tables.pop(table.table_id))
+        tables.extend(updated_tables.values())
+
+        names = {table.table_id: table.name for table in tables}
+        relations: list[Relation] = []
+        candidates = [
+            relation for relation in full.relations
+            if not (relation.from_table_id in subgraph_ids and relation.to_table_id in subgraph_ids)
+        ] + [
+            relation.model_copy(update={
+                "from_table_id": renamed_ids.get(relation.from_table_id, relation.from_table_id),
+                "to_table_id": renamed_ids.get(relation.to_table_id, relation.to_table_id),
+            }) for relation in updated.relations
+        ]
+        for relation in candidates:
+            if relation.from_table_id not in names or relation.to_table_id not in names:
+                continue
+            # Relations crossing the sub-schema border keep up with renamed tables
+            relations.append(relation.model_copy(update={
+                "from_table": names[relation.from_table_id],
+                "to_table": names[relation.to_table_id],
+            }))
+
+        return DbSchema(tables=tables, relations=relations)
+
+
+def _last_user_message(messages: list[dict[str, str]]) -> str:
+    for message in reversed(messages):
+        if message.get("role", "user") == "user":
+            return str(message.get("content", ""))
+    return ""
+
+
+def _words(text: str) -> list[str]:
+    return _WORD.findall(text.lower())
+
+
+def _mentions(text: str, name: str) -> bool:
+    """
+    True if the name (snake_case parts as separate words) is in the text, singular or plural.
+    """
+    words = _words(name)
+    if not words:
+        return False
+    last = words[-1]
+    variants = {last, last[:-1] if last.endswith("s") else last + "s"}
+    if last.endswith("ies"):
+        variants.add(last[:-3] + "y")
+    elif last.endswith("y"):
+        variants.add(last[:-1] + "ies")
+    return any(f" {' '.join(words[:-1] + [variant])} " in text for variant in variants if variant)
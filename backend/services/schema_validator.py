@@ -0,0 +1,187 @@
+from pydantic import ValidationError
+
+from models import DbSchema, Table, Column, Relation, SchemaIssue, SchemaAnswer, VALID_COLUMN_TYPES
+from services.json_extract import extract_json
+
+_VALID_TYPES = frozenset(VALID_COLUMN_TYPES)
+# Listed in the exception message, the rest is only counted
+MESSAGE_ISSUES = 10
+
+
+class SchemaValidationError(ValueError):
+    def __init__(self, issues: list[SchemaIssue]):
+        self.issues = issues
+        errors = [issue.message for issue in issues if issue.level == "error"]
+        message = "; ".join(errors[:MESSAGE_ISSUES])
+        if len(errors) > MESSAGE_ISSUES:
+            message += f" and {len(errors) - MESSAGE_ISSUES} more errors"
+        super().__init__(message)
+
+
+class SchemaValidator:
+    """
+    Maps the schema answer of the LLM to DbSchema and checks it.
+
+    The JSON text is parsed and validated in one model_validate_json call, without building Python
+    dicts first or every model separately. The checks then run in a single pass over id and
+    name indexes: O(tables + columns + relations). Only duplicate table ids reject the schema,
+    relations couldn't tell the tables apart. Everything else is a warning returned with it.
+    """
+
+    @staticmethod
+    def parse(raw_response: str, aliases: dict[str, str] = None) -> tuple[DbSchema, list[SchemaIssue]]:
+        """
+        Parses {"schema": {"tables": [...], "relations": [...]}}, also when the answer wraps it in
+        a code block or prose. Prompt aliases used as table ids
+        are replaced with the real ids, relations with a wrong table id or name are repaired when
+        the other one identifies the table and many-to-many relations listed twice are kept once.
+        Tables and columns defined twice keep their first definition, relations to tables that
+        don't exist are dropped. Raises SchemaValidationError with all issues when there are errors.
+        """
+        try:
+            schema = SchemaAnswer.model_validate_json(extract_json(raw_response)).db_schema
+        except ValidationError as e:
+            raise SchemaValidationError([_structure_issue(error) for error in e.errors()])
+
+        if aliases:
+            SchemaValidator._resolve_aliases(schema, aliases)
+        schema.tables, schema.relations, issues = SchemaValidator._check(schema.tables, schema.relations, repair=True)
+        if any(issue.level == "error" for issue in issues):
+            raise SchemaValidationError(issues)
+        return schema, issues
+
+    @staticmethod
+    def validate(schema: DbSchema) -> list[SchemaIssue]:
+        """
+        Checks a schema without changing it.
+        """
+        return SchemaValidator._check(schema.tables, schema.relations, repair=False)[2]
+
+    @staticmethod
+    def _resolve_aliases(schema: DbSchema, aliases: dict[str, str]):
+        for table in schema.tables:
+            table.table_id = aliases.get(table.table_id, table.table_id)
+        for relation in schema.relations:
+            relation.from_table_id = aliases.get(relation.from_table_id, relation.from_table_id)
+            relation.to_table_id = aliases.get(relation.to_table_id, relation.to_table_id)
+
+    @staticmethod
+    def _check(tables: list[Table], relations: list[Relation],
+               repair: bool) -> tuple[list[Table], list[Relation], list[SchemaIssue]]:
+        issues: list[SchemaIssue] = []
+        checked_tables: list[Table] = []
+        by_id: dict[str, Table] = {}
+        by_name: dict[str, Table] = {}
+
+        for table in tables:
+            name = table.name.lower()
+            if name in by_name:
+                issues.append(SchemaIssue(
+                    level="warning", code="duplicate_table_name", table_id=table.table_id, table=table.name,
+                    message=f"Table {table.name} is defined more than once"
+                ))
+                if repair:
+                    # Relations to the dropped definition are repaired by name to the first one
+                    continue
+            else:
+                by_name[name] = table
+
+            if table.table_id in by_id:
+                issues.append(SchemaIssue(
+                    level="error", code="duplicate_table_id", table_id=table.table_id, table=table.name,
+                    message=f"Tables {by_id[table.table_id].name} and {table.name} have the same table_id {table.table_id}"
+                ))
+            else:
+                by_id[table.table_id] = table
+            checked_tables.append(table)
+
+            if not table.columns:
+                issues.append(SchemaIssue(
+                    level="warning", code="empty_table", table_id=table.table_id, table=table.name,
+                    message=f"Table {table.name} has no columns"
+                ))
+            column_names = set()
+            for column in table.columns:
+                column_name = column.name.lower()
+                if column_name in column_names:
+                    issues.append(SchemaIssue(
+                        level="warning", code="duplicate_column", table_id=table.table_id, table=table.name,
+                        column=column.name, message=f"Column {column.name} is defined more than once in {table.name}"
+                    ))
+                column_names.add(column_name)
+                if column.type not in _VALID_TYPES and column.type.split("(", 1)[0].strip().lower() not in _VALID_TYPES:
+                    issues.append(SchemaIssue(
+                        level="warning", code="unknown_column_type", table_id=table.table_id, table=table.name,
+                        column=column.name, message=f"Column {table.name}.{column.name} has unknown type {column.type}"
+                    ))
+            if repair and len(column_names) < len(table.columns):
+                table.columns = _first_definitions(table.columns)
+
+        checked: list[Relation] = []
+        many_to_many: set[tuple[str, str]] = set()
+        for index, relation in enumerate(relations):
+            from_table = by_id.get(relation.from_table_id) or by_name.get(relation.from_table.lower())
+            to_table = by_id.get(relation.to_table_id) or by_name.get(relation.to_table.lower())
+            if from_table is None or to_table is None:
+                missing = relation.from_table if from_table is None else relation.to_table
+                issues.append(SchemaIssue(
+                    level="warning", code="dangling_relation", relation=index, table=missing,
+                    message=f"Relation {relation.from_table} -> {relation.to_table} refers to missing table {missing}"
+                ))
+                continue
+
+            if (from_table.table_id, from_table.name, to_table.table_id, to_table.name) != (
+                    relation.from_table_id, relation.from_table, relation.to_table_id, relation.to_table):
+                issues.append(SchemaIssue(
+                    level="warning", code="relation_reference_mismatch", relation=index, table=relation.from_table,
+                    message=f"Relation {relation.from_table} -> {relation.to_table} has a table_id "
+                            f"that doesn't match the table name"
+                ))
+                if repair:
+                    relation = Relation(
+                        from_table=from_table.name,
+                        from_table_id=from_table.table_id,
+                        to_table=to_table.name,
+                        to_table_id=to_table.table_id,
+                        type=relation.type
+                    )
+
+            if relation.type == "many-to-many":
+                key = tuple(sorted((from_table.table_id, to_table.table_id)))
+                if key in many_to_many:
+                    issues.append(SchemaIssue(
+                        level="warning", code="duplicate_relation", relation=index, table=relation.from_table,
+                        message=f"Many-to-many relation {relation.from_table} - {relation.to_table} "
+                                f"is defined more than once"
+                    ))
+                    if repair:
+                        continue
+                many_to_many.add(key)
+            checked.append(relation)
+
+        return checked_tables, checked, issues
+
+
+def _first_definitions(columns: list[Column]) -> list[Column]:
+    seen = set()
+    first = []
+    for column in columns:
+        if column.name.lower() not in seen:
+            seen.add(column.name.lower())
+            first.append(column)
+    return first
+
+
+def _structure_issue(error: dict) -> SchemaIssue:
+    if error["type"] == "json_invalid":
+        return SchemaIssue(level="error", code="invalid_json", message=error["ctx"]["error"])
+    return SchemaIssue(level="error", code="structure",
+                       message=f"{_location(error['loc']) or 'answer'}: {error['msg']}")
+
+
+def _location(loc: tuple) -> str:
+    # ("tables", 3, "columns", 0, "type") -> tables[3].columns[0].type
+    path = ""
+    for part in loc:
+        path += f"[{part}]" if isinstance(part, int) else f".{part}" if path else str(part)
+    return path
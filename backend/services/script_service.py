@@ -1,23 +1,235 @@
-import sqlglot
-from sqlglot import ParseError
-from models import DbSchema, ScriptResponse
+import asyncio
+
+from models import DbSchema, ScriptResponse, BatchScriptResponse, MigrationResponse
 from prompts.script_prompts import ScriptPrompts
+from services.json_extract import strip_code_fence
 from services.llm_service import LLMClient
+from services.metrics import span, stage, log_event
+from services.response_cache import ResponseCache, schema_fingerprint
+from services.schema_codec import SchemaCodec
+from services.single_flight import SingleFlight
+
+SYSTEM_PROMPT = "You are an expert in relational databases and SQL."
 
 
 class SQLScriptService:
-    def __init__(self, llm_service: LLMClient):
+    def __init__(self, llm_service: LLMClient, response_cache: ResponseCache = None,
+                 single_flight: SingleFlight = None):
         self.llm_service = llm_service
+        # Identical exports in flight at the same time share one generation
+        self.single_flight = single_flight
+        # Exports of an unchanged diagram are answered from the cache
+        self.response_cache = response_cache
+
+    def generate_sql_script(self, current_db_state: DbSchema, dialect: str, use_llm: bool = False) -> ScriptResponse:
+        if self.single_flight is None:
+            return self._generate_sql_script(current_db_state, dialect, use_llm)
+        return self.single_flight.do(self._request_key(current_db_state, dialect, use_llm),
+                                     lambda: self._generate_sql_script(current_db_state, dialect, use_llm))
+
+    async def generate_sql_script_async(self, current_db_state: DbSchema, dialect: str,
+                                        use_llm: bool = False) -> ScriptResponse:
+        if self.single_flight is None:
+            return await self._generate_sql_script_async(current_db_state, dialect, use_llm)
+        return await self.single_flight.do_async(
+            self._request_key(current_db_state, dialect, use_llm),
+            lambda: self._generate_sql_script_async(current_db_state, dialect, use_llm)
+        )
+
+    def _generate_sql_script(self, current_db_state: DbSchema, dialect: str, use_llm: bool) -> ScriptResponse:
+        cache_key = self._cache_key(current_db_state, dialect, use_llm)
+        cached = self._cached_script(cache_key)
+        if cached:
+            return cached
+
+        if not use_llm:
+            script_response = self._compile_sql_script(current_db_state, dialect)
+        else:
+            with stage("script"):
+                sql_script = self.llm_service.send_prompt(
+                    user_prompt=ScriptPrompts.generate_sql_schema_script_template(
+                        SchemaCodec.encode(current_db_state), dialect
+                    ),
+                    system_prompt=SYSTEM_PROMPT,
+                    temperature=0.2
+                )
+            script_response = self._build_script_response(sql_script, dialect)
+
+        self._cache_script(cache_key, script_response)
+        return script_response
+
+    async def _generate_sql_script_async(self, current_db_state: DbSchema, dialect: str,
+                                         use_llm: bool) -> ScriptResponse:
+        cache_key = self._cache_key(current_db_state, dialect, use_llm)
+        cached = self._cached_script(cache_key)
+        if cached:
+            return cached
+
+        if not use_llm:
+            # Compiling and validating large schemas with sqlglot would block other requests
+            script_response = await asyncio.to_thread(self._compile_sql_script, current_db_state, dialect)
+        else:
+            with stage("script"):
+                sql_script = await self.llm_service.send_prompt_async(
+                    user_prompt=ScriptPrompts.generate_sql_schema_script_template(
+                        SchemaCodec.encode(current_db_state), dialect
+                    ),
+                    system_prompt=SYSTEM_PROMPT,
+                    temperature=0.2
+                )
+            script_response = self._build_script_response(sql_script, dialect)
+
+        self._cache_script(cache_key, script_response)
+        return script_response
+
+    async def generate_sql_scripts_async(self, current_db_state: DbSchema, dialects: list[str],
+                                         use_llm: bool = False) -> BatchScriptResponse:
+        """
+        Scripts for several dialects from at most one generation. The local compiler builds the
+        statements once and renders them per dialect; an LLM script is generated for one dialect
+        and transpiled to the others with sqlglot. Rendering and validation run in worker threads.
+        """
+        dialects = list(dict.fromkeys(dialects))
+        scripts: dict[str, ScriptResponse] = {}
+        for dialect in dialects:
+            cached = self._cached_script(self._cache_key(current_db_state, dialect, use_llm))
+            if cached:
+                scripts[dialect] = cached
+        missing = [dialect for dialect in dialects if dialect not in scripts]
+
+        if missing and use_llm:
+            # A cached LLM script for any of the dialects saves the generation
+            source_dialect = next(iter(scripts), None)
+            if source_dialect is None:
+                source_dialect = missing.pop(0)
+                scripts[source_dialect] = await self.generate_sql_script_async(current_db_state, source_dialect, True)
+            results = await asyncio.gather(*(
+                asyncio.to_thread(self._transpile_sql_script, scripts[source_dialect], source_dialect, dialect)
+                for dialect in missing
+            ))
+        elif missing:
+            results = await self._compile_sql_scripts_async(current_db_state, missing)
+        else:
+            results = []
+
+        for dialect, script_response in zip(missing, results):
+            self._cache_script(self._cache_key(current_db_state, dialect, use_llm), script_response)
+            scripts[dialect] = script_response
+        return BatchScriptResponse(scripts={dialect: scripts[dialect] for dialect in dialects})
+
+    def generate_migration_script(self, previous_db_state: DbSchema | None, current_db_state: DbSchema,
+                                  dialect: str) -> MigrationResponse:
+        """
+        ALTER script from the previous diagram version to the current one, compiled locally.
+        """
+        from services.ddl_compiler import DDLCompilerError
+        from services.migration_compiler import MigrationCompiler
+        try:
+            with stage("migration_compile"):
+                sql_script, notes = MigrationCompiler.to_sql(previous_db_state, current_db_state, dialect)
+        except DDLCompilerError as e:
+            log_event("migration_compile_failed", level="warning", dialect=dialect, error=str(e))
+            return MigrationResponse(sql="", message=f"error in script: {str(e)}")
+
+        if not sql_script:
+            return MigrationResponse(sql="", message="no changes to migrate", notes=notes)
+        return MigrationResponse(sql=sql_script, message="successfully created migration", notes=notes)
+
+    async def generate_migration_script_async(self, previous_db_state: DbSchema | None, current_db_state: DbSchema,
+                                              dialect: str) -> MigrationResponse:
+        # Diffing and rendering large schemas takes long enough to block other requests
+        return await asyncio.to_thread(self.generate_migration_script, previous_db_state, current_db_state, dialect)
+
+    def _cache_key(self, current_db_state: DbSchema, dialect: str, use_llm: bool) -> str | None:
+        if self.response_cache is None:
+            return None
+        return self._request_key(current_db_state, dialect, use_llm)
+
+    @staticmethod
+    def _request_key(current_db_state: DbSchema, dialect: str, use_llm: bool) -> str:
+        return ResponseCache.key("script", schema_fingerprint(current_db_state), dialect.lower(), str(use_llm))
 
-    def generate_sql_script(self, current_db_state: DbSchema, dialect: str)->ScriptResponse:
-        sql_script = self.llm_service.send_prompt(
-            user_prompt=ScriptPrompts.generate_sql_schema_script_template(current_db_state, dialect),
-            system_prompt="You are an expert in relational databases and SQL.",
-            temperature=0.2
+    def _cached_script(self, cache_key: str | None) -> ScriptResponse | None:
+        if cache_key is None:
+            return None
+        cached = self.response_cache.get(cache_key)
+        return ScriptResponse.model_validate_json(cached) if cached else None
+
+    def _cache_script(self, cache_key: str | None, script_response: ScriptResponse):
+        # Failed scripts are not cached, the next attempt may succeed
+        if cache_key is not None and script_response.sql:
+            self.response_cache.set(cache_key, script_response.model_dump_json())
+
+    @staticmethod
+    def _compile_sql_script(current_db_state: DbSchema, dialect: str) -> ScriptResponse:
+        # sqlglot is slow to import, load it on first use instead of at cold start
+        from services.ddl_compiler import DDLCompiler, DDLCompilerError
+        try:
+            with stage("ddl_compile"):
+                sql_script = DDLCompiler.to_sql(current_db_state, dialect)
+        except DDLCompilerError as e:
+            log_event("ddl_compile_failed", level="warning", dialect=dialect, error=str(e))
+            return ScriptResponse(sql="", message=f"error in script: {str(e)}")
+
+        return ScriptResponse(sql=sql_script, message="successfully created script")
+
+    async def _compile_sql_scripts_async(self, current_db_state: DbSchema, dialects: list[str]) -> list[ScriptResponse]:
+        from services.ddl_compiler import DDLCompiler, DDLCompilerError
+        try:
+            with stage("ddl_compile"):
+                statements = await asyncio.to_thread(DDLCompiler.compile_many, current_db_state, dialects)
+        except DDLCompilerError as e:
+            log_event("ddl_compile_failed", level="warning", dialect=",".join(dialects), error=str(e))
+            return [ScriptResponse(sql="", message=f"error in script: {str(e)}") for _ in dialects]
+
+        return await asyncio.gather(*(
+            asyncio.to_thread(self._render_sql_script, statements[dialect], dialect) for dialect in dialects
+        ))
+
+    @staticmethod
+    def _render_sql_script(statements: list, dialect: str) -> ScriptResponse:
+        from services.ddl_compiler import DDLCompiler, DDLCompilerError
+        try:
+            with span("ddl_render"):
+                sql_script = DDLCompiler.render(statements, dialect)
+        except DDLCompilerError as e:
+            log_event("ddl_compile_failed", level="warning", dialect=dialect, error=str(e))
+            return ScriptResponse(sql="", message=f"error in script: {str(e)}")
+
+        return ScriptResponse(sql=sql_script, message="successfully created script")
+
+    def _transpile_sql_script(self, source: ScriptResponse, source_dialect: str, dialect: str) -> ScriptResponse:
+        if not source.sql:
+            # The generation failed, every dialect gets its error
+            return source
+
+        import sqlglot
+        from sqlglot import ErrorLevel
+        from sqlglot.errors import SqlglotError
+        from services.ddl_compiler import normalize_dialect
+        try:
+            with span("sqlglot_transpile"):
+                statements = sqlglot.transpile(
+                    source.sql,
+                    read=normalize_dialect(source_dialect),
+                    write=normalize_dialect(dialect),
+                    pretty=True,
+                    unsupported_level=ErrorLevel.RAISE
+                )
+        except (SqlglotError, ValueError) as e:
+            log_event("transpile_failed", level="warning", dialect=dialect, error=str(e))
+            return ScriptResponse(sql="", message=f"error in script: {str(e)}")
+
+        sql_script = "\n\n".join(f"{statement};" for statement in statements if statement)
+        is_valid, message = self._is_valid_sql(sql_script, dialect)
+        return ScriptResponse(
+            sql=sql_script if is_valid else "",
+            message=message
         )
-        print(sql_script)
-        if sql_script.startswith("```sql") and sql_script.endswith("```"):
-            sql_script = sql_script[7:-3].strip()
+
+    def _build_script_response(self, sql_script: str, dialect: str) -> ScriptResponse:
+        log_event("llm_script", level="debug", dialect=dialect, chars=len(sql_script))
+        sql_script = strip_code_fence(sql_script)
         is_valid, message = self._is_valid_sql(sql_script, dialect)
 
         return ScriptResponse(
@@ -26,11 +238,14 @@ class SQLScriptService:
         )
 
     def _is_valid_sql(self, sql: str, dialect: str = "postgresql") -> tuple[bool, str]:
+        import sqlglot
+        from sqlglot import ParseError
+        from services.ddl_compiler import normalize_dialect
         try:
-            sqlglot.parse(sql, read=dialect)
+            with span("sqlglot_parse"):
+                sqlglot.parse(sql, read=normalize_dialect(dialect))
             return True, f"successfully created script"
         except ParseError as e:
-            print(f"SQL ParseError: {e}")
+            log_event("llm_script_invalid", level="warning", dialect=dialect, error=str(e))
             return False, f"error in script: {str(e)}"
 
-
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+from typing import Awaitable, Callable, TypeVar
+
+from services.metrics import metrics
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent executions with the same key: the first caller runs the work and
+    callers arriving while it is in flight get its result (or exception) instead of starting
+    their own. Nothing is kept once the execution finishes, that is the response cache's job.
+
+    A Lambda container serves one request at a time, so this pays off on a long-running server.
+    """
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.stats = {"executed": 0, "coalesced": 0}
+        self._calls: dict[str, _Call] = {}
+        self._tasks: dict[tuple[asyncio.AbstractEventLoop, str], asyncio.Task] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            self._count_coalesced()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        self.stats["executed"] += 1
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key: str, factory: Callable[[], Awaitable[T]]) -> T:
+        # Tasks belong to one event loop, requests on another loop don't share them
+        task_key = (asyncio.get_running_loop(), key)
+        with self._lock:
+            task = self._tasks.get(task_key)
+            leader = task is None
+            if leader:
+                task = self._tasks[task_key] = asyncio.ensure_future(factory())
+                task.add_done_callback(lambda _: self._forget(task_key))
+        if leader:
+            self.stats["executed"] += 1
+        else:
+            self._count_coalesced()
+        # A disconnecting client must not cancel the work the other callers are waiting for
+        return await asyncio.shield(task)
+
+    def _forget(self, task_key: tuple[asyncio.AbstractEventLoop, str]):
+        with self._lock:
+            self._tasks.pop(task_key, None)
+
+    def _count_coalesced(self):
+        self.stats["coalesced"] += 1
+        metrics.inc("chat2db_coalesced_requests_total", 1,
+                    "Requests answered by an identical request already in flight", operation=self.operation)
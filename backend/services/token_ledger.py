@@ -0,0 +1,337 @@
+import decimal
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from services.metrics import span, log_event
+
+
+class TokenLimitError(Exception):
+    pass
+
+
+def current_year_month() -> str:
+    return datetime.now().strftime("%Y-%m")
+
+
+class TokenStore(ABC):
+    """
+    Persistent monthly token counter shared by all service instances.
+    """
+
+    @abstractmethod
+    def get(self, year_month: str) -> int:
+        pass
+
+    @abstractmethod
+    def reserve(self, year_month: str, tokens: int, token_limit: int) -> int:
+        """
+        Atomically add tokens if the total stays within token_limit, returns the new total.
+        Raises TokenLimitError otherwise.
+        """
+        pass
+
+    @abstractmethod
+    def add(self, year_month: str, tokens: int) -> int:
+        """
+        Unconditionally add tokens (negative values release unused reservations).
+        """
+        pass
+
+
+class DynamoDBTokenStore(TokenStore):
+    def __init__(self, table_name: str = "Chat2dbTokenUsage"):
+        self.table_name = table_name
+        self._table = None
+
+    @property
+    def table(self):
+        # boto3 is imported lazily (slow import) and the resource is built once per process
+        if self._table is None:
+            import boto3
+            self._table = boto3.resource('dynamodb').Table(self.table_name)
+        return self._table
+
+    def get(self, year_month: str) -> int:
+        from botocore.exceptions import ClientError
+        try:
+            response = self.table.get_item(Key={'year_month': year_month})
+            return int(response.get('Item', {}).get('tokens_used', 0))
+        except ClientError as e:
+            log_event("token_store_error", level="error", operation="get_item", error=e.response['Error']['Message'])
+            return 0
+
+    def reserve(self, year_month: str, tokens: int, token_limit: int) -> int:
+        from botocore.exceptions import ClientError
+        try:
+            response = self.table.update_item(
+                Key={'year_month': year_month},
+                UpdateExpression="SET tokens_used = if_not_exists(tokens_used, :zero) + :inc",
+                ConditionExpression="tokens_used <= :limit OR attribute_not_exists(tokens_used)",
+                ExpressionAttributeValues={
+                    ':inc': decimal.Decimal(tokens),
+                    ':limit': decimal.Decimal(token_limit - tokens),
+                    ':zero': decimal.Decimal(0)
+                },
+                ReturnValues="UPDATED_NEW"
+            )
+            return int(response["Attributes"]["tokens_used"])
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                raise TokenLimitError("Token limit exceeded. Please try again later.")
+            raise
+
+    def add(self, year_month: str, tokens: int) -> int:
+        response = self.table.update_item(
+            Key={'year_month': year_month},
+            UpdateExpression="SET tokens_used = if_not_exists(tokens_used, :zero) + :inc",
+            ExpressionAttributeValues={
+                ':inc': decimal.Decimal(tokens),
+                ':zero': decimal.Decimal(0)
+            },
+            ReturnValues="UPDATED_NEW"
+        )
+        return int(response["Attributes"]["tokens_used"])
+
+
+class InMemoryTokenStore(TokenStore):
+    """
+    Process local store for tests and local development.
+    """
+
+    def __init__(self):
+        self.usage: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, year_month: str) -> int:
+        return self.usage.get(year_month, 0)
+
+    def reserve(self, year_month: str, tokens: int, token_limit: int) -> int:
+        with self._lock:
+            used = self.usage.get(year_month, 0)
+            if used > token_limit - tokens:
+                raise TokenLimitError("Token limit exceeded. Please try again later.")
+            self.usage[year_month] = used + tokens
+            return self.usage[year_month]
+
+    def add(self, year_month: str, tokens: int) -> int:
+        with self._lock:
+            self.usage[year_month] = self.usage.get(year_month, 0) + tokens
+            return self.usage[year_month]
+
+
+class SQLiteTokenStore(TokenStore):
+    """
+    File backed store for local development, shared between processes on one machine.
+    """
+
+    def __init__(self, path: str = "token_usage.db"):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS token_usage (year_month TEXT PRIMARY KEY, tokens_used INTEGER NOT NULL)"
+        )
+
+    def get(self, year_month: str) -> int:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT tokens_used FROM token_usage WHERE year_month = ?", (year_month,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def reserve(self, year_month: str, tokens: int, token_limit: int) -> int:
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._ensure_row(year_month)
+                updated = self._connection.execute(
+                    "UPDATE token_usage SET tokens_used = tokens_used + ? "
+                    "WHERE year_month = ? AND tokens_used <= ?",
+                    (tokens, year_month, token_limit - tokens)
+                ).rowcount
+                total = self._total(year_month)
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+        if not updated:
+            raise TokenLimitError("Token limit exceeded. Please try again later.")
+        return total
+
+    def add(self, year_month: str, tokens: int) -> int:
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._ensure_row(year_month)
+                self._connection.execute(
+                    "UPDATE token_usage SET tokens_used = tokens_used + ? WHERE year_month = ?",
+                    (tokens, year_month)
+                )
+                total = self._total(year_month)
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+        return total
+
+    def _ensure_row(self, year_month: str):
+        self._connection.execute(
+            "INSERT OR IGNORE INTO token_usage (year_month, tokens_used) VALUES (?, 0)", (year_month,)
+        )
+
+    def _total(self, year_month: str) -> int:
+        return self._connection.execute(
+            "SELECT tokens_used FROM token_usage WHERE year_month = ?", (year_month,)
+        ).fetchone()[0]
+
+
+class TokenLedger:
+    """
+    Local token accounting on top of a TokenStore.
+
+    Quota is reserved from the store in blocks and spent locally, so most LLM calls don't
+    touch the store at all. Actual usage reported by the API is reconciled against the
+    estimate; overruns are written in batched background flushes. Unused reservations are
+    released on month rollover and on close(), a process that dies without closing can
+    over-count by at most one block. Lambda recycles containers without closing them, keep
+    the block small there.
+
+    close() can be called more than once, the ledger stays usable and starts a new flush
+    thread on the next write.
+    """
+
+    def __init__(
+        self,
+        store: TokenStore,
+        token_limit: int,
+        block_size: int = 20000,
+        flush_threshold: int = 5000,
+        flush_interval: float = 30.0
+    ):
+        self.store = store
+        self.token_limit = token_limit
+        self.block_size = block_size
+        self.flush_threshold = flush_threshold
+        self.flush_interval = flush_interval
+        self.year_month = current_year_month()
+        self.tokens_used = 0
+        self.reserved = 0
+        self.pending = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._executor_lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+
+    def try_charge(self, estimated_tokens: int) -> bool:
+        """
+        Spends from the local reservation only, returns False if the store has to be asked.
+        """
+        with self._lock:
+            self._roll_month()
+            if self.reserved >= estimated_tokens:
+                self.reserved -= estimated_tokens
+                return True
+            return False
+
+    def charge(self, estimated_tokens: int):
+        if self.try_charge(estimated_tokens):
+            return
+
+        with self._lock:
+            year_month = self.year_month
+            missing = estimated_tokens - self.reserved
+        with span("token_store"):
+            try:
+                reserved = max(self.block_size, missing)
+                total = self.store.reserve(year_month, reserved, self.token_limit)
+            except TokenLimitError:
+                # Not enough quota left for a whole block, take only what this call needs
+                reserved = missing
+                total = self.store.reserve(year_month, reserved, self.token_limit)
+
+        with self._lock:
+            self.tokens_used = total
+            if year_month == self.year_month:
+                self.reserved += reserved - estimated_tokens
+            else:
+                # month changed while reserving, the call is billed to the old month
+                self._submit(self._write, year_month, estimated_tokens - reserved)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        """
+        Reconciles the estimate charged before the call with the usage reported by the API.
+        """
+        with self._lock:
+            self._roll_month()
+            delta = actual_tokens - estimated_tokens
+            if delta <= 0:
+                self.reserved -= delta
+            else:
+                covered = min(delta, self.reserved)
+                self.reserved -= covered
+                self.pending += delta - covered
+
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+            if self.pending and (self.pending >= self.flush_threshold or due):
+                self._schedule_flush()
+
+    def flush(self):
+        with self._lock:
+            self._schedule_flush()
+        self._submit(lambda: None).result()
+
+    def close(self):
+        """
+        Writes pending usage and releases the unspent reservation.
+        """
+        with self._lock:
+            amount = self.pending - self.reserved
+            self.pending = self.reserved = 0
+            year_month = self.year_month
+        if amount:
+            self._submit(self._write, year_month, amount)
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _submit(self, fn, *args):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="token-ledger")
+            return self._executor.submit(fn, *args)
+
+    def _schedule_flush(self):
+        # caller holds the lock
+        if self.pending:
+            self._submit(self._write, self.year_month, self.pending)
+            self.pending = 0
+        self._last_flush = time.monotonic()
+
+    def _roll_month(self):
+        # caller holds the lock
+        year_month = current_year_month()
+        if year_month == self.year_month:
+            return
+        amount = self.pending - self.reserved
+        if amount:
+            self._submit(self._write, self.year_month, amount)
+        self.year_month = year_month
+        self.pending = self.reserved = 0
+        self.tokens_used = 0
+
+    def _write(self, year_month: str, tokens: int):
+        try:
+            with span("token_store"):
+                total = self.store.add(year_month, tokens)
+            if year_month == self.year_month:
+                self.tokens_used = total
+            log_event("token_usage_flushed", tokens=tokens, year_month=year_month, tokens_used=total)
+        except Exception as e:
+            log_event("token_usage_flush_failed", level="error", tokens=tokens, error=str(e))
+            with self._lock:
+                if year_month == self.year_month:
+                    self.pending += tokens
@@ -0,0 +1,40 @@
+import functools
+import os
+import sys
+
+ENCODING_NAME = "o200k_base"
+# Pre-baked tiktoken cache shipped with the deployment package, see bake() below
+BAKED_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tiktoken_cache")
+
+
+@functools.lru_cache(maxsize=1)
+def get_encoding():
+    """
+    Loads the tokenizer once per process. tiktoken is imported lazily because it is only
+    needed for the first LLM call. Without a cache tiktoken downloads the BPE file on every
+    Lambda cold start, so a pre-baked cache directory is used when present.
+    """
+    if "TIKTOKEN_CACHE_DIR" not in os.environ and os.path.isdir(BAKED_CACHE_DIR) and os.listdir(BAKED_CACHE_DIR):
+        os.environ["TIKTOKEN_CACHE_DIR"] = BAKED_CACHE_DIR
+
+    import tiktoken
+    return tiktoken.get_encoding(ENCODING_NAME)
+
+
+def count_tokens(*texts: str) -> int:
+    encoding = get_encoding()
+    return sum(len(encoding.encode(text)) for text in texts)
+
+
+def bake(cache_dir: str = BAKED_CACHE_DIR):
+    """
+    Downloads the encoding into cache_dir so it can be shipped with the Lambda package.
+    """
+    os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
+    get_encoding.cache_clear()
+    get_encoding()
+    print(f"Baked {ENCODING_NAME} into {cache_dir}")
+
+
+if __name__ == "__main__":
+    bake(sys.argv[1] if len(sys.argv) > 1 else BAKED_CACHE_DIR)
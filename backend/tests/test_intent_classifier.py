@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+from benchmarks.intent_classifier import load_corpus, schema_with_tables
+from services.intent_classifier import IntentClassifier
+
+CORPUS = load_corpus()
+
+
+def classify(classifier: IntentClassifier, example: dict) -> str | None:
+    result = classifier.classify(
+        [{"role": "user", "content": example["message"]}], schema_with_tables(example["tables"])
+    )
+    return json.loads(result)["was_related"] if result is not None else None
+
+
+def test_no_decision_on_the_corpus_is_wrong():
+    # Messages left to the LLM cost a call, a wrong decision answers the user wrongly
+    classifier = IntentClassifier()
+    wrong = [example["message"] for example in CORPUS
+             if classify(classifier, example) not in (None, example["label"])]
+    assert wrong == []
+
+
+def test_most_messages_are_decided_locally():
+    classifier = IntentClassifier()
+    decided = sum(classify(classifier, example) is not None for example in CORPUS)
+    assert decided / len(CORPUS) >= 0.7
+
+
+@pytest.mark.parametrize("message, tables", [
+    ("is this good?", ["users", "orders", "products"]),
+    ("what is a foreign key?", []),
+    ("thanks, now add a categories table", ["users", "orders", "products"]),
+])
+def test_schema_questions_are_not_rejected(message, tables):
+    example = {"message": message, "tables": tables}
+    assert classify(IntentClassifier(), example) != "no"
@@ -0,0 +1,87 @@
+"""
+Retries, timeouts and the circuit breaker of the LLM transport against the local fake server.
+See benchmarks/transport.py for the timings of the same scenarios.
+"""
+import time
+
+import pytest
+
+from benchmarks.fake_llm_server import FakeLLMServer
+from benchmarks.transport import make_client, SCHEMA_ANSWER
+from services.database_service import DatabaseService
+from services.llm_transport import CircuitBreaker, LLMTransportError, LLMUnavailableError
+
+
+@pytest.fixture
+def server():
+    with FakeLLMServer(default=(200, "hello", 0.0)) as server:
+        yield server
+
+
+@pytest.fixture
+def client(server):
+    client = make_client(server)
+    yield client
+    client.close()
+
+
+def test_5xx_is_retried(server, client):
+    server.plan = [(503, "", 0.0), (503, "", 0.0)]
+    assert client.send_prompt("hi", "system") == "hello"
+    assert len(server.requests) == 3
+
+
+def test_429_is_retried(server, client):
+    server.plan = [(429, "", 0.0)]
+    assert client.send_prompt("hi", "system") == "hello"
+    assert len(server.requests) == 2
+
+
+def test_5xx_until_retries_run_out(server, client):
+    server.plan = [(503, "", 0.0)] * 4
+    with pytest.raises(LLMTransportError) as error:
+        client.send_prompt("hi", "system")
+    assert error.value.status_code == 503
+    assert len(server.requests) == 4
+
+
+def test_4xx_is_not_retried(server, client):
+    server.plan = [(400, "bad request", 0.0)]
+    with pytest.raises(LLMTransportError) as error:
+        client.send_prompt("hi", "system")
+    assert error.value.status_code == 400
+    assert len(server.requests) == 1
+
+
+def test_stalled_attempt_is_retried(server):
+    server.plan = [(200, "late", 3.0)]
+    client = make_client(server, attempt_timeout=0.3)
+    assert client.send_prompt("hi", "system") == "hello"
+    assert len(server.requests) == 2
+    client.close()
+
+
+def test_breaker_opens_and_closes_after_a_successful_trial(server):
+    server.default = (500, "", 0.0)
+    client = make_client(server, max_retries=0, breaker=CircuitBreaker(failure_threshold=3, reset_timeout=0.3))
+    for _ in range(3):
+        with pytest.raises(LLMTransportError):
+            client.send_prompt("hi", "system")
+    assert client.transport.breaker.state == "open"
+
+    with pytest.raises(LLMUnavailableError):
+        client.send_prompt("hi", "system")
+    assert len(server.requests) == 3
+
+    time.sleep(0.3)
+    server.default = (200, "hello", 0.0)
+    assert client.send_prompt("hi", "system") == "hello"
+    assert client.transport.breaker.state == "closed"
+    client.close()
+
+
+def test_unparsable_schema_is_reasked(server, client):
+    server.plan = [(200, "{\"schema\": {\"tables\": [", 0.0), (200, SCHEMA_ANSWER, 0.0)]
+    updated_db = DatabaseService(client)._generate_sql_schema([{"role": "user", "content": "add users"}], "postgres")
+    assert [table.name for table in updated_db.tables] == ["users"]
+    assert len(server.requests) == 2
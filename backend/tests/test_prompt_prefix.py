@@ -0,0 +1,66 @@
+"""
+Prompts of the same kind have to start with a byte-identical prefix, the provider's prompt
+cache matches on it. See benchmarks/prompt_prefix.py for the lengths of the shared prefixes.
+"""
+import os
+
+import pytest
+
+from benchmarks.prompt_prefix import FIRST_TURN, NEXT_TURN, OTHER_CHAT
+from benchmarks.schemas import generate_schema
+from prompts.database_prompts import (
+    DatabasePrompts, SCHEMA_RULES, FULL_SCHEMA_TASK, SCHEMA_PATCH_TASK, INTENT_RULES, SUMMARY_RULES
+)
+from prompts.script_prompts import ScriptPrompts, SCRIPT_RULES
+from services.schema_codec import SchemaCodec
+
+SMALL = SchemaCodec.encode(generate_schema(5))
+LARGE = SchemaCodec.encode(generate_schema(40))
+
+
+@pytest.mark.parametrize("static, prompts", [
+    (SCHEMA_RULES + FULL_SCHEMA_TASK, [
+        DatabasePrompts.generate_sql_schema(FIRST_TURN, "postgresql"),
+        DatabasePrompts.generate_sql_schema(OTHER_CHAT, "mysql", LARGE),
+    ]),
+    (SCHEMA_RULES + SCHEMA_PATCH_TASK, [
+        DatabasePrompts.generate_schema_patch(FIRST_TURN, "postgresql", SMALL),
+        DatabasePrompts.generate_schema_patch(OTHER_CHAT, "sqlite", LARGE),
+    ]),
+    (SCHEMA_RULES, [
+        DatabasePrompts.generate_sql_schema(FIRST_TURN, "postgresql", SMALL),
+        DatabasePrompts.generate_schema_patch(FIRST_TURN, "postgresql", SMALL),
+    ]),
+    (INTENT_RULES, [
+        DatabasePrompts.check_if_generate_schema(FIRST_TURN),
+        DatabasePrompts.check_if_generate_schema(OTHER_CHAT),
+    ]),
+    (SUMMARY_RULES, [
+        DatabasePrompts.get_user_answer_template(None, SMALL, FIRST_TURN),
+        DatabasePrompts.get_user_answer_template(SMALL, LARGE, OTHER_CHAT),
+    ]),
+    (SCRIPT_RULES, [
+        ScriptPrompts.generate_sql_schema_script_template(SMALL, "postgresql"),
+        ScriptPrompts.generate_sql_schema_script_template(LARGE, "tsql"),
+    ]),
+], ids=["schema", "schema patch", "schema and patch", "intent", "summary", "script"])
+def test_prompts_start_with_static_instructions(static, prompts):
+    for prompt in prompts:
+        assert prompt.startswith(static)
+
+
+def test_static_instructions_hold_no_request_data():
+    for static in (SCHEMA_RULES, FULL_SCHEMA_TASK, SCHEMA_PATCH_TASK, INTENT_RULES, SUMMARY_RULES, SCRIPT_RULES):
+        assert FIRST_TURN[0]["content"] not in static
+        assert "postgresql" not in static
+
+
+def test_next_turn_shares_the_conversation_history():
+    first = DatabasePrompts.generate_schema_patch(FIRST_TURN, "postgresql", SMALL)
+    following = DatabasePrompts.generate_schema_patch(NEXT_TURN, "postgresql", LARGE)
+    assert FIRST_TURN[0]["content"] in os.path.commonprefix([first, following])
+
+
+def test_reask_starts_with_the_failed_prompt():
+    full = DatabasePrompts.generate_sql_schema(FIRST_TURN, "postgresql", SMALL)
+    assert DatabasePrompts.fix_invalid_schema(full, "invalid JSON").startswith(full)
@@ -0,0 +1,111 @@
+import pytest
+
+from services import token_ledger
+from services.token_ledger import TokenLedger, InMemoryTokenStore, TokenLimitError
+
+
+@pytest.fixture
+def month(monkeypatch):
+    current = {"value": "2026-01"}
+    monkeypatch.setattr(token_ledger, "current_year_month", lambda: current["value"])
+    return current
+
+
+@pytest.fixture
+def store():
+    return InMemoryTokenStore()
+
+
+def make_ledger(store: InMemoryTokenStore, token_limit: int = 10 ** 6) -> TokenLedger:
+    return TokenLedger(store, token_limit, block_size=1000, flush_threshold=500, flush_interval=3600)
+
+
+def test_charge_reserves_a_block_and_spends_it_locally(month, store):
+    ledger = make_ledger(store)
+    ledger.charge(100)
+    assert store.usage == {"2026-01": 1000}
+    assert ledger.reserved == 900
+
+    assert ledger.try_charge(400)
+    ledger.charge(500)
+    assert store.usage == {"2026-01": 1000}
+    assert ledger.reserved == 0
+    ledger.close()
+
+
+def test_charge_larger_than_a_block_reserves_what_is_missing(month, store):
+    ledger = make_ledger(store)
+    ledger.charge(2500)
+    assert store.usage == {"2026-01": 2500}
+    assert ledger.reserved == 0
+    ledger.close()
+
+
+def test_settle_returns_overestimates_to_the_reservation(month, store):
+    ledger = make_ledger(store)
+    ledger.charge(300)
+    ledger.settle(300, 100)
+    assert ledger.reserved == 900
+    assert ledger.pending == 0
+    ledger.close()
+
+
+def test_settle_spends_the_reservation_before_writing_overruns(month, store):
+    ledger = make_ledger(store)
+    ledger.charge(800)
+    ledger.settle(800, 1000)
+    assert (ledger.reserved, ledger.pending) == (0, 0)
+
+    ledger.settle(0, 300)
+    assert ledger.pending == 300
+    assert store.usage == {"2026-01": 1000}
+
+    # Over the flush threshold the overrun is written in the background
+    ledger.settle(0, 300)
+    ledger.flush()
+    assert ledger.pending == 0
+    assert store.usage == {"2026-01": 1600}
+    ledger.close()
+
+
+def test_close_writes_pending_and_releases_the_reservation(month, store):
+    ledger = make_ledger(store)
+    ledger.charge(100)
+    ledger.settle(100, 100)
+    ledger.close()
+    assert store.usage == {"2026-01": 100}
+
+    ledger.charge(2000)
+    ledger.settle(2000, 2200)
+    ledger.close()
+    ledger.close()
+    assert store.usage == {"2026-01": 2300}
+
+
+def test_month_rollover_releases_the_old_reservation(month, store):
+    ledger = make_ledger(store)
+    ledger.charge(100)
+    ledger.settle(100, 50)
+
+    month["value"] = "2026-02"
+    assert not ledger.try_charge(10)
+    ledger.charge(10)
+    ledger.flush()
+    assert store.usage == {"2026-01": 50, "2026-02": 1000}
+    assert ledger.year_month == "2026-02"
+    assert ledger.reserved == 990
+    ledger.close()
+    assert store.usage == {"2026-01": 50, "2026-02": 10}
+
+
+def test_charge_near_the_limit_reserves_only_what_the_call_needs(month, store):
+    ledger = make_ledger(store, token_limit=1500)
+    ledger.charge(100)
+    ledger.charge(1200)
+    assert store.usage == {"2026-01": 1300}
+    assert ledger.reserved == 0
+
+    with pytest.raises(TokenLimitError):
+        ledger.charge(500)
+    assert store.usage == {"2026-01": 1300}
+    ledger.close()